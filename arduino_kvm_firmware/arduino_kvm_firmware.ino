@@ -1,159 +1,796 @@
 #include <Keyboard.h>
 #include <Mouse.h>
+#include <HID.h>
 
 // ==========================================
 // Arduino KVM Firmware
-// Version: 3.5 (Stable Release)
-// Features: Safety Reset (REL), CMD/Win Map, Full HID Spoofing
+// Version: 4.4
+// Features: Safety Reset (REL), CMD/Win Map, Full HID Spoofing, Binary Protocol v2, Bulk Typing, Reliable Mode, Absolute Pointer,
+//           Link Speed Negotiation, Identify, Motion Smoothing, Horizontal Scroll
 // ==========================================
 // 改进点：
 // 1. 全面支持 KeyDown/KeyUp，完美支持组合键 (Ctrl+C, Alt+Tab, Win+L 等)
 // 2. 映射表覆盖常用功能键
-// 3. 保持高速通信 115200
+// 3. 上电速率 115200，可协商到更高速率 (见第 9 条)
+// 4. 协议 v2: 二进制定长帧 [操作码][负载][CRC8 可选]，与文本指令 "HDR:data\n" 共存
+//    操作码最高位为 1；上位机发送 "V:2,<crc>" 握手，固件原样回复后上位机才会切换到 v2
+// 5. 批量输入文本: "T:<len>:<payload>" 或 v2 帧 [0x88][len][payload]
+//    固件用 Keyboard.write 逐字输入 (Shift 由库按 US 布局自动处理)，完成后回复 "T:<len>"
+//    上位机收到回复才发下一块，因此每块不超过 TYPE_CHUNK_MAX，串口缓冲区不会溢出
+// 6. 可靠模式: "Q:<seq>:<指令>" 或 v2 帧 [0x89][seq][内层帧]
+//    只按序号顺序执行，重复/超前的帧丢弃等待重传；每帧回复累计确认 "A:<最后执行的序号>"
+//    "SEQ:<n>" 设置下一个期望序号 (握手/重新同步)
+// 7. 接收路径不再使用 String (避免 2.5KB RAM 上的堆碎片):
+//    串口数据先搬进环形缓冲区，每次发送 HID 报告后都会再搬一次，防止 64 字节的硬件缓冲溢出；
+//    文本指令在定长字符数组中原地切分，键名表放在 PROGMEM 中二分查找；
+//    每次 loop() 处理缓冲区里所有完整的指令。
+//    溢出次数通过 "STAT:0" 查询，发生溢出时也会主动上报 "O:<次数>" (最多每 100ms 一次)
+// 8. 绝对定位鼠标: 额外注册一个绝对坐标指针 (报告 ID 3，X/Y 0-32767 映射到目标机整个桌面)
+//    "P:<x>,<y>" 或 v2 帧 [0x8A][x:uint16][y:uint16] (小端)，一个包直接定位，没有累计误差
+//    按钮仍由相对鼠标发送 (MD/MU)，拖拽时两者同时生效
+//    "CAP:0" 查询固件能力 -> "CAP:<位掩码>" (bit0 = 绝对定位)；旧固件不回复
+// 9. 速率协商: "B:<速率>" 先用当前速率回复 "B:<速率>"，发送完毕后切换 (不支持的速率回复当前速率，不切换)
+//    切换后 BAUD_CONFIRM_MS 内必须在新速率下收到 "B:0" 确认，否则退回原速率 (链路不可用时不会困在新速率上)
+//    等待确认期间收到的回显指令 "E:<数据>" (原样回复，供上位机统计误码) 会延长确认期限
+//    "B:0" 平时用于查询当前速率；切回上电速率 "B:115200" 立即生效，无需确认
+// 10. 识别: "I:0" -> "I:ArduinoKVM,<固件版本>,<能力位掩码>"，上位机扫描串口时用来确认端口上确实是本固件
+// 11. 平滑位移: "MV:<t>,<dx>,<dy>" 或 v2 帧 [0x8B][t:uint16][dx:int16][dy:int16] (小端)
+//    t 为上位机的毫秒时间戳，dx/dy 为上一个样本以来的总位移 (即这段时间的平均速度)。
+//    固件按上位机时间戳之差 (不受串口和 USB 抖动影响) 把位移均匀分配到之后每 1ms 的 HID 报告中；
+//    下一个样本迟到时按样本速度最多再外推 SMOOTH_EXTRAP_MAX 毫秒，多走的部分由下一个样本扣回，
+//    上位机在位移停止后会再发一个空样本；一直等不到新样本时剩余部分一次补齐，总位移与收到的完全一致。
+//    其他鼠标指令 (M/P/MD/MU/S/SH/REL) 执行前先发出尚未播放的位移，点击位置不受影响。
+//    "CAP:0" 的 bit1 表示支持
+// 12. 水平滚动: "SH:<n>" 或 v2 帧 [0x8C][pan:int8]，n > 0 向右。
+//    Mouse.h 的报告只有垂直滚轮，这里额外注册一个带 AC Pan 的指针 (报告 ID 4)。
+//    触控板的小数滚动由上位机累加，凑满整格才发送 S/SH。"CAP:0" 的 bit2 表示支持
+
+// --- 协议 v2 操作码 (与 arduino_kvm_lib.py 一致) ---
+#define OP_MOUSE_MOVE  0x81  // dx:int8 dy:int8
+#define OP_MOUSE_DOWN  0x82  // button:uint8
+#define OP_MOUSE_UP    0x83  // button:uint8
+#define OP_SCROLL      0x84  // wheel:int8
+#define OP_KEY_DOWN    0x85  // keycode:uint8
+#define OP_KEY_UP      0x86  // keycode:uint8
+#define OP_RELEASE_ALL 0x87  // 无负载
+#define OP_TYPE_TEXT   0x88  // len:uint8 + len 字节文本
+#define OP_SEQ         0x89  // seq:uint8 + 内层帧
+#define OP_MOUSE_ABS   0x8A  // x:uint16 y:uint16 (小端, 0-32767)
+#define OP_MOUSE_VEL   0x8B  // t:uint16 dx:int16 dy:int16 (小端)
+#define OP_HSCROLL     0x8C  // pan:int8
+#define FRAME_INVALID  0xFF
+
+#define TYPE_CHUNK_MAX 48    // 单块文本上限，需小于 Serial1 接收缓冲 (64 字节)
+#define FRAME_MAX      (3 + TYPE_CHUNK_MAX)
+
+#define RX_RING_SIZE   128   // 环形缓冲区大小 (2 的幂)
+#define LINE_MAX       64    // 单条文本指令最大长度
+#define UART_RX_FULL   63    // Serial1.available() 达到该值说明硬件缓冲已满，可能丢字节
+#define OVERFLOW_REPORT_MS 100
+
+#define ABS_REPORT_ID  3     // Mouse.h 占用 1，Keyboard.h 占用 2
+#define ABS_MAX        32767
+#define CAP_ABS_MOUSE  0x01
+#define PAN_REPORT_ID  4
+#define CAP_SMOOTH_MOTION 0x02
+#define CAP_HSCROLL    0x04
+#define CAPABILITIES   (CAP_ABS_MOUSE | CAP_SMOOTH_MOTION | CAP_HSCROLL)
+#define FW_VERSION     "4.4"
+
+#define SMOOTH_TICK_US    1000  // 平滑模式的 HID 报告间隔 (USB 全速轮询 1ms)
+#define SMOOTH_MAX_DT     50    // 样本间隔超过该值 (ms) 视为从静止开始
+#define SMOOTH_START_DT   4     // 从静止开始的第一个样本的播放时长 (ms)
+#define SMOOTH_EXTRAP_MAX 8     // 样本迟到时最多外推的时间 (ms)
+
+#define SERIAL_BAUD     115200UL  // 上电速率
+#define BAUD_CONFIRM_MS 500       // 切换速率后等待确认的时间
+// 可协商的速率: 16MHz 的 ATmega32U4 (U2X) 下 2M/1M/500k/250k 无分频误差，230400 误差约 2%
+const unsigned long BAUD_RATES[] = {230400UL, 250000UL, 500000UL, 1000000UL, 2000000UL};
+
+// --- 绝对定位指针的 HID 报告描述符: 3 个按钮 (始终为 0) + 16 位绝对 X/Y ---
+static const uint8_t ABS_MOUSE_DESCRIPTOR[] PROGMEM = {
+  0x05, 0x01,              // Usage Page (Generic Desktop)
+  0x09, 0x02,              // Usage (Mouse)
+  0xA1, 0x01,              // Collection (Application)
+  0x85, ABS_REPORT_ID,     //   Report ID
+  0x09, 0x01,              //   Usage (Pointer)
+  0xA1, 0x00,              //   Collection (Physical)
+  0x05, 0x09,              //     Usage Page (Button)
+  0x19, 0x01,              //     Usage Minimum (1)
+  0x29, 0x03,              //     Usage Maximum (3)
+  0x15, 0x00,              //     Logical Minimum (0)
+  0x25, 0x01,              //     Logical Maximum (1)
+  0x95, 0x03,              //     Report Count (3)
+  0x75, 0x01,              //     Report Size (1)
+  0x81, 0x02,              //     Input (Data, Var, Abs)
+  0x95, 0x01,              //     Report Count (1)
+  0x75, 0x05,              //     Report Size (5)
+  0x81, 0x03,              //     Input (Const) 补齐 1 字节
+  0x05, 0x01,              //     Usage Page (Generic Desktop)
+  0x09, 0x30,              //     Usage (X)
+  0x09, 0x31,              //     Usage (Y)
+  0x16, 0x00, 0x00,        //     Logical Minimum (0)
+  0x26, 0xFF, 0x7F,        //     Logical Maximum (32767)
+  0x75, 0x10,              //     Report Size (16)
+  0x95, 0x02,              //     Report Count (2)
+  0x81, 0x02,              //     Input (Data, Var, Abs)
+  0xC0,                    //   End Collection
+  0xC0,                    // End Collection
+};
+
+// 与 Mouse.h 一样在全局构造时注册描述符 (必须早于 USB 枚举)
+struct AbsMouse_ {
+  AbsMouse_() {
+    static HIDSubDescriptor node(ABS_MOUSE_DESCRIPTOR, sizeof(ABS_MOUSE_DESCRIPTOR));
+    HID().AppendDescriptor(&node);
+  }
+  void moveTo(unsigned int x, unsigned int y) {
+    if (x > ABS_MAX) x = ABS_MAX;
+    if (y > ABS_MAX) y = ABS_MAX;
+    uint8_t report[5] = {0, (uint8_t)x, (uint8_t)(x >> 8), (uint8_t)y, (uint8_t)(y >> 8)};
+    HID().SendReport(ABS_REPORT_ID, report, sizeof(report));
+  }
+};
+AbsMouse_ AbsMouse;
+
+// --- 水平滚动的 HID 报告描述符: 相对 X/Y (始终为 0，系统据此识别为鼠标) + AC Pan ---
+static const uint8_t PAN_MOUSE_DESCRIPTOR[] PROGMEM = {
+  0x05, 0x01,              // Usage Page (Generic Desktop)
+  0x09, 0x02,              // Usage (Mouse)
+  0xA1, 0x01,              // Collection (Application)
+  0x85, PAN_REPORT_ID,     //   Report ID
+  0x09, 0x01,              //   Usage (Pointer)
+  0xA1, 0x00,              //   Collection (Physical)
+  0x09, 0x30,              //     Usage (X)
+  0x09, 0x31,              //     Usage (Y)
+  0x15, 0x81,              //     Logical Minimum (-127)
+  0x25, 0x7F,              //     Logical Maximum (127)
+  0x75, 0x08,              //     Report Size (8)
+  0x95, 0x02,              //     Report Count (2)
+  0x81, 0x06,              //     Input (Data, Var, Rel)
+  0x05, 0x0C,              //     Usage Page (Consumer)
+  0x0A, 0x38, 0x02,        //     Usage (AC Pan)
+  0x95, 0x01,              //     Report Count (1)
+  0x81, 0x06,              //     Input (Data, Var, Rel)
+  0xC0,                    //   End Collection
+  0xC0,                    // End Collection
+};
+
+struct PanMouse_ {
+  PanMouse_() {
+    static HIDSubDescriptor node(PAN_MOUSE_DESCRIPTOR, sizeof(PAN_MOUSE_DESCRIPTOR));
+    HID().AppendDescriptor(&node);
+  }
+  void pan(signed char n) {
+    uint8_t report[3] = {0, 0, (uint8_t)n};
+    HID().SendReport(PAN_REPORT_ID, report, sizeof(report));
+  }
+};
+PanMouse_ PanMouse;
+
+// --- 特殊键名表 (按名称排序，二分查找；与 arduino_kvm_lib.KEY_CODES 一致) ---
+struct KeyEntry {
+  char name[13];
+  byte code;
+};
+
+const KeyEntry KEY_TABLE[] PROGMEM = {
+  {"alt",          KEY_LEFT_ALT},
+  {"alt_l",        KEY_LEFT_ALT},
+  {"alt_r",        KEY_LEFT_ALT},
+  {"backspace",    KEY_BACKSPACE},
+  {"caps_lock",    KEY_CAPS_LOCK},
+  {"cmd",          KEY_LEFT_GUI},
+  {"cmd_l",        KEY_LEFT_GUI},
+  {"cmd_r",        KEY_LEFT_GUI},
+  {"ctrl",         KEY_LEFT_CTRL},
+  {"ctrl_l",       KEY_LEFT_CTRL},
+  {"ctrl_r",       KEY_LEFT_CTRL},
+  {"delete",       KEY_DELETE},
+  {"down",         KEY_DOWN_ARROW},
+  {"end",          KEY_END},
+  {"enter",        KEY_RETURN},
+  {"esc",          KEY_ESC},
+  {"f1",           KEY_F1},
+  {"f10",          KEY_F10},
+  {"f11",          KEY_F11},
+  {"f12",          KEY_F12},
+  {"f2",           KEY_F2},
+  {"f3",           KEY_F3},
+  {"f4",           KEY_F4},
+  {"f5",           KEY_F5},
+  {"f6",           KEY_F6},
+  {"f7",           KEY_F7},
+  {"f8",           KEY_F8},
+  {"f9",           KEY_F9},
+  {"home",         KEY_HOME},
+  {"insert",       KEY_INSERT},
+  {"left",         KEY_LEFT_ARROW},
+  {"num_lock",     219},         // Num Lock
+  {"page_down",    KEY_PAGE_DOWN},
+  {"page_up",      KEY_PAGE_UP},
+  {"pause",        208},         // Pause (0xD0)
+  {"print_screen", 206},         // Print Screen (0xCE)
+  {"right",        KEY_RIGHT_ARROW},
+  {"scroll_lock",  207},         // Scroll Lock (0xCF)
+  {"shift",        KEY_LEFT_SHIFT},
+  {"shift_l",      KEY_LEFT_SHIFT},
+  {"shift_r",      KEY_LEFT_SHIFT},
+  {"space",        ' '},         // space is just space
+  {"tab",          KEY_TAB},
+  {"up",           KEY_UP_ARROW},
+  {"win",          KEY_LEFT_GUI},
+};
+const byte KEY_TABLE_SIZE = sizeof(KEY_TABLE) / sizeof(KEY_TABLE[0]);
 
 void setup() {
-  Serial1.begin(115200); 
-  
+  Serial1.begin(SERIAL_BAUD);
+
   Mouse.begin();
   Keyboard.begin();
 }
 
-String inputString = "";         
-boolean stringComplete = false;  
+// 环形缓冲区
+byte rxRing[RX_RING_SIZE];
+volatile byte rxHead = 0;  // 写入位置
+byte rxTail = 0;           // 读取位置
+unsigned int rxOverflows = 0;   // 环形缓冲区满而丢弃的字节数
+unsigned int uartSaturated = 0; // 发现硬件缓冲已满的次数
+unsigned int reportedOverflows = 0;
+unsigned long lastOverflowReport = 0;
+
+// 文本指令接收状态
+char lineBuf[LINE_MAX];
+byte lineLen = 0;
+boolean lineDiscard = false; // 超长指令: 丢弃到行尾
+unsigned int parseErrors = 0;
+
+// v2 二进制帧接收状态
+byte frameBuf[FRAME_MAX];
+byte frameLen = 0;
+byte frameNeed = 0;        // 当前帧总长度，0 表示不在帧内
+boolean crcEnabled = false;
+unsigned int crcErrors = 0;
+
+// 可靠模式: 下一个期望的序号
+byte expectedSeq = 0;
+
+// 文本协议 T 指令: 剩余待输入的负载字节数 (收到即输入，无需缓存)
+byte typeRemaining = 0;
+byte typeTotal = 0;
+
+// 速率协商: baudPrev 不为 0 表示刚切换、等待确认，超时退回 baudPrev
+unsigned long serialBaud = SERIAL_BAUD;
+unsigned long baudPrev = 0;
+unsigned long baudSwitchedAt = 0;
+
+// 平滑位移 (速度单位: 1/256 点每毫秒)
+long smoothRemX = 0, smoothRemY = 0;    // 已收到但尚未发出的位移 (外推多走时为负)
+long smoothVelX = 0, smoothVelY = 0;    // 本段的播放速度
+long smoothPredX = 0, smoothPredY = 0;  // 样本本身的速度，外推时使用
+long smoothFracX = 0, smoothFracY = 0;  // 不足 1 点的累计小数
+unsigned int smoothLastT = 0;           // 上一个样本的时间戳
+byte smoothPlay = 0;                    // 本段剩余的播放毫秒数
+byte smoothExtrap = 0;                  // 剩余允许外推的毫秒数
+boolean smoothActive = false;
+unsigned long smoothTickAt = 0;
 
 void loop() {
-  serialEvent(); 
-  if (stringComplete) {
-    inputString.trim(); 
-    parseCommand(inputString);
-    inputString = "";
-    stringComplete = false;
+  pumpSerial();
+  // 处理缓冲区中的所有字节 (可能包含多条指令)
+  while (rxTail != rxHead) {
+    byte c = rxRing[rxTail];
+    rxTail = (rxTail + 1) & (RX_RING_SIZE - 1);
+    consumeByte(c);
+  }
+  reportOverflow();
+  smoothTick();
+  if (baudPrev && millis() - baudSwitchedAt > BAUD_CONFIRM_MS) {
+    setBaud(baudPrev); // 新速率下没有收到确认: 退回原速率
+    baudPrev = 0;
   }
 }
 
-void serialEvent() {
-  while (Serial1.available()) {
-    char inChar = (char)Serial1.read();
-    if (inChar == '\n') {
-      stringComplete = true;
-    } else {
-      inputString += inChar;
+// 回复发送完毕后切换速率；切换前后收到的字节都不可信，接收状态全部清空
+void setBaud(unsigned long rate) {
+  Serial1.flush();
+  Serial1.end();
+  Serial1.begin(rate);
+  serialBaud = rate;
+  rxHead = rxTail = 0;
+  lineLen = 0;
+  lineDiscard = false;
+  frameNeed = 0;
+  typeRemaining = 0;
+}
+
+boolean baudSupported(unsigned long rate) {
+  for (byte i = 0; i < sizeof(BAUD_RATES) / sizeof(BAUD_RATES[0]); i++) {
+    if (BAUD_RATES[i] == rate) return true;
+  }
+  return false;
+}
+
+void sendBaud(unsigned long rate) {
+  Serial1.print("B:");
+  Serial1.print(rate);
+  Serial1.print('\n');
+}
+
+// 把硬件串口缓冲中的数据搬进环形缓冲区；执行耗时的 HID 操作后也会调用
+void pumpSerial() {
+  int avail = Serial1.available();
+  if (avail >= UART_RX_FULL) uartSaturated++;
+  while (avail-- > 0) {
+    byte c = (byte)Serial1.read();
+    byte next = (rxHead + 1) & (RX_RING_SIZE - 1);
+    if (next == rxTail) {
+      rxOverflows++;
+      continue;
     }
+    rxRing[rxHead] = c;
+    rxHead = next;
   }
 }
 
-void parseCommand(String cmd) {
-  int splitIndex = cmd.indexOf(':');
-  if (splitIndex == -1) return;
+void reportOverflow() {
+  unsigned int total = rxOverflows + uartSaturated;
+  if (total == reportedOverflows) return;
+  if (millis() - lastOverflowReport < OVERFLOW_REPORT_MS) return;
+  lastOverflowReport = millis();
+  reportedOverflows = total;
+  Serial1.print("O:");
+  Serial1.print(total);
+  Serial1.print('\n');
+}
 
-  String type = cmd.substring(0, splitIndex);
-  String data = cmd.substring(splitIndex + 1);
+void consumeByte(byte c) {
+  // 二进制帧: 按定长收满，负载中的 '\n' 不作为结束符
+  if (frameNeed) {
+    frameBuf[frameLen++] = c;
+    if (frameLen == 2 && frameBuf[0] == OP_TYPE_TEXT) {
+      // 变长帧: 第二个字节是文本长度
+      if (c > TYPE_CHUNK_MAX) { frameNeed = 0; parseErrors++; return; }
+      frameNeed = 2 + c + (crcEnabled ? 1 : 0);
+    }
+    if (frameLen == 3 && frameBuf[0] == OP_SEQ) {
+      // 带序号的帧: 第三个字节是内层操作码
+      byte inner = framePayloadLength(c);
+      if (inner == FRAME_INVALID || c == OP_SEQ || c == OP_TYPE_TEXT) { frameNeed = 0; parseErrors++; return; }
+      frameNeed = 3 + inner + (crcEnabled ? 1 : 0);
+    }
+    if (frameLen == frameNeed) {
+      handleFrame();
+      frameNeed = 0;
+    }
+    return;
+  }
 
-  // --- 鼠标部分 ---
-  if (type == "M") {
-    int commaIndex = data.indexOf(',');
-    if (commaIndex != -1) {
-      int dx = data.substring(0, commaIndex).toInt();
-      int dy = data.substring(commaIndex + 1).toInt();
-      Mouse.move(dx, dy, 0);
+  // T 指令负载: 按长度接收，负载中的 '\n' 和 ':' 都是普通字符
+  if (typeRemaining) {
+    Keyboard.write(c);
+    pumpSerial();
+    if (--typeRemaining == 0) sendTypeAck(typeTotal);
+    return;
+  }
+
+  if (c >= 0x80 && lineLen == 0 && !lineDiscard) {
+    byte payload = framePayloadLength(c);
+    if (payload == FRAME_INVALID) { parseErrors++; return; } // 未知操作码，丢弃
+    frameBuf[0] = c;
+    frameLen = 1;
+    frameNeed = 1 + payload + (crcEnabled ? 1 : 0);
+    if (frameLen == frameNeed) {
+      handleFrame();
+      frameNeed = 0;
     }
+    return;
   }
-  else if (type == "MD") {
-    if (data == "L") Mouse.press(MOUSE_LEFT);
-    if (data == "R") Mouse.press(MOUSE_RIGHT);
-    if (data == "M") Mouse.press(MOUSE_MIDDLE);
+
+  // 文本指令: 每收到一行立即执行
+  if (c == '\n') {
+    if (!lineDiscard) {
+      // 去掉行尾的 '\r' 和空格
+      while (lineLen > 0 && (lineBuf[lineLen - 1] == '\r' || lineBuf[lineLen - 1] == ' ')) lineLen--;
+      lineBuf[lineLen] = '\0';
+      parseLine(lineBuf);
+    }
+    lineLen = 0;
+    lineDiscard = false;
+    return;
   }
-  else if (type == "MU") {
-    if (data == "L") Mouse.release(MOUSE_LEFT);
-    if (data == "R") Mouse.release(MOUSE_RIGHT);
-    if (data == "M") Mouse.release(MOUSE_MIDDLE);
+  if (lineDiscard) return;
+  if (lineLen >= LINE_MAX - 1) {
+    lineDiscard = true;
+    lineLen = 0;
+    parseErrors++;
+    return;
   }
-  else if (type == "S") {
-    Mouse.move(0, 0, data.toInt());
+  lineBuf[lineLen++] = (char)c;
+
+  // "T:<len>:" 头部收完后切换到按长度接收负载
+  if (c == ':' && lineLen > 2 && lineBuf[0] == 'T' && lineBuf[1] == ':') {
+    lineBuf[lineLen - 1] = '\0';
+    int len = atoi(lineBuf + 2);
+    lineLen = 0;
+    if (len > TYPE_CHUNK_MAX) len = TYPE_CHUNK_MAX;
+    if (len <= 0) {
+      sendTypeAck(0);
+    } else {
+      typeTotal = len;
+      typeRemaining = len;
+    }
   }
-  
-  // --- 键盘部分 (核心改进) ---
-  else if (type == "KD") {
-    pressKey(data);
+}
+
+byte framePayloadLength(byte op) {
+  switch (op) {
+    case OP_MOUSE_MOVE:  return 2;
+    case OP_MOUSE_ABS:   return 4;
+    case OP_MOUSE_VEL:   return 6;
+    case OP_TYPE_TEXT:   return 1; // 长度字节，收到后再按长度扩展
+    case OP_SEQ:         return 2; // 序号 + 内层操作码，收到后再按内层帧扩展
+    case OP_MOUSE_DOWN:
+    case OP_MOUSE_UP:
+    case OP_SCROLL:
+    case OP_HSCROLL:
+    case OP_KEY_DOWN:
+    case OP_KEY_UP:      return 1;
+    case OP_RELEASE_ALL: return 0;
   }
-  else if (type == "KU") {
-    releaseKey(data);
+  return FRAME_INVALID;
+}
+
+// CRC-8 (多项式 0x07, 初值 0)
+byte crc8(const byte *data, byte len) {
+  byte c = 0;
+  for (byte i = 0; i < len; i++) {
+    c ^= data[i];
+    for (byte b = 0; b < 8; b++) {
+      c = (c & 0x80) ? (byte)((c << 1) ^ 0x07) : (byte)(c << 1);
+    }
   }
-  // --- 全局重置 ---
-  else if (type == "REL") {
-     Keyboard.releaseAll();
-     Mouse.release(MOUSE_LEFT);
-     Mouse.release(MOUSE_RIGHT);
-     Mouse.release(MOUSE_MIDDLE);
+  return c;
+}
+
+void handleFrame() {
+  if (crcEnabled) {
+    if (crc8(frameBuf, frameLen - 1) != frameBuf[frameLen - 1]) {
+      crcErrors++;
+      return;
+    }
   }
+  executeFrame(frameBuf);
 }
 
-// 解析键值或字符
-void pressKey(String k) {
-  if (k.length() == 1) {
-    Keyboard.press(k.charAt(0));
-  } else {
-    int code = getSpecialKeyCode(k);
-    if (code != 0) Keyboard.press(code);
+void executeFrame(const byte *f) {
+  switch (f[0]) {
+    case OP_MOUSE_MOVE:
+    case OP_MOUSE_ABS:
+    case OP_MOUSE_DOWN:
+    case OP_MOUSE_UP:
+    case OP_SCROLL:
+    case OP_HSCROLL:
+    case OP_RELEASE_ALL:
+      flushMotion(); // 先发出平滑模式尚未播放的位移
   }
+  switch (f[0]) {
+    case OP_MOUSE_VEL:
+      smoothSample(f[1] | ((unsigned int)f[2] << 8),
+                   (int)(f[3] | ((unsigned int)f[4] << 8)), (int)(f[5] | ((unsigned int)f[6] << 8)));
+      break;
+    case OP_MOUSE_MOVE:
+      Mouse.move((signed char)f[1], (signed char)f[2], 0);
+      break;
+    case OP_MOUSE_ABS:
+      AbsMouse.moveTo(f[1] | (f[2] << 8), f[3] | (f[4] << 8));
+      break;
+    case OP_MOUSE_DOWN:
+      Mouse.press(f[1]);
+      break;
+    case OP_MOUSE_UP:
+      Mouse.release(f[1]);
+      break;
+    case OP_SCROLL:
+      Mouse.move(0, 0, (signed char)f[1]);
+      break;
+    case OP_HSCROLL:
+      PanMouse.pan((signed char)f[1]);
+      break;
+    case OP_KEY_DOWN:
+      Keyboard.press(f[1]);
+      break;
+    case OP_KEY_UP:
+      Keyboard.release(f[1]);
+      break;
+    case OP_RELEASE_ALL:
+      releaseAll();
+      break;
+    case OP_TYPE_TEXT:
+      typeChunk(f + 2, f[1]);
+      break;
+    case OP_SEQ:
+      if (acceptSeq(f[1])) executeFrame(f + 2);
+      sendAck();
+      break;
+  }
+  pumpSerial(); // 发送 HID 报告期间串口可能已收到新数据
+}
+
+// 只接受期望的下一个序号；重复的 (重传) 或超前的 (中间有丢失) 都不执行
+boolean acceptSeq(byte seq) {
+  if (seq != expectedSeq) return false;
+  expectedSeq++;
+  return true;
+}
+
+void sendAck() {
+  Serial1.print("A:");
+  Serial1.print((byte)(expectedSeq - 1));
+  Serial1.print('\n');
+}
+
+// 逐字输入一块文本，完成后回复确认 (流控)
+void typeChunk(const byte *buf, byte len) {
+  for (byte i = 0; i < len; i++) {
+    Keyboard.write(buf[i]);
+    pumpSerial();
+  }
+  sendTypeAck(len);
 }
 
-void releaseKey(String k) {
-  if (k.length() == 1) {
-    Keyboard.release(k.charAt(0));
+void sendTypeAck(byte len) {
+  Serial1.print("T:");
+  Serial1.print(len);
+  Serial1.print('\n');
+}
+
+// 收到一个位移样本: 连同尚未播放完的部分在接下来的 dt 毫秒内均匀发出
+void smoothSample(unsigned int t, int dx, int dy) {
+  unsigned int dt = t - smoothLastT; // 上位机时间戳之差
+  smoothLastT = t;
+  if (dt == 0) dt = 1;
+  if (dt > SMOOTH_MAX_DT || !smoothActive) dt = SMOOTH_START_DT; // 从静止开始: 不按停顿的时长播放
+  smoothRemX += dx;
+  smoothRemY += dy;
+  smoothVelX = smoothRemX * 256 / (long)dt;
+  smoothVelY = smoothRemY * 256 / (long)dt;
+  smoothPredX = (long)dx * 256 / (long)dt;
+  smoothPredY = (long)dy * 256 / (long)dt;
+  smoothPlay = dt;
+  smoothExtrap = (dx || dy) ? min(dt, (unsigned int)SMOOTH_EXTRAP_MAX) : 0; // 空样本 (已停止) 不外推
+  if (!smoothActive) {
+    smoothActive = true;
+    smoothTickAt = micros();
+  }
+}
+
+// 每毫秒发出一个 HID 报告
+void smoothTick() {
+  if (!smoothActive) return;
+  unsigned long now = micros();
+  if (now - smoothTickAt < SMOOTH_TICK_US) return;
+  smoothTickAt += SMOOTH_TICK_US;
+  if (now - smoothTickAt >= SMOOTH_TICK_US) smoothTickAt = now; // 落后太多 (例如正在输入文本) 不补发
+  long vx, vy;
+  if (smoothPlay) {
+    vx = smoothVelX;
+    vy = smoothVelY;
+    smoothPlay--;
+  } else if (smoothExtrap) {
+    vx = smoothPredX;
+    vy = smoothPredY;
+    smoothExtrap--;
   } else {
-    int code = getSpecialKeyCode(k);
+    flushMotion(); // 等不到新样本: 取整余数或外推多走的部分一次补齐
+    return;
+  }
+  smoothFracX += vx;
+  smoothFracY += vy;
+  long nx = constrain(smoothFracX / 256, -127L, 127L);
+  long ny = constrain(smoothFracY / 256, -127L, 127L);
+  smoothFracX = constrain(smoothFracX - nx * 256, -255L, 255L);
+  smoothFracY = constrain(smoothFracY - ny * 256, -255L, 255L);
+  smoothRemX -= nx;
+  smoothRemY -= ny;
+  if (nx || ny) Mouse.move(nx, ny, 0);
+}
+
+// 立即发出所有尚未播放的位移 (其他鼠标指令之前调用)
+void flushMotion() {
+  if (!smoothActive) return;
+  while (smoothRemX || smoothRemY) {
+    long nx = constrain(smoothRemX, -127L, 127L);
+    long ny = constrain(smoothRemY, -127L, 127L);
+    Mouse.move(nx, ny, 0);
+    smoothRemX -= nx;
+    smoothRemY -= ny;
+  }
+  smoothFracX = smoothFracY = 0;
+  smoothPlay = smoothExtrap = 0;
+  smoothActive = false;
+}
+
+void releaseAll() {
+  Keyboard.releaseAll();
+  Mouse.release(MOUSE_LEFT);
+  Mouse.release(MOUSE_RIGHT);
+  Mouse.release(MOUSE_MIDDLE);
+}
+
+byte mouseButton(const char *data) {
+  if (data[0] == '\0' || data[1] != '\0') return 0;
+  if (data[0] == 'L') return MOUSE_LEFT;
+  if (data[0] == 'R') return MOUSE_RIGHT;
+  if (data[0] == 'M') return MOUSE_MIDDLE;
+  return 0;
+}
+
+// 原地切分 "HDR:data" 并执行
+void parseLine(char *cmd) {
+  char *data = strchr(cmd, ':');
+  if (data == NULL) return;
+  *data++ = '\0';
+  const char *type = cmd;
+
+  if (strcmp(type, "M") == 0 || strcmp(type, "P") == 0 || strcmp(type, "MD") == 0 ||
+      strcmp(type, "MU") == 0 || strcmp(type, "S") == 0 || strcmp(type, "SH") == 0 ||
+      strcmp(type, "REL") == 0) {
+    flushMotion(); // 先发出平滑模式尚未播放的位移
+  }
+
+  // --- 鼠标部分 ---
+  if (strcmp(type, "M") == 0) {
+    char *comma = strchr(data, ',');
+    if (comma != NULL) {
+      int dx = atoi(data);
+      int dy = atoi(comma + 1);
+      Mouse.move(dx, dy, 0);
+    }
+  }
+  else if (strcmp(type, "MV") == 0) {
+    char *c1 = strchr(data, ',');
+    char *c2 = c1 ? strchr(c1 + 1, ',') : NULL;
+    if (c2 != NULL) smoothSample((unsigned int)atol(data), atoi(c1 + 1), atoi(c2 + 1));
+  }
+  else if (strcmp(type, "P") == 0) {
+    char *comma = strchr(data, ',');
+    if (comma != NULL) {
+      long x = constrain(atol(data), 0L, (long)ABS_MAX);
+      long y = constrain(atol(comma + 1), 0L, (long)ABS_MAX);
+      AbsMouse.moveTo(x, y);
+    }
+  }
+  else if (strcmp(type, "MD") == 0) {
+    byte b = mouseButton(data);
+    if (b) Mouse.press(b);
+  }
+  else if (strcmp(type, "MU") == 0) {
+    byte b = mouseButton(data);
+    if (b) Mouse.release(b);
+  }
+  else if (strcmp(type, "S") == 0) {
+    Mouse.move(0, 0, atoi(data));
+  }
+  else if (strcmp(type, "SH") == 0) {
+    PanMouse.pan(atoi(data));
+  }
+
+  // --- 键盘部分 (核心改进) ---
+  else if (strcmp(type, "KD") == 0) {
+    byte code = keyCode(data);
+    if (code != 0) Keyboard.press(code);
+  }
+  else if (strcmp(type, "KU") == 0) {
+    byte code = keyCode(data);
     if (code != 0) Keyboard.release(code);
   }
+  // --- 全局重置 ---
+  else if (strcmp(type, "REL") == 0) {
+     releaseAll();
+  }
+  // --- 可靠模式: Q:<seq>:<指令> ---
+  else if (strcmp(type, "Q") == 0) {
+    char *inner = strchr(data, ':');
+    if (inner == NULL) return;
+    *inner++ = '\0';
+    if (acceptSeq((byte)atoi(data))) {
+      parseLine(inner);
+    }
+    sendAck();
+    return;
+  }
+  else if (strcmp(type, "SEQ") == 0) {
+    expectedSeq = (byte)atoi(data);
+    sendAck();
+    return;
+  }
+  // --- 协议握手: V:<版本>,<crc> ---
+  else if (strcmp(type, "V") == 0) {
+    if (data[0] == '2' && data[1] == ',') {
+      crcEnabled = (strcmp(data + 2, "1") == 0);
+      Serial1.print("V:");
+      Serial1.print(data);
+      Serial1.print('\n');
+    }
+    return;
+  }
+  // --- 链路统计: STAT:0 -> STAT:<环形缓冲溢出>,<硬件缓冲满>,<CRC 错误>,<解析错误> ---
+  else if (strcmp(type, "STAT") == 0) {
+    Serial1.print("STAT:");
+    Serial1.print(rxOverflows);
+    Serial1.print(',');
+    Serial1.print(uartSaturated);
+    Serial1.print(',');
+    Serial1.print(crcErrors);
+    Serial1.print(',');
+    Serial1.print(parseErrors);
+    Serial1.print('\n');
+    return;
+  }
+  // --- 速率协商: B:<速率> 切换 / B:0 查询或确认 ---
+  else if (strcmp(type, "B") == 0) {
+    unsigned long rate = strtoul(data, NULL, 10);
+    if (rate == 0) {
+      baudPrev = 0;          // 新速率下能收到完整的指令，确认切换
+      sendBaud(serialBaud);
+    } else if (rate == SERIAL_BAUD) {
+      sendBaud(rate);
+      setBaud(rate);         // 上电速率总是可用，不需要确认
+      baudPrev = 0;
+    } else if (baudSupported(rate)) {
+      unsigned long prev = baudPrev ? baudPrev : serialBaud;
+      sendBaud(rate);
+      setBaud(rate);
+      baudPrev = prev;
+      baudSwitchedAt = millis();
+    } else {
+      sendBaud(serialBaud);  // 不支持: 回复当前速率，不切换
+    }
+    return;
+  }
+  // --- 回显: E:<数据> -> E:<数据> (速率协商时统计误码) ---
+  else if (strcmp(type, "E") == 0) {
+    if (baudPrev) baudSwitchedAt = millis();
+    Serial1.print("E:");
+    Serial1.print(data);
+    Serial1.print('\n');
+    return;
+  }
+  // --- 识别: I:0 -> I:ArduinoKVM,<版本>,<能力> ---
+  else if (strcmp(type, "I") == 0) {
+    Serial1.print("I:ArduinoKVM," FW_VERSION ",");
+    Serial1.print(CAPABILITIES);
+    Serial1.print('\n');
+    return;
+  }
+  // --- 能力查询: CAP:0 -> CAP:<位掩码> ---
+  else if (strcmp(type, "CAP") == 0) {
+    Serial1.print("CAP:");
+    Serial1.print(CAPABILITIES);
+    Serial1.print('\n');
+    return;
+  }
+  pumpSerial();
 }
 
-// 特殊按键映射表
-int getSpecialKeyCode(String k) {
-  if (k == "enter") return KEY_RETURN;
-  if (k == "esc") return KEY_ESC;
-  if (k == "backspace") return KEY_BACKSPACE;
-  if (k == "delete") return KEY_DELETE;
-  if (k == "insert") return KEY_INSERT;
-  if (k == "tab") return KEY_TAB;
-  if (k == "space") return ' '; // space is just space
-  
-  if (k == "up") return KEY_UP_ARROW;
-  if (k == "down") return KEY_DOWN_ARROW;
-  if (k == "left") return KEY_LEFT_ARROW;
-  if (k == "right") return KEY_RIGHT_ARROW;
-
-  if (k == "page_up") return KEY_PAGE_UP;
-  if (k == "page_down") return KEY_PAGE_DOWN;
-  if (k == "home") return KEY_HOME;
-  if (k == "end") return KEY_END;
-
-  // 补充常用功能键
-  if (k == "print_screen") return 206; // Print Screen (0xCE)
-  if (k == "scroll_lock")  return 207; // Scroll Lock (0xCF)
-  if (k == "pause")        return 208; // Pause (0xD0)
-  
-  if (k == "caps_lock") return KEY_CAPS_LOCK;
-  if (k == "num_lock") return 219; // Num Lock
-  if (k == "scroll_lock") return 207; // Scroll Lock
-  
-  if (k == "f1") return KEY_F1;
-  if (k == "f2") return KEY_F2;
-  if (k == "f3") return KEY_F3;
-  if (k == "f4") return KEY_F4;
-  if (k == "f5") return KEY_F5;
-  if (k == "f6") return KEY_F6;
-  if (k == "f7") return KEY_F7;
-  if (k == "f8") return KEY_F8;
-  if (k == "f9") return KEY_F9;
-  if (k == "f10") return KEY_F10;
-  if (k == "f11") return KEY_F11;
-  if (k == "f12") return KEY_F12;
-
-  // 修饰键 (关键！)
-  if (k == "shift" || k == "shift_l" || k == "shift_r") return KEY_LEFT_SHIFT; 
-  if (k == "ctrl" || k == "ctrl_l" || k == "ctrl_r") return KEY_LEFT_CTRL;
-  if (k == "alt" || k == "alt_l" || k == "alt_r") return KEY_LEFT_ALT;
-  if (k == "cmd" || k == "cmd_l" || k == "cmd_r" || k == "win") return KEY_LEFT_GUI;
+// 解析键值或字符: 单个字符直接返回，否则查特殊键名表
+byte keyCode(const char *k) {
+  if (k[0] == '\0') return 0;
+  if (k[1] == '\0') return (byte)k[0];
+  return getSpecialKeyCode(k);
+}
 
+// 特殊按键映射表 (PROGMEM 二分查找)
+byte getSpecialKeyCode(const char *k) {
+  int lo = 0;
+  int hi = KEY_TABLE_SIZE - 1;
+  while (lo <= hi) {
+    int mid = (lo + hi) / 2;
+    int cmp = strcmp_P(k, KEY_TABLE[mid].name);
+    if (cmp == 0) return pgm_read_byte(&KEY_TABLE[mid].code);
+    if (cmp < 0) hi = mid - 1;
+    else lo = mid + 1;
+  }
   return 0; // 未知按键
 }
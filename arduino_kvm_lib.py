@@ -1,102 +1,1193 @@
 import serial
-import serial.tools.list_ports
 import time
 import threading
-from pynput import mouse, keyboard
+import collections
+import atexit
+import signal
+import queue
+import struct
+from kvm_motion import MotionAccumulator, split_delta, DEFAULT_REPORT_RATE
+from kvm_keymap import KeyMap
+from kvm_stats import KVMStats, StatsLogger
+from kvm_capture import CAPTURE_MODES, RecenterCapture, EvdevCapture
+from kvm_screen import ScreenGeometry
+from kvm_baud import BASE_BAUD, DEFAULT_CACHE_PATH, NO_BAUD_TTL, BaudCache, device_key, negotiable, negotiate, restore_base
+from kvm_discovery import PORT_SCAN_TTL, DeviceDiscovery, comports as _comports
 
 # ==========================================
 # Arduino KVM 核心库
 # ==========================================
+# 启动速度: pynput (会加载 Xlib/平台后端)、串口枚举、录制和网络中继模块都在首次使用时才导入，
+# 只发送指令的脚本 (宏、文本输入) 不需要为它们付出启动时间；
+# 构造 ArduinoKVMClient 时也不再扫描串口，未指定端口时在 connect() 中查找 (见 kvm_discovery.py)，扫描结果短暂缓存。
+
+mouse = keyboard = None  # pynput 模块，由 _load_pynput() 在镜像/录制时导入
+
+
+def _load_pynput():
+    global mouse, keyboard
+    if mouse is None:
+        from pynput import mouse as _mouse, keyboard as _keyboard
+        mouse, keyboard = _mouse, _keyboard
+
+
+
+# ==========================================
+# 通信协议
+# ==========================================
+# v1 (文本):   "HDR:data\n"，例如 "M:-12,7\n" (8~12 字节)
+# v2 (二进制): [操作码 1B][定长负载][CRC8 1B, 可选]，例如鼠标位移只需 3 字节
+#   操作码最高位为 1，固件据此区分二进制帧与文本指令，两种格式可以混用。
+#   connect() 时发送 "V:2,<crc>\n" 握手，旧固件不回复则自动退回文本协议。
+PROTO_TEXT = 1
+PROTO_V2 = 2
+PROTO_HANDSHAKE_TIMEOUT = 0.3
+
+OP_MOUSE_MOVE = 0x81   # dx:int8 dy:int8
+OP_MOUSE_DOWN = 0x82   # button:uint8
+OP_MOUSE_UP = 0x83     # button:uint8
+OP_SCROLL = 0x84       # wheel:int8
+OP_KEY_DOWN = 0x85     # keycode:uint8
+OP_KEY_UP = 0x86       # keycode:uint8
+OP_RELEASE_ALL = 0x87  # 无负载
+OP_TYPE_TEXT = 0x88    # len:uint8 + len 字节 ASCII 文本
+OP_SEQ = 0x89          # seq:uint8 + 内层帧 (可靠模式)
+OP_MOUSE_ABS = 0x8A    # x:uint16 y:uint16 (小端, 0-32767 绝对坐标)
+OP_MOUSE_VEL = 0x8B    # t:uint16 dx:int16 dy:int16 (平滑移动样本, t 为上位机毫秒时间戳)
+OP_HSCROLL = 0x8C      # pan:int8 (水平滚动, 正数向右)
+
+# 固件能力 (CAP:0 查询，旧固件不回复)
+CAP_ABS_MOUSE = 0x01   # 绝对定位指针
+CAP_SMOOTH_MOTION = 0x02  # 平滑移动 (固件按时间戳插值播放位移样本)
+CAP_HSCROLL = 0x04     # 水平滚动 (AC Pan)
+CAP_QUERY_TIMEOUT = 0.2
+MOUSE_MODES = ('relative', 'absolute', 'smooth')
+MODE_CAPS = {'absolute': CAP_ABS_MOUSE, 'smooth': CAP_SMOOTH_MOTION}
+
+# 批量输入文本 (T 指令): 每块不超过固件缓冲，固件打完一块回复 "T:<n>\n" 后才发下一块
+TYPE_CHUNK_MAX = 48
+TYPE_ACK_TIMEOUT = 0.3           # 每块的基础等待时间
+TYPE_ACK_TIMEOUT_PER_CHAR = 0.01 # 固件每个字符需要按下+松开两个 HID 报告
+
+V2_OPCODES = {
+    "M": OP_MOUSE_MOVE, "MD": OP_MOUSE_DOWN, "MU": OP_MOUSE_UP, "S": OP_SCROLL, "SH": OP_HSCROLL,
+    "KD": OP_KEY_DOWN, "KU": OP_KEY_UP, "REL": OP_RELEASE_ALL,
+}
+
+# 与固件 Mouse.h 的 MOUSE_LEFT/RIGHT/MIDDLE 一致
+MOUSE_BUTTON_CODES = {"L": 0x01, "R": 0x02, "M": 0x04}
+
+# 与固件 getSpecialKeyCode() 一致 (Arduino Keyboard.h 键码)
+KEY_CODES = {
+    "enter": 0xB0, "esc": 0xB1, "backspace": 0xB2, "tab": 0xB3, "space": 0x20,
+    "insert": 0xD1, "home": 0xD2, "page_up": 0xD3, "delete": 0xD4, "end": 0xD5, "page_down": 0xD6,
+    "right": 0xD7, "left": 0xD8, "down": 0xD9, "up": 0xDA,
+    "caps_lock": 0xC1, "print_screen": 0xCE, "scroll_lock": 0xCF, "pause": 0xD0, "num_lock": 0xDB,
+    "ctrl": 0x80, "ctrl_l": 0x80, "ctrl_r": 0x80,
+    "shift": 0x81, "shift_l": 0x81, "shift_r": 0x81,
+    "alt": 0x82, "alt_l": 0x82, "alt_r": 0x82,
+    "cmd": 0x83, "cmd_l": 0x83, "cmd_r": 0x83, "win": 0x83,
+}
+KEY_CODES.update({f"f{i}": 0xC1 + i for i in range(1, 13)})  # F1=0xC2 ... F12=0xCD
+
+
+def _make_crc8_table():
+    table = []
+    for i in range(256):
+        c = i
+        for _ in range(8):
+            c = ((c << 1) ^ 0x07) & 0xFF if c & 0x80 else (c << 1) & 0xFF
+        table.append(c)
+    return bytes(table)
+
+_CRC8_TABLE = _make_crc8_table()
+
+
+def crc8(data):
+    """CRC-8 (多项式 0x07, 初值 0)，与固件 crc8() 一致"""
+    c = 0
+    for b in data:
+        c = _CRC8_TABLE[c ^ b]
+    return c
+
+
+def key_code(k):
+    """键名或单个 ASCII 字符 -> Arduino 键码，不支持则返回 None"""
+    if len(k) == 1 and ord(k) < 0x80:
+        return ord(k)
+    return KEY_CODES.get(k)
+
+
+def encode_text(header, data):
+    return f"{header}:{data}\n".encode('utf-8')
+
+
+# 键码 -> 键名 (同一键码的多个别名取第一个，用于重新编码和显示)
+KEY_NAMES = {}
+for _name, _code in KEY_CODES.items():
+    KEY_NAMES.setdefault(_code, _name)
+MOUSE_BUTTON_NAMES = {v: k for k, v in MOUSE_BUTTON_CODES.items()}
+_V2_HEADERS = {v: k for k, v in V2_OPCODES.items()}
+
+
+def decode_command(payload):
+    """
+    解析一条已编码的按键/按钮指令 -> (header, 标识)，其他指令返回 None。
+    按键的标识为 Arduino 键码 (不在表中的字符为原字符串)，按钮为 "L"/"R"/"M"，REL 为 None。
+    """
+    first = payload[0]
+    if first >= 0x80:
+        header = _V2_HEADERS.get(first)
+        if header in ("KD", "KU"):
+            return header, payload[1]
+        if header in ("MD", "MU"):
+            return header, MOUSE_BUTTON_NAMES.get(payload[1], payload[1])
+        if header == "REL":
+            return header, None
+        return None
+    header, sep, data = payload.partition(b":")
+    if not sep or header not in (b"KD", b"KU", b"MD", b"MU", b"REL"):
+        return None
+    header = header.decode('ascii')
+    data = data[:-1].decode('utf-8', 'replace') if data.endswith(b"\n") else data.decode('utf-8', 'replace')
+    if header in ("KD", "KU"):
+        code = key_code(data)
+        return header, data if code is None else code
+    return header, (None if header == "REL" else data)
+
+
+def key_label(ident):
+    """decode_command 给出的按键标识 -> 可读/可重新编码的键名"""
+    if isinstance(ident, int):
+        return KEY_NAMES.get(ident) or chr(ident)
+    return ident
+
+
+# ==========================================
+# 按下状态跟踪 / 退出时释放
+# ==========================================
+# 由实际发出的指令推算目标机上当前按下的键和按钮 (REL 清空)。
+# 按住一个键时系统自动重复会产生一连串 KD，键已经按下时重复的 KD/MD 没有任何效果，直接丢弃。
+
+class HeldState:
+    def __init__(self, on_change=None):
+        """on_change(): 按下状态变化时调用 (在发送线程中，界面应自行转到主线程)"""
+        self.lock = threading.Lock()
+        self.keys = {}      # 按键标识 -> None (保持按下顺序)
+        self.buttons = {}   # "L"/"R"/"M" -> None
+        self.on_change = on_change
+        self.repeats_dropped = 0
+        self.bytes_saved = 0
+
+    def track(self, payload):
+        """记录一条指令，返回 False 表示这是重复的按下 (无需发送)"""
+        first = payload[0]
+        if first == OP_MOUSE_MOVE or first == 0x4D and payload[1] == 0x3A: # 位移 (最频繁) 直接跳过
+            return True
+        cmd = decode_command(payload)
+        if cmd is None:
+            return True
+        header, ident = cmd
+        with self.lock:
+            if header == "KD" or header == "MD":
+                table = self.keys if header == "KD" else self.buttons
+                if ident in table:
+                    self.repeats_dropped += 1
+                    self.bytes_saved += len(payload)
+                    return False
+                table[ident] = None
+            elif header == "KU" or header == "MU":
+                table = self.keys if header == "KU" else self.buttons
+                if ident not in table: return True
+                del table[ident]
+            else:  # REL
+                if not (self.keys or self.buttons): return True
+                self.keys.clear()
+                self.buttons.clear()
+        if self.on_change:
+            self.on_change()
+        return True
+
+    def clear(self):
+        with self.lock:
+            self.keys.clear()
+            self.buttons.clear()
+
+    def any(self):
+        return bool(self.keys or self.buttons)
+
+    def items(self):
+        """(按键标识列表, 按钮列表)，按按下顺序"""
+        with self.lock:
+            return list(self.keys), list(self.buttons)
+
+    def snapshot(self):
+        keys, buttons = self.items()
+        return {
+            "keys": [key_label(k) for k in keys],
+            "buttons": buttons,
+            "repeats_dropped": self.repeats_dropped,
+            "bytes_saved": self.bytes_saved,
+        }
+
+
+EXIT_LOCK_TIMEOUT = 0.2  # 退出时等待串口锁的上限 (秒)
+_release_hooks = []
+_atexit_registered = False
+_exit_signals = set()  # 已安装处理函数的信号
+
+
+def release_on_exit(fn):
+    """
+    注册一个释放函数，进程退出 (正常退出、未捕获异常、SIGTERM/SIGHUP、Windows 关闭控制台) 时调用，
+    用来向目标机发送 REL。fn 不能阻塞太久。
+    """
+    install_exit_handlers()
+    if fn not in _release_hooks:
+        _release_hooks.append(fn)
+
+
+def cancel_release_on_exit(fn):
+    if fn in _release_hooks:
+        _release_hooks.remove(fn)
+
+
+def _release_everything():
+    for fn in list(_release_hooks):
+        try:
+            fn()
+        except Exception:
+            pass
+
+
+def install_exit_handlers():
+    """
+    注册 atexit 和 SIGTERM/SIGHUP/SIGBREAK 处理 (可重复调用)。
+    信号处理只能在主线程安装: 在其他线程 (回调、线程池里首次连接) 调用时只注册 atexit，
+    之后主线程再调用时补装。首次连接不在主线程的程序 (例如 kvm_daemon) 应在主线程先调用一次。
+    返回信号处理是否已全部安装。
+    """
+    global _atexit_registered
+    if not _atexit_registered:
+        _atexit_registered = True
+        atexit.register(_release_everything)
+    ok = True
+    for name in ("SIGTERM", "SIGHUP", "SIGBREAK"):
+        signum = getattr(signal, name, None)
+        if signum is None or signum in _exit_signals: continue
+        try:
+            previous = signal.getsignal(signum)
+            signal.signal(signum, lambda n, frame, prev=previous: _on_exit_signal(n, frame, prev))
+        except (ValueError, OSError):
+            ok = False # 不在主线程，暂时只依赖 atexit
+            continue
+        _exit_signals.add(signum)
+    return ok
+
+
+def _on_exit_signal(signum, frame, previous):
+    _release_everything()
+    if callable(previous):
+        previous(signum, frame)
+    elif previous != signal.SIG_IGN:
+        raise SystemExit(128 + signum)
+
+
+def encode_v2(header, data, crc=False):
+    """编码为 v2 二进制帧；无法用二进制表示的指令 (例如非 ASCII 字符) 退回文本格式"""
+    op = V2_OPCODES.get(header)
+    if op is None:
+        return encode_text(header, data)
+    if op == OP_MOUSE_MOVE:
+        dx, dy = (int(v) for v in str(data).split(','))
+        return encode_v2_move(dx, dy, crc)
+    if op == OP_MOUSE_DOWN or op == OP_MOUSE_UP:
+        code = MOUSE_BUTTON_CODES.get(data)
+        if code is None:
+            return encode_text(header, data)
+        frame = bytes((op, code))
+    elif op == OP_SCROLL or op == OP_HSCROLL:
+        wheel = int(data)
+        if not -128 <= wheel <= 127:
+            return encode_text(header, data)
+        frame = struct.pack('<Bb', op, wheel)
+    elif op == OP_KEY_DOWN or op == OP_KEY_UP:
+        code = key_code(data)
+        if code is None:
+            return encode_text(header, data)
+        frame = bytes((op, code))
+    else:
+        frame = bytes((op,))
+    if crc:
+        frame += bytes((crc8(frame),))
+    return frame
+
+
+def encode_v2_move(dx, dy, crc=False):
+    if not (-128 <= dx <= 127 and -128 <= dy <= 127):
+        return encode_text("M", f"{dx},{dy}")
+    frame = struct.pack('<Bbb', OP_MOUSE_MOVE, dx, dy)
+    if crc:
+        frame += bytes((crc8(frame),))
+    return frame
+
+
+def encode_abs(x, y, protocol=PROTO_TEXT, crc=False):
+    """编码绝对定位 (0-32767): 文本 "P:<x>,<y>\n"，v2 为 [0x8A][x:uint16][y:uint16]"""
+    if protocol == PROTO_V2:
+        frame = struct.pack('<BHH', OP_MOUSE_ABS, x, y)
+        if crc:
+            frame += bytes((crc8(frame),))
+        return frame
+    return encode_text("P", f"{x},{y}")
+
+
+def encode_vel(t, dx, dy, protocol=PROTO_TEXT, crc=False):
+    """编码平滑移动样本: 文本 "MV:<t>,<dx>,<dy>\n"，v2 为 [0x8B][t:uint16][dx:int16][dy:int16]"""
+    if protocol == PROTO_V2:
+        frame = struct.pack('<BHhh', OP_MOUSE_VEL, t, dx, dy)
+        if crc:
+            frame += bytes((crc8(frame),))
+        return frame
+    return encode_text("MV", f"{t},{dx},{dy}")
+
+
+def encode_type_text(chunk, protocol=PROTO_TEXT, crc=False):
+    """编码一块待输入的 ASCII 文本: 文本协议 "T:<len>:<payload>\n"，v2 为 [0x88][len][payload]"""
+    if protocol == PROTO_V2:
+        frame = bytes((OP_TYPE_TEXT, len(chunk))) + chunk
+        if crc:
+            frame += bytes((crc8(frame),))
+        return frame
+    return b"T:%d:" % len(chunk) + chunk + b"\n"
+
+
+# ==========================================
+# 可靠模式 (可选)
+# ==========================================
+# 按键/点击/复位等关键指令带上 8 位序号: 文本 "Q:<seq>:<指令>"，v2 [0x89][seq][内层帧]。
+# 固件只按顺序执行 (收到重复或超前的序号直接丢弃)，并回复累计确认 "A:<最后执行的序号>"。
+# 上位机保留未确认指令的滑动窗口，超时后按顺序全部重发 (Go-Back-N)。
+# 鼠标位移和滚轮仍然是即发即弃，不占用窗口，保证热路径吞吐。
+RELIABLE_WINDOW = 64   # 未确认指令上限，必须小于序号空间的一半
+RETX_TIMEOUT = 0.2     # 最早一条未确认指令超过该时间则重发
+RETX_MAX = 10          # 连续无进展的重发轮数上限，超过后报错并重新同步序号
+
+
+def is_critical(payload):
+    """是否为需要可靠送达的指令 (鼠标位移、滚轮、批量文本、控制指令除外)"""
+    first = payload[0]
+    if first >= 0x80:
+        return first not in (OP_MOUSE_MOVE, OP_MOUSE_ABS, OP_MOUSE_VEL, OP_SCROLL, OP_HSCROLL, OP_TYPE_TEXT)
+    return not payload.startswith((b"M:", b"P:", b"MV:", b"S:", b"SH:", b"T:", b"V:", b"SEQ:", b"CAP:"))
+
+
+def wrap_reliable(payload, seq, crc=False):
+    """为已编码的指令加上序号"""
+    if payload[0] >= 0x80:
+        # v2: CRC 覆盖整个外层帧，替换内层帧自带的 CRC
+        frame = bytes((OP_SEQ, seq)) + (payload[:-1] if crc else payload)
+        if crc:
+            frame += bytes((crc8(frame),))
+        return frame
+    return b"Q:%d:" % seq + payload
+
+
+# 发送队列满时的丢弃策略
+# drop_oldest: 丢弃队列中最旧的鼠标位移包
+# drop_newest: 丢弃新到的鼠标位移包
+# block:       调用方等待，直到队列有空位
+# 注意：按键/点击/复位等关键指令在任何策略下都不会被丢弃
+TX_DROP_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+TX_BATCH_MAX = 64  # 每次 write() 最多合并的指令数
+
+# 连接监控: 写入/读取失败或心跳超时后自动重连
+# 重连后先发 REL，再重新按下当前应处于按下状态的键和按钮，并补发断线期间累积的位移
+HEARTBEAT_INTERVAL = 1.0   # 空闲时每秒查询一次 STAT (仅限支持 STAT 的固件)
+HEARTBEAT_TIMEOUT = 0.3
+HEARTBEAT_MISSES = 2       # 连续多少次无回复判定为断线
+RECONNECT_BACKOFF_MIN = 0.05
+RECONNECT_BACKOFF_MAX = 2.0
+
 
 class ArduinoKVMClient:
-    def __init__(self, port=None, baud_rate=115200):
+    def __init__(self, port=None, baud_rate=BASE_BAUD, async_tx=False, tx_queue_size=256, tx_drop_policy='drop_oldest',
+                 report_rate=DEFAULT_REPORT_RATE, protocol='auto', crc=False, reliable=False, instrument=False,
+                 auto_reconnect=True, mouse_mode='relative', geometry=None, link_baud='auto',
+                 baud_cache=DEFAULT_CACHE_PATH):
         self.port = port
-        self.baud_rate = baud_rate
+        self.baud_rate = baud_rate  # 固件上电速率，连接和协商都从这个速率开始
+
+        # 链路速率 (见 kvm_baud.py): 'auto' 协商最高可用速率 (优先使用缓存)；'probe' 忽略缓存重新探测；
+        # 指定速率则只尝试该速率；None 保持 baud_rate
+        if not (link_baud in ('auto', 'probe', None) or isinstance(link_baud, int)):
+            raise ValueError(f"未知的链路速率: {link_baud}")
+        self.link_baud = link_baud
+        self.link_rate = baud_rate  # 当前实际使用的速率
+        self.baud_report = None     # 最近一次协商的结果
+        self.baud_cache = BaudCache(baud_cache) if baud_cache else None
         self.lock = threading.Lock()
         self.ser = None
         self.connected = False
         self.error_msg = ""
-        
-        # 如果未指定端口，尝试自动寻找
-        if self.port is None:
-            self.port = self.find_device()
 
+        # 协议: 'auto' 握手协商 v2，失败退回文本；'text' 强制文本；'v2' 要求二进制
+        if protocol not in ('auto', 'text', 'v2'):
+            raise ValueError(f"未知的协议: {protocol}")
+        self.protocol_mode = protocol
+        self.protocol = PROTO_TEXT
+        self.use_crc = crc
+        self.bulk_text = None  # 固件是否支持 T 指令，首次 type_text 时探测
+
+        # 可靠模式: 关键指令带序号，等待固件确认，超时重发
+        self.reliable_mode = reliable
+        self.reliable = False  # 握手成功后才启用
+        self.seq_next = 0
+        self.unacked = collections.OrderedDict()  # seq -> [帧, 发送时间]
+        self.retx_rounds = 0  # 自上次确认进展以来的重发轮数
+        self.rel_cond = threading.Condition(threading.Lock())
+        self.retransmits = 0
+        self.reliable_failures = 0
+
+        # 接收线程 (可靠模式下负责处理确认，其余回复转交 rx_lines)
+        self.rx_thread = None
+        self.rx_stop = False
+        self.rx_lines = queue.Queue()
+        self.device_overflows = 0  # 固件主动上报的 "O:<次数>" (环形缓冲/硬件缓冲溢出)
+
+        # 发送管线 (可选): 调用方只负责入队，由独立的写线程批量写串口
+        if tx_drop_policy not in TX_DROP_POLICIES:
+            raise ValueError(f"未知的丢弃策略: {tx_drop_policy}")
+        self.async_tx = async_tx
+        self.tx_queue_size = tx_queue_size
+        self.tx_drop_policy = tx_drop_policy
+        self.tx_queue = collections.deque()
+        self.tx_cond = threading.Condition(threading.Lock())
+        self.tx_thread = None
+        self.tx_stop = False
+        self.tx_dropped = 0
+        self.tx_coalesced = 0
+        self.tx_max_depth = 0
+
+        # 发送统计 (可选): 关闭时为 None，发送路径只多一次判断
+        self.instr = KVMStats() if instrument else None
+        self.stats_logger = None
+
+        self.motion_udp = False  # 传输层是否提供独立的位移通道 (网络中继)
+
+        # 当前处于按下状态的键和按钮 (由发出的指令推算)，重连后据此恢复，退出时释放
+        self.held = HeldState()
+
+        # 连接监控
+        self.auto_reconnect = auto_reconnect
+        self.link_down = threading.Event()
+        self.read_lock = threading.RLock()  # 读取固件回复的调用方互斥 (文本输入确认、STAT 查询)
+        self.rx_stash = collections.deque()  # 心跳读到的其他回复 (例如 T 确认)，留给等待它的调用方
+        self.heartbeat = False
+        self.sup_thread = None
+        self.sup_stop = False
+        self.pending_motion = [0, 0]  # 断线期间累积的位移
+        self.reconnects = 0
+        self.device_id = None  # 设备键 (USB VID:PID:序列号)，重连时用来找回改名后的端口
+
+        # 会话录制 (可选): 镜像回调收到的原始事件写入录制文件，见 kvm_trace.py
+        self.recorder = None
+        
         # 状态
         self.target_os = 'WIN' # 'WIN' or 'MAC'
         self.mirror_enabled = False
+        self.keymap = KeyMap(self.target_os, self._encode)
         
         # 监听器
         self.m_listener = None
         self.k_listener = None
-        self.last_mouse_time = 0
-        self.MOUSE_RATE_LIMIT = 0.005
-        
-        # 鼠标位移计算
-        self.prev_x = 0
-        self.prev_y = 0
-        self.first_move = True
+        self.capture = None        # 鼠标捕获 (kvm_capture)，默认方式为 None
+        self.virtual_pos = (0, 0)  # 捕获模式下累加的虚拟坐标 (仅用于录制)
+
+        # 鼠标位移聚合 (按回报率合并发送，不丢事件)
+        self.motion = MotionAccumulator(self.mouse_move, rate_hz=report_rate, send_abs=self._send_abs,
+                                        send_scroll=self.scroll)
+
+        # 鼠标模式: 固件支持时可切换为绝对定位 (一个包直接定位，没有累计误差)
+        if mouse_mode not in MOUSE_MODES:
+            raise ValueError(f"mouse_mode 必须是 {MOUSE_MODES} 之一")
+        self.mouse_mode_req = mouse_mode
+        self.mouse_mode = 'relative'  # 连接并确认固件支持后才切换
+        # kvm_screen.ScreenGeometry。None 时由 connect / set_mouse_mode / start_mirroring 在调用方线程检测，
+        # 发送线程只读取 (检测可能要创建 Tk，不能在后台线程中进行)
+        self.geometry = geometry
+        self.caps = None
+        self.hscroll_warned = False
 
     @staticmethod
-    def list_ports():
-        """列出所有可用串口"""
-        return [p.device for p in serial.tools.list_ports.comports()]
+    def list_ports(refresh=False):
+        """列出所有可用串口 (refresh=True 时忽略缓存重新扫描)"""
+        return [p.device for p in _comports(refresh)]
 
     @staticmethod
-    def find_device():
-        """尝试自动查找 Arduino 设备"""
-        ports = serial.tools.list_ports.comports()
-        candidates = []
-        for p in ports:
-            # 优先匹配 Arduino 或 Leonardo
-            desc = p.description.lower()
-            hwid = p.hwid.lower()
-            if "arduino" in desc or "leonardo" in desc or "vid:pid=2341" in hwid:
-                return p.device
-            candidates.append(p.device)
-        
-        # 如果找不到明确的，但有且只有一个串口，就用它
-        if len(candidates) == 1:
-            return candidates[0]
-            
-        return None
+    def find_device(refresh=False):
+        """
+        自动查找 KVM 设备: 已识别过的设备 (按 USB VID:PID:序列号) 在场就直接使用，
+        否则并行打开候选串口确认固件身份，都不回复时退回描述字符串匹配 (见 kvm_discovery.py)
+        """
+        return DeviceDiscovery.default().find(refresh)
 
     def connect(self):
+        # 未指定端口时才扫描 (构造客户端本身不枚举串口)
+        auto = not self.port
+        if auto:
+            self.port = self.find_device()
         if not self.port:
             self.error_msg = "未指定串口且未能自动找到设备"
             return False
 
+        if self.mouse_mode_req == 'absolute':
+            self._ensure_geometry()
         try:
-            self.ser = serial.Serial(self.port, self.baud_rate, timeout=0.1)
-            self.connected = True
-            print(f"✅ [Lib] 串口已连接: {self.port}")
-            return True
+            self._open()
         except Exception as e:
             self.connected = False
             self.error_msg = str(e)
             print(f"❌ [Lib] 串口连接失败: {e}")
+            if auto:
+                DeviceDiscovery.default().forget(self.port) # 缓存的设备不可用，下次重新识别
             return False
+        # 记住设备身份，自动重连时按它找回改名后的端口
+        self.device_id = None if "://" in self.port else device_key(self.port, _comports())
+        if self.protocol == PROTO_V2 or self.heartbeat or (self.baud_report or {}).get("supported"):
+            DeviceDiscovery.default().remember(self.port) # 固件已应答握手，下次启动直接使用
+        self.link_down.clear()
+        self.held.clear()
+        self.pending_motion = [0, 0]
+        release_on_exit(self._release_on_exit)
+        if self.async_tx:
+            self._start_tx_thread()
+        if self.auto_reconnect:
+            self._start_supervisor()
+        print(f"✅ [Lib] 串口已连接: {self.port} (协议 v{self.protocol}{', 可靠模式' if self.reliable else ''})")
+        return True
+
+    def _open(self):
+        """打开端口并完成握手 (首次连接和自动重连共用)"""
+        if self.port.startswith("kvm://"):
+            # 网络中继 (kvm_relay.py): 按键走 TCP，鼠标位移走 UDP
+            from kvm_relay import RelayTransport
+            ser = RelayTransport.from_url(self.port, timeout=0.1)
+        else:
+            # 支持 pyserial URL (socket://, loop://) 和普通设备名，便于连接 kvm_emulator
+            ser = serial.serial_for_url(self.port, self.baud_rate, timeout=0.1)
+        with self.lock:
+            self.ser = ser
+        self.motion_udp = hasattr(ser, "write_motion")
+        self.connected = True
+        prev_rate, self.link_rate = self.link_rate, self.baud_rate
+        if self.link_baud and not self.motion_udp and negotiable(self.port):
+            self._negotiate_baud(prev_rate)
+        self._negotiate_protocol()
+        self._start_reliable()
+        self.bulk_text = None
+        self.keymap = KeyMap(self.target_os, self._encode) # 协议可能已变化，重建按键表
+        self.caps = None
+        if self.mouse_mode_req != 'relative':
+            self._apply_mouse_mode()
+        if self.auto_reconnect:
+            # 固件支持 STAT 时才用它做心跳，旧固件只靠读写异常判断断线
+            with self.read_lock:
+                self.heartbeat = self._query_stats(HEARTBEAT_TIMEOUT) is not None
+
+    def _negotiate_baud(self, prev_rate):
+        """在上电速率下与固件协商更高的链路速率，结果按设备缓存 (网络中继和 URL 端口不协商)"""
+        key = device_key(self.port, _comports())
+        cache = self.baud_cache if key is not None else None
+        cached = cache.get(key) if cache and self.link_baud == 'auto' else None
+        if cached == self.baud_rate:
+            return  # 之前已确认没有更快的速率 (或者是旧固件)，不再探测
+        # 自动重连时固件可能仍处于上次协商的速率
+        hint = cached or (prev_rate if prev_rate != self.baud_rate else None)
+        target = self.link_baud if self.link_baud != 'auto' or cached else 'probe'
+        try:
+            report = negotiate(self.ser, self.baud_rate, target, hint)
+        except Exception as e:
+            print(f"⚠️ [Lib] 速率协商异常: {e}")
+            try:
+                self.ser.baudrate = self.baud_rate
+            except Exception:
+                pass
+            return
+        self.baud_report = report
+        self.link_rate = report["baud"]
+        if cache and (report["probes"] or not report["supported"]):
+            ok = [p for p in report["probes"] if p["ok"]]
+            # 旧固件的结果只短期有效: 刷新新固件后应重新协商
+            cache.put(key, self.link_rate, ok[0]["error_rate"] if ok else None,
+                      ttl=None if report["supported"] else NO_BAUD_TTL)
+        if self.link_rate != self.baud_rate:
+            print(f"⚡ [Lib] 链路速率: {self.link_rate}" + (" (缓存)" if report["cached"] else ""))
+
+    def _negotiate_protocol(self):
+        """握手: 发送 V:2,<crc>，固件原样回复则启用 v2；旧固件不回复，保持文本协议"""
+        self.protocol = PROTO_TEXT
+        if self.protocol_mode == 'text':
+            return
+        hello = f"V:{PROTO_V2},{1 if self.use_crc else 0}"
+        try:
+            self.ser.reset_input_buffer()
+            self.ser.write(f"{hello}\n".encode('utf-8'))
+            deadline = time.monotonic() + PROTO_HANDSHAKE_TIMEOUT
+            while time.monotonic() < deadline:
+                line = self.ser.readline().strip()
+                if line == hello.encode('utf-8'):
+                    self.protocol = PROTO_V2
+                    return
+        except Exception as e:
+            print(f"⚠️ [Lib] 协议握手异常: {e}")
+        if self.protocol_mode == 'v2':
+            print("⚠️ [Lib] 固件不支持协议 v2，已退回文本协议")
+
+    def _start_reliable(self):
+        """握手: 发送 SEQ:0 让固件从序号 0 开始，固件回复 A:255 则启用可靠模式"""
+        self.reliable = False
+        if not self.reliable_mode:
+            return
+        with self.rel_cond:
+            self.seq_next = 0
+            self.unacked.clear()
+            self.retx_rounds = 0
+        try:
+            self.ser.write(encode_text("SEQ", 0))
+            deadline = time.monotonic() + PROTO_HANDSHAKE_TIMEOUT
+            while time.monotonic() < deadline:
+                if self.ser.readline().strip() == b"A:255":
+                    self.reliable = True
+                    break
+        except Exception as e:
+            print(f"⚠️ [Lib] 可靠模式握手异常: {e}")
+        if not self.reliable:
+            print("⚠️ [Lib] 固件不支持可靠模式，关键指令将不做确认")
+            return
+        self.rx_stop = False
+        self.rx_thread = threading.Thread(target=self._rx_worker, name="kvm-rx", daemon=True)
+        self.rx_thread.start()
+
+    def _stop_reliable(self, timeout=1.0):
+        """等待窗口内的指令全部确认后停止接收线程"""
+        if not self.rx_thread: return
+        deadline = time.monotonic() + timeout
+        with self.rel_cond:
+            while self.unacked and time.monotonic() < deadline:
+                self.rel_cond.wait(RETX_TIMEOUT)
+            if self.unacked:
+                self.reliable_failures += len(self.unacked)
+                print(f"❌ [Lib] 断开时仍有 {len(self.unacked)} 条关键指令未被确认")
+                self.unacked.clear()
+        self._stop_rx_thread()
+
+    def _stop_rx_thread(self):
+        if not self.rx_thread: return
+        self.rx_stop = True
+        if self.rx_thread is not threading.current_thread():
+            self.rx_thread.join(timeout=1.0)
+        self.rx_thread = None
+        self.reliable = False
+
+    def reliable_pending(self):
+        """窗口内未确认的关键指令数"""
+        return len(self.unacked)
 
     def disconnect(self):
+        self._stop_supervisor()
+        cancel_release_on_exit(self._release_on_exit)
+        # 线程和状态无论端口是否打开都要清理: 重连期间 (监控线程已关闭端口) 断开时写线程和接收线程仍在运行
+        self.stop_stats_logger()
+        self.stop_recording()
+        # 先把队列里剩下的指令发完，等关键指令全部确认，再复位 (端口已关闭时不再等待确认)
+        self._stop_tx_thread()
+        self._stop_reliable(timeout=1.0 if self.ser else 0.0)
         if self.ser:
             with self.lock:
                 try:
-                    self.send_packet_raw("REL", "0") # 安全复位
+                    self.ser.write(self._encode("REL", "0")) # 安全复位
+                    self.ser.flush()
+                    if self.link_rate != self.baud_rate:
+                        restore_base(self.ser, self.baud_rate) # 切回上电速率，其他工具仍可直接连接
                     self.ser.close()
                 except:
                     pass
             self.ser = None
-            self.connected = False
             print(f"🔌 [Lib] 串口已断开")
+        self.connected = False
+        self.link_down.clear()
+        self.held.clear()
+
+    def _release_on_exit(self):
+        """进程退出时调用: 直接写 REL (不经过发送队列，写线程可能已经停止)"""
+        if not (self.connected and self.ser): return
+        # 信号处理函数在主线程中执行，主线程可能正持有 self.lock (disconnect / _write 中)，
+        # 不能无限等待: 超时后不加锁直接写
+        locked = self.lock.acquire(timeout=EXIT_LOCK_TIMEOUT)
+        try:
+            self.ser.write(self._encode("REL", "0"))
+            self.ser.flush()
+        except Exception:
+            pass
+        finally:
+            if locked:
+                self.lock.release()
+        self.held.clear()
+
+    def held_state(self):
+        """当前按下的键/按钮 (键名列表) 以及丢弃的自动重复次数，供界面显示"""
+        return self.held.snapshot()
 
     def send_packet_raw(self, header, data):
         """直接发送底层指令"""
-        if self.connected and self.ser and self.ser.is_open:
-            payload = f"{header}:{data}\n"
-            with self.lock:
+        self._send(self._encode(header, data))
+
+    def _send(self, payload):
+        """发送一条已编码指令，成功写出或入队返回 True"""
+        # 断线期间也要记录，重连后据此恢复；已经按下的键再次 KD (系统自动重复) 不发送
+        if not self.held.track(payload):
+            return True
+        if not (self.connected and self.ser and self.ser.is_open):
+            return False
+        if self.instr is not None:
+            self.instr.count_command(payload)
+        if self.reliable and is_critical(payload):
+            self._send_reliable(payload)
+            return True
+        return self._transmit(payload)
+
+    def _transmit(self, payload):
+        if self.tx_thread:
+            self._enqueue(payload, droppable=False)
+            return True
+        return self._write(payload)
+
+    def _encode(self, header, data):
+        if self.protocol == PROTO_V2:
+            return encode_v2(header, data, self.use_crc)
+        return encode_text(header, data)
+
+    def _encode_move(self, dx, dy):
+        if self.protocol == PROTO_V2:
+            return encode_v2_move(dx, dy, self.use_crc)
+        return encode_text("M", f"{dx},{dy}")
+
+    def _write(self, payload):
+        instr = self.instr
+        if instr is not None:
+            return self._write_timed(payload, instr)
+        with self.lock:
+            try:
+                self.ser.write(payload)
+                return True
+            except Exception as e:
+                err = e
+        self._link_lost(err)
+        return False
+
+    def _write_timed(self, payload, instr):
+        t0 = time.perf_counter()
+        with self.lock:
+            t1 = time.perf_counter()
+            try:
+                self.ser.write(payload)
+                t2 = time.perf_counter()
+            except Exception as e:
+                err = e
+                t2 = None
+        if t2 is None:
+            instr.count_error()
+            self._link_lost(err)
+            return False
+        instr.count_write(len(payload), t1 - t0, t2 - t1)
+        return True
+
+    # --- 连接监控 / 自动重连 ---
+
+    def _link_lost(self, err):
+        """读写失败或心跳超时: 标记断线 (只提示一次)，由监控线程重连"""
+        if self.link_down.is_set() or self.ser is None:
+            return
+        self.error_msg = str(err)
+        self.connected = False
+        self.link_down.set()
+        if self.auto_reconnect:
+            print(f"⚠️ [Lib] 连接中断: {err}，正在重连...")
+        else:
+            print(f"❌ [Lib] 连接中断: {err}")
+
+    def _start_supervisor(self):
+        if self.sup_thread: return
+        self.sup_stop = False
+        self.sup_thread = threading.Thread(target=self._supervise, name="kvm-health", daemon=True)
+        self.sup_thread.start()
+
+    def _stop_supervisor(self):
+        if not self.sup_thread: return
+        self.sup_stop = True
+        self.link_down.set()  # 唤醒
+        self.sup_thread.join(timeout=2.0)
+        self.sup_thread = None
+        self.link_down.clear()
+
+    def _supervise(self):
+        misses = 0
+        while not self.sup_stop:
+            if self.link_down.wait(HEARTBEAT_INTERVAL):
+                if self.sup_stop: break
+                self._reconnect()
+                misses = 0
+                continue
+            if not self.heartbeat:
+                continue
+            # 心跳: 有其他调用方正在读取回复 (例如文本输入) 说明链路正忙，本轮跳过
+            if not self.read_lock.acquire(blocking=False):
+                continue
+            try:
+                alive = self._query_stats(HEARTBEAT_TIMEOUT, stash=True) is not None
+            except Exception as e:
+                self._link_lost(e)
+                continue
+            finally:
+                self.read_lock.release()
+            misses = 0 if alive else misses + 1
+            if misses >= HEARTBEAT_MISSES:
+                self._link_lost("心跳超时")
+
+    def _close_port(self):
+        self._stop_rx_thread()
+        with self.lock:
+            ser, self.ser = self.ser, None
+        if ser:
+            try:
+                ser.close()
+            except Exception:
+                pass
+
+    def _reconnect(self):
+        """按指数退避重新打开端口；设备名可能变化 (例如重新枚举为 COM6)，失败时重新自动查找"""
+        delay = RECONNECT_BACKOFF_MIN
+        attempts = 0
+        while not self.sup_stop:
+            self._close_port()
+            attempts += 1
+            try:
+                self._open()
+                break
+            except Exception as e:
+                self.connected = False
+                self.error_msg = str(e)
+            if "://" not in self.port:
+                if self.device_id and self.device_id != self.port:
+                    found = DeviceDiscovery.default().locate(self.device_id, refresh=True)
+                else:
+                    found = self.find_device(refresh=True)
+                if found and found != self.port:
+                    print(f"🔎 [Lib] 设备已重新枚举为 {found}")
+                    self.port = found
+                    continue
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_BACKOFF_MAX)
+        if self.sup_stop:
+            return
+        self.link_down.clear()
+        self.reconnects += 1
+        self._resync()
+        print(f"✅ [Lib] 已重新连接: {self.port} (第 {attempts} 次尝试)")
+
+    def _resync(self):
+        """复位目标机状态，再恢复应处于按下状态的键/按钮，并补发断线期间的位移"""
+        keys, buttons = self.held.items()
+        dx, dy = self.pending_motion
+        self.pending_motion = [0, 0]
+        frames = [self._encode("REL", "0")]
+        frames += [self._encode("KD", key_label(k)) for k in keys]
+        frames += [self._encode_move(sx, sy) for sx, sy in split_delta(dx, dy)]
+        frames += [self._encode("MD", b) for b in buttons]
+        # 直接写出，不经过 _send (REL 不能清掉正在恢复的按下状态)
+        self._write(b"".join(frames))
+
+    def _hold_motion(self, dx, dy):
+        """断线期间的位移先累积，重连后一次补发"""
+        self.pending_motion[0] += dx
+        self.pending_motion[1] += dy
+
+    # --- 统计 ---
+
+    def enable_stats(self, enabled=True):
+        """打开/关闭发送统计 (打开时从零开始计数)"""
+        self.instr = KVMStats() if enabled else None
+        if not enabled:
+            self.stop_stats_logger()
+
+    def stats(self):
+        """
+        统计快照 (dict)，统计未打开时返回 None。
+        packets/bytes 按指令类型计数；write_time/lock_wait 为耗时直方图摘要；
+        coalesced/dropped 为被回报率合并和被发送队列合并/丢弃的鼠标事件数。
+        """
+        instr = self.instr
+        if instr is None:
+            return None
+        snap = instr.snapshot()
+        motion_merged = max(0, self.motion.events_in - self.motion.packets_out)
+        snap.update({
+            "coalesced": motion_merged + self.tx_coalesced,
+            "dropped": self.tx_dropped,
+            "tx_queue_depth": len(self.tx_queue),
+            "tx_max_depth": self.tx_max_depth,
+            "retransmits": self.retransmits,
+            "reliable_failures": self.reliable_failures,
+            "device_overflows": self.device_overflows,
+            "repeats_dropped": self.held.repeats_dropped,
+            "reconnects": self.reconnects,
+            "link_baud": self.link_rate,
+        })
+        return snap
+
+    def start_stats_logger(self, interval=5.0, log=print):
+        """每 interval 秒输出一次速率 (自动打开统计)"""
+        if self.instr is None:
+            self.enable_stats()
+        self.stop_stats_logger()
+        self.stats_logger = StatsLogger(self, interval, log).start()
+
+    def stop_stats_logger(self):
+        if self.stats_logger:
+            self.stats_logger.stop()
+            self.stats_logger = None
+
+    # --- 可靠模式 ---
+
+    def _send_reliable(self, payload):
+        with self.rel_cond:
+            # 窗口已满时等待确认 (流控)
+            while len(self.unacked) >= RELIABLE_WINDOW and self.reliable:
+                self.rel_cond.wait(RETX_TIMEOUT)
+            seq = self.seq_next
+            self.seq_next = (seq + 1) & 0xFF
+            frame = wrap_reliable(payload, seq, self.use_crc)
+            self.unacked[seq] = [frame, time.monotonic()]
+            # 持锁发送，保证线上顺序与序号顺序一致
+            self._transmit(frame)
+
+    def _rx_worker(self):
+        while not self.rx_stop:
+            try:
+                line = self.ser.readline().strip()
+            except Exception as e:
+                self._link_lost(e)
+                time.sleep(RETX_TIMEOUT)
+                continue
+            if line.startswith(b"A:"):
                 try:
-                    self.ser.write(payload.encode('utf-8'))
-                except Exception as e:
-                    print(f"发送异常: {e}")
+                    self._on_ack(int(line[2:]))
+                except ValueError:
+                    pass
+            elif line.startswith(b"O:"):
+                self._on_overflow(line)
+            elif line:
+                self.rx_lines.put(line)
+            self._check_retransmit()
+
+    def _on_ack(self, acked):
+        """累计确认: 序号不晚于 acked 的指令全部出窗"""
+        with self.rel_cond:
+            while self.unacked:
+                seq = next(iter(self.unacked))
+                if (acked - seq) & 0xFF >= 0x80:
+                    break
+                del self.unacked[seq]
+                self.retx_rounds = 0
+            self.rel_cond.notify_all()
+
+    def _check_retransmit(self):
+        with self.rel_cond:
+            if not self.unacked:
+                return
+            oldest = next(iter(self.unacked.values()))
+            if time.monotonic() - oldest[1] < RETX_TIMEOUT:
+                return
+            if self.retx_rounds >= RETX_MAX:
+                # 多次重发无果: 报错并让固件从下一个序号重新开始，避免后续指令全部被丢弃
+                self.reliable_failures += len(self.unacked)
+                self.error_msg = f"{len(self.unacked)} 条关键指令未被确认"
+                print(f"❌ [Lib] {self.error_msg}，重新同步序号")
+                self.unacked.clear()
+                self.retx_rounds = 0
+                self._write(encode_text("SEQ", self.seq_next))
+                self.rel_cond.notify_all()
+                return
+            # Go-Back-N: 按顺序重发窗口内的全部指令
+            now = time.monotonic()
+            for entry in self.unacked.values():
+                entry[1] = now
+            self.retx_rounds += 1
+            self.retransmits += len(self.unacked)
+            self._write(b"".join(entry[0] for entry in self.unacked.values()))
+
+    def _on_overflow(self, line):
+        try:
+            count = int(line[2:])
+        except ValueError:
+            return
+        if count != self.device_overflows:
+            print(f"⚠️ [Lib] 固件接收缓冲溢出 (累计 {count} 次)，指令可能丢失")
+        self.device_overflows = count
+
+    def _read_line(self, timeout):
+        """读取一行固件回复 (接收线程运行时从 rx_lines 取)，溢出通知单独记录"""
+        if self.rx_stash:
+            return self.rx_stash.popleft()
+        if self.rx_thread:
+            try:
+                return self.rx_lines.get(timeout=max(timeout, 0))
+            except queue.Empty:
+                return b""
+        line = self.ser.readline().strip()
+        if line.startswith(b"O:"):
+            self._on_overflow(line)
+            return b""
+        return line
+
+    def device_stats(self, timeout=0.3):
+        """
+        查询固件链路统计 (STAT:0)，返回 dict:
+          rx_overflows   环形缓冲区满而丢弃的字节数
+          uart_saturated 发现 64 字节硬件缓冲已满的次数
+          crc_errors     v2 帧 CRC 校验失败次数
+          parse_errors   超长/无法解析的指令数
+        旧固件不支持时返回 None
+        """
+        if not self.connected: return None
+        with self.read_lock:
+            return self._query_stats(timeout)
+
+    def _query(self, header, timeout, stash=False):
+        """发送 "<header>:0" 并等待以 "<header>:" 开头的回复，返回回复内容 (bytes)，超时返回 None"""
+        self._transmit(encode_text(header, 0))
+        prefix = header.encode('ascii') + b":"
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            line = self._read_line(remaining)
+            if line.startswith(prefix):
+                return line[len(prefix):]
+            if line and stash:
+                self.rx_stash.append(line)
+
+    def _query_stats(self, timeout, stash=False):
+        reply = self._query("STAT", timeout, stash)
+        if reply is None:
+            return None
+        try:
+            values = [int(v) for v in reply.split(b",")]
+        except ValueError:
+            return None
+        if len(values) != 4:
+            return None
+        return dict(zip(("rx_overflows", "uart_saturated", "crc_errors", "parse_errors"), values))
+
+    def device_caps(self):
+        """查询固件能力位掩码 (CAP_*)，旧固件返回 0；结果缓存到下次重新连接"""
+        if self.caps is None and self.connected:
+            with self.read_lock:
+                reply = self._query("CAP", CAP_QUERY_TIMEOUT)
+            try:
+                self.caps = int(reply) if reply is not None else 0
+            except ValueError:
+                self.caps = 0
+        return self.caps or 0
+
+    # --- 发送管线 (写线程) ---
+
+    def _start_tx_thread(self):
+        self.tx_stop = False
+        self.tx_thread = threading.Thread(target=self._tx_worker, name="kvm-tx", daemon=True)
+        self.tx_thread.start()
+
+    def _stop_tx_thread(self):
+        if not self.tx_thread: return
+        with self.tx_cond:
+            self.tx_stop = True
+            self.tx_cond.notify_all()
+        self.tx_thread.join(timeout=2.0)
+        self.tx_thread = None
+
+    def tx_queue_depth(self):
+        """当前待发送的指令数"""
+        return len(self.tx_queue)
+
+    def _enqueue(self, item, droppable):
+        """
+        入队一条指令。item 为已编码的 bytes，或鼠标位移 [dx, dy] (写线程发送前再编码)。
+        droppable=True 的条目 (鼠标位移) 在队列满时可按策略丢弃；其余条目永不丢弃。
+        """
+        with self.tx_cond:
+            # 队尾还没发出去的位移包直接累加，不再新增一条
+            if droppable and self.tx_queue and isinstance(self.tx_queue[-1], list):
+                tail = self.tx_queue[-1]
+                nx, ny = tail[0] + item[0], tail[1] + item[1]
+                if -127 <= nx <= 127 and -127 <= ny <= 127:
+                    tail[0], tail[1] = nx, ny
+                    self.tx_coalesced += 1
+                    return
+            if len(self.tx_queue) >= self.tx_queue_size:
+                if self.tx_drop_policy == 'block':
+                    while len(self.tx_queue) >= self.tx_queue_size and not self.tx_stop:
+                        self.tx_cond.wait()
+                elif droppable and self.tx_drop_policy == 'drop_newest':
+                    self.tx_dropped += 1
+                    return
+                else:
+                    # 腾出一个位置: 丢弃最旧的位移包；若队列里全是关键指令则允许超出上限
+                    for i, queued in enumerate(self.tx_queue):
+                        if isinstance(queued, list):
+                            del self.tx_queue[i]
+                            self.tx_dropped += 1
+                            break
+            self.tx_queue.append(item)
+            depth = len(self.tx_queue)
+            if depth > self.tx_max_depth:
+                self.tx_max_depth = depth
+            self.tx_cond.notify_all()
+
+    def _tx_worker(self):
+        while True:
+            with self.tx_cond:
+                while not self.tx_queue and not self.tx_stop:
+                    self.tx_cond.wait()
+                if not self.tx_queue:
+                    return  # 已请求停止且队列已清空
+                batch = []
+                while self.tx_queue and len(batch) < TX_BATCH_MAX:
+                    batch.append(self.tx_queue.popleft())
+                self.tx_cond.notify_all()
+
+            chunks = []
+            moves = []  # 网络中继时位移单独走 UDP
+            mx = my = 0
+            for item in batch:
+                if isinstance(item, list):
+                    mx += item[0]
+                    my += item[1]
+                    frame = self._encode_move(item[0], item[1])
+                    (moves if self.motion_udp else chunks).append(frame)
+                    if self.instr is not None:
+                        self.instr.count_command(frame)
+                else:
+                    chunks.append(item)
+            ok = True
+            if moves:
+                ok = self._write_motion(b"".join(moves))
+            if chunks:
+                # 多条指令合并为一次 write()，减少系统调用和 USB 事务
+                ok = self._write(b"".join(chunks)) and ok
+            if not ok and self.link_down.is_set() and (mx or my):
+                self._hold_motion(mx, my)
 
     # --- 高级控制 API (供外部程序调用) ---
 
@@ -122,16 +1213,169 @@ class ArduinoKVMClient:
             time.sleep(duration)
 
     def type_text(self, text, delay=0.02):
-        """输入文本"""
+        """输入文本 (固件支持时整块发送，大小写和符号的 Shift 由固件处理)"""
+        if self._probe_bulk_text():
+            self._type_text_bulk(text)
+            return
         for char in text:
-            # 简单处理
+            # 旧固件: 逐字符发送
             self.send_key_down(char)
             self.send_key_up(char)
             time.sleep(delay)
 
+    def _probe_bulk_text(self):
+        """发送一个空的 T 块，固件回复 T:0 说明支持批量输入；旧固件会忽略 T 指令"""
+        if self.bulk_text is None and self.connected:
+            self._send(encode_type_text(b"", self.protocol, self.use_crc))
+            self.bulk_text = self._wait_type_ack(0, TYPE_ACK_TIMEOUT)
+        return bool(self.bulk_text)
+
+    def _type_text_bulk(self, text):
+        with self.read_lock: # 输入期间暂停心跳
+            return self._type_chunks(text)
+
+    def _type_chunks(self, text):
+        data = text.encode('ascii', 'ignore') # 固件按 US 键盘布局输入，只支持 ASCII
+        for i in range(0, len(data), TYPE_CHUNK_MAX):
+            chunk = data[i:i + TYPE_CHUNK_MAX]
+            self._send(encode_type_text(chunk, self.protocol, self.use_crc))
+            # 流控: 等固件打完这一块再发下一块，避免固件串口缓冲区溢出
+            timeout = TYPE_ACK_TIMEOUT + len(chunk) * TYPE_ACK_TIMEOUT_PER_CHAR
+            if not self._wait_type_ack(len(chunk), timeout):
+                print(f"⚠️ [Lib] 文本输入未收到确认，已中止 ({i}/{len(data)} 字节)")
+                return False
+        return True
+
+    def _wait_type_ack(self, count, timeout):
+        expected = b"T:%d" % count
+        deadline = time.monotonic() + timeout
+        try:
+            with self.read_lock:
+                while time.monotonic() < deadline:
+                    line = self._read_line(deadline - time.monotonic())
+                    if line == expected:
+                        return True
+        except Exception as e:
+            self._link_lost(e)
+        return False
+
     def mouse_move(self, dx, dy):
-        self.send_packet_raw("M", f"{dx},{dy}")
+        """相对移动，超出 HID 范围的位移会被拆成多个包"""
+        if not self.connected:
+            if self.link_down.is_set():
+                self._hold_motion(dx, dy)
+            return
+        if self.motion_udp and not self.tx_thread:
+            # 网络中继: 同一次移动拆出的所有包合成一个数据报
+            self._write_motion(b"".join(self._encode_move(sx, sy) for sx, sy in split_delta(dx, dy)))
+            return
+        for sx, sy in split_delta(dx, dy):
+            if self.tx_thread:
+                self._enqueue_motion(sx, sy)
+            elif not self._send(self._encode_move(sx, sy)) and self.link_down.is_set():
+                self._hold_motion(sx, sy)
+
+    def _write_motion(self, payload):
+        if not (payload and self.connected and self.ser): return False
+        try:
+            self.ser.write_motion(payload)
+            return True
+        except Exception as e:
+            self._link_lost(e)
+            return False
+
+    def _enqueue_motion(self, dx, dy):
+        if not (self.connected and self.ser and self.ser.is_open):
+            return
+        self._enqueue([dx, dy], droppable=True)
+
+    # --- 绝对定位 ---
+
+    def set_mouse_mode(self, mode, geometry=None):
+        """
+        'relative'、'absolute' 或 'smooth'。绝对定位需要固件 v4.0+，平滑移动需要 v4.3+，
+        固件不支持时保持相对模式并返回 False。
+        geometry: kvm_screen.ScreenGeometry，本机坐标到 0-32767 的映射 (默认检测整个虚拟桌面)
+        """
+        if mode not in MOUSE_MODES:
+            raise ValueError(f"mouse_mode 必须是 {MOUSE_MODES} 之一")
+        if geometry is not None:
+            self.geometry = geometry
+        if mode == 'absolute':
+            self._ensure_geometry()
+        self.mouse_mode_req = mode
+        if not self.connected:
+            return True # 连接时再确认
+        return self._apply_mouse_mode()
+
+    def _ensure_geometry(self):
+        """在调用方线程检测本机桌面范围 (只检测一次)"""
+        if self.geometry is None:
+            self.geometry = ScreenGeometry.detect()
+        return self.geometry
+
+    def _apply_mouse_mode(self):
+        mode = self.mouse_mode_req
+        if mode in MODE_CAPS and not self.device_caps() & MODE_CAPS[mode]:
+            label = "绝对定位" if mode == 'absolute' else "平滑移动"
+            print(f"⚠️ [Lib] 固件不支持{label}，继续使用相对模式")
+            mode = 'relative'
+        self.motion.flush()
+        self.mouse_mode = mode
+        self.motion.absolute = (mode == 'absolute')
+        self.motion.set_smooth(self.mouse_sample if mode == 'smooth' else None)
+        if self.mirror_enabled and mode == 'absolute':
+            _load_pynput()
+            self.motion.move_to(*mouse.Controller().position) # 立即对齐远端光标
+        return mode == self.mouse_mode_req
+
+    def mouse_move_to(self, x, y):
+        """绝对定位到本机桌面坐标 (x, y)，按 geometry 映射 (需要固件支持)"""
+        self._ensure_geometry()
+        self._send_abs(x, y)
+
+    def _send_abs(self, x, y):
+        """镜像的发送线程使用: geometry 已在切换到绝对模式时检测好"""
+        ax, ay = self.geometry.to_hid(x, y)
+        self.mouse_move_abs(ax, ay)
+
+    def mouse_move_abs(self, ax, ay):
+        """绝对定位到 HID 坐标 (0-32767，覆盖目标机整个桌面)"""
+        payload = encode_abs(ax, ay, self.protocol, self.use_crc)
+        if self.motion_udp and not self.tx_thread:
+            self._write_motion(payload) # 网络中继: 走 UDP，过期的定位包直接被丢弃
+        else:
+            self._send(payload)
         
+    # --- 平滑移动 ---
+
+    def mouse_sample(self, t, dx, dy):
+        """
+        发送一个平滑移动样本: 上位机时间戳 t (毫秒, 16 位回绕) 之前累积的位移 (dx, dy)。
+        固件按相邻样本的时间间隔均匀播放位移，并在下一个样本到达前有限外推，
+        累计位移与样本之和严格相等。样本不能丢 (丢一个就少一段位移)，所以不走 UDP 中继
+        """
+        if not self.connected:
+            if self.link_down.is_set():
+                self._hold_motion(dx, dy)
+            return
+        if not self._send(encode_vel(t, dx, dy, self.protocol, self.use_crc)) and self.link_down.is_set():
+            self._hold_motion(dx, dy)
+
+    def scroll(self, wheel, pan=0):
+        """
+        滚动整格: wheel > 0 向上，pan > 0 向右 (超出 ±127 的部分拆成多个包)。
+        水平滚动需要固件 v4.4+，旧固件上忽略 (发过去会被当成未知指令)
+        """
+        if pan and self.connected and not self.device_caps() & CAP_HSCROLL:
+            if not self.hscroll_warned:
+                self.hscroll_warned = True
+                print("⚠️ [Lib] 固件不支持水平滚动，已忽略")
+            pan = 0
+        for w, p in split_delta(int(wheel), int(pan)):
+            if w: self.send_packet_raw("S", str(w))
+            if p: self.send_packet_raw("SH", str(p))
+
     def mouse_click(self, button="L"):
         """L, R, M"""
         self.send_packet_raw("MD", button)
@@ -143,96 +1387,146 @@ class ArduinoKVMClient:
     def set_target_os(self, os_type):
         """ 'WIN' or 'MAC' """
         self.target_os = os_type
+        self.keymap = KeyMap(os_type, self._encode)
+
+    def set_report_rate(self, rate_hz):
+        """镜像模式下鼠标位移的发送频率 (Hz)，例如 125/250/500/1000"""
+        self.motion.set_rate(rate_hz)
 
-    def start_mirroring(self):
+    def start_mirroring(self, capture='cursor', grab=False):
+        """
+        capture: 鼠标位移的来源 (见 kvm_capture.py)
+          'cursor'   由本机光标坐标变化推算 (默认，光标到屏幕边缘后无法继续移动)
+          'recenter' 指针锁定，本机光标离开中心区域时拉回，位移不受屏幕边缘限制
+          'evdev'    Linux 直接读取鼠标原始位移 (未经本机指针加速)；grab=True 时独占鼠标
+        捕获模式总是发送相对位移。
+        """
         if self.mirror_enabled: return
+        if capture not in CAPTURE_MODES:
+            raise ValueError(f"capture 必须是 {CAPTURE_MODES} 之一")
         
+        _load_pynput()
         # 初始化鼠标位置，防止第一次跳变
         m_controller = mouse.Controller()
-        self.prev_x, self.prev_y = m_controller.position
-        self.first_move = True
+        self.motion.reset_position(*m_controller.position)
+        self.virtual_pos = tuple(int(v) for v in m_controller.position)
+        if self.recorder is not None:
+            self.recorder.move(*m_controller.position) # 录制起点坐标
+        if capture == 'cursor' and self.mouse_mode == 'absolute':
+            self.motion.move_to(*m_controller.position) # 绝对模式: 先把远端光标对齐
         
-        self.m_listener = mouse.Listener(on_move=self._on_move, on_click=self._on_click, on_scroll=self._on_scroll)
-        self.k_listener = keyboard.Listener(on_press=self._on_press, on_release=self._on_release)
+        guard = self._guard_callback
+        if capture == 'evdev':
+            # 原始设备同时提供位移、按钮和滚轮，不再需要 pynput 鼠标监听 (否则点击会重复)
+            self.capture = EvdevCapture(self._on_raw_delta, on_button=guard(self._on_raw_button),
+                                        on_scroll=guard(lambda dx, dy: self._on_scroll(0, 0, dx, dy)), grab=grab)
+            self.m_listener = None
+        else:
+            on_move = self._on_move
+            if capture == 'recenter':
+                x, y, w, h = self._ensure_geometry().region
+                self.capture = RecenterCapture(self._on_raw_delta, (x + w // 2, y + h // 2), controller=m_controller)
+                on_move = self.capture.on_move
+            self.m_listener = mouse.Listener(on_move=guard(on_move), on_click=guard(self._on_click),
+                                             on_scroll=guard(self._on_scroll))
+        if self.capture is not None:
+            self.motion.absolute = False
+            self.capture.start()
+        self.motion.start()
+        self.k_listener = keyboard.Listener(on_press=guard(self._on_press), on_release=guard(self._on_release))
         
-        self.m_listener.start()
+        if self.m_listener: self.m_listener.start()
         self.k_listener.start()
         self.mirror_enabled = True
         print("🟢 [Lib] 镜像已启动")
 
+    def _guard_callback(self, fn):
+        """回调抛出异常时 pynput 会停止监听，按下的键就再也收不到松开事件: 先释放全部再继续"""
+        def wrapper(*args):
+            try:
+                return fn(*args)
+            except Exception as e:
+                print(f"❌ [Lib] 镜像回调异常: {e}，已释放所有按键")
+                self.send_packet_raw("REL", "0")
+        return wrapper
+
     def stop_mirroring(self):
         if not self.mirror_enabled: return
         
-        if self.m_listener: self.m_listener.stop()
-        if self.k_listener: self.k_listener.stop()
+        self.mirror_enabled = False
+        for listener in (self.m_listener, self.k_listener):
+            if listener is None: continue
+            listener.stop()
+            # 等正在执行的回调返回，避免它在 REL 之后又发出按下指令
+            if listener is not threading.current_thread():
+                listener.join(timeout=0.5)
+        if self.capture is not None:
+            self.capture.stop()
+            self.capture = None
+            self.motion.absolute = (self.mouse_mode == 'absolute')
+        self.motion.stop()
         
         # 发送复位防止卡键
         self.send_packet_raw("REL", "0")
-        self.mirror_enabled = False
         print("⚪ [Lib] 镜像已停止")
 
-    # --- 内部事件处理 ---
+    # --- 会话录制 ---
 
-    def _remap_key_for_mac(self, k):
-        if self.target_os != 'MAC': return k
-        if k == 'ctrl_l': return 'win'
-        if k == 'ctrl_r': return 'win'
-        if k == 'cmd':    return 'alt'
-        if k == 'win':    return 'alt'
-        if k == 'alt_l':  return 'ctrl_l'
-        if k == 'alt_r':  return 'ctrl_r'
-        return k
+    def start_recording(self, path):
+        """把镜像期间的输入事件追加到录制文件 (可以先开始录制再启动镜像)"""
+        self.stop_recording()
+        from kvm_trace import TraceRecorder
+        self.recorder = TraceRecorder(path)
+        if self.mirror_enabled:
+            self.recorder.move(*mouse.Controller().position)
+        print(f"🔴 [Lib] 开始录制: {path}")
+
+    def stop_recording(self):
+        if self.recorder is None: return
+        recorder, self.recorder = self.recorder, None
+        recorder.close()
+        print(f"⏹ [Lib] 录制结束: {recorder.events} 个事件")
+
+    # --- 内部事件处理 ---
 
     def _on_move(self, x, y):
-        current_time = time.time()
-        if current_time - self.last_mouse_time < self.MOUSE_RATE_LIMIT: return
-        self.last_mouse_time = current_time
-        
-        if self.first_move:
-            self.prev_x, self.prev_y = x, y
-            self.first_move = False
-            return
+        if self.recorder is not None: self.recorder.move(x, y)
+        self.motion.move_to(x, y)
 
-        dx, dy = x - self.prev_x, y - self.prev_y
-        self.prev_x, self.prev_y = x, y
-        
-        if dx != 0 or dy != 0:
-            self.send_packet_raw("M", f"{dx},{dy}")
+    def _on_raw_delta(self, dx, dy):
+        """捕获模式的位移 (不受屏幕边缘限制)"""
+        if self.recorder is not None:
+            vx, vy = self.virtual_pos
+            self.virtual_pos = (vx + dx, vy + dy)
+            self.recorder.move(*self.virtual_pos)
+        self.motion.add(dx, dy)
+
+    def _on_raw_button(self, code, pressed):
+        _load_pynput()
+        button = {"L": mouse.Button.left, "R": mouse.Button.right}.get(code, mouse.Button.middle)
+        self._on_click(0, 0, button, pressed)
 
     def _on_click(self, x, y, button, pressed):
-        btn_code = "L" if button == mouse.Button.left else "R" if button == mouse.Button.right else "M"
+        if self.recorder is not None: self.recorder.click(button, pressed)
+        self.motion.flush() # 先把未发送的位移发出去，点击才会落在正确位置
+        name = getattr(button, 'name', None) # 按名称比较，回放时无需导入 pynput 的平台后端
+        btn_code = "L" if name == 'left' else "R" if name == 'right' else "M"
         cmd = "MD" if pressed else "MU"
         self.send_packet_raw(cmd, btn_code)
 
     def _on_scroll(self, x, y, dx, dy):
-        self.send_packet_raw("S", str(dy))
+        if self.recorder is not None: self.recorder.scroll(dx, dy)
+        self.motion.add_scroll(dx, dy) # 与位移在同一周期合并，高精度滚动凑满整格才发送
 
     def _on_press(self, key):
-        try:
-            k = key.char
-            if k:
-                if 1 <= ord(k) <= 26: k = chr(ord(k) + 96)
-                k = self._remap_key_for_mac(k)
-                self.send_packet_raw("KD", k)
-        except AttributeError:
-            k = str(key).replace('Key.', '')
-            if k == 'cmd': k = 'win'
-            k = self._remap_key_for_mac(k)
-            self.send_packet_raw("KD", k)
+        if self.recorder is not None: self.recorder.key(key, True)
+        data = self.keymap.press(key)
+        if data: self._send(data)
 
     def _on_release(self, key):
-        try:
-            k = key.char
-            if k:
-                if 1 <= ord(k) <= 26: k = chr(ord(k) + 96)
-                k = self._remap_key_for_mac(k)
-                self.send_packet_raw("KU", k)
-        except AttributeError:
-            k = str(key).replace('Key.', '')
-            if k == 'cmd': k = 'win'
-            if 'media_' in k: return
-            k = self._remap_key_for_mac(k)
-            self.send_packet_raw("KU", k)
+        if self.recorder is not None: self.recorder.key(key, False)
+        data = self.keymap.release(key)
+        if data: self._send(data)
 
 if __name__ == "__main__":
     # 简单的库文件测试
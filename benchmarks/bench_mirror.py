@@ -0,0 +1,262 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import arduino_kvm_lib
+from kvm_emulator import KVMEmulator, EmulatorServer
+from kvm_trace import TraceKey
+
+# ==========================================
+# 镜像管线基准测试
+# ==========================================
+# 以受控速率直接调用 ArduinoKVMClient 的 pynput 回调 (_on_move / _on_press / _on_release)，
+# 在本地固件模拟器上测量: 每事件延迟 p50/p99、每事件字节数、被合并/丢弃的事件数、CPU 时间。
+# 按键用 kvm_trace.TraceKey 代替 pynput 对象，无显示器的机器 (CI) 上也能运行。
+# 结果可输出为 JSON，便于在不同提交之间比较:
+#
+#   python benchmarks/bench_mirror.py --json results.json
+#   python benchmarks/bench_mirror.py --scenario motion --rate 1000 --report-rate 500 --protocol text
+
+SCENARIOS = ('motion', 'key_repeat', 'typing')
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def pace(start, i, interval):
+    """等到第 i 个事件的计划时间 (先 sleep 再自旋，保证 1 kHz 下的精度)"""
+    target = start + i * interval
+    while True:
+        remaining = target - time.perf_counter()
+        if remaining <= 0:
+            return
+        if remaining > 0.002:
+            time.sleep(remaining - 0.001)
+
+
+def wait_idle(emu, timeout=2.0):
+    """等到模拟器在 50ms 内不再收到新数据"""
+    deadline = time.monotonic() + timeout
+    last = -1
+    while time.monotonic() < deadline:
+        n = emu.bytes_in
+        if n == last:
+            return
+        last = n
+        time.sleep(0.05)
+
+
+def make_client(args, emu):
+    server = EmulatorServer(emu).start()
+    client = arduino_kvm_lib.ArduinoKVMClient(
+        server.url, async_tx=args.async_tx, report_rate=args.report_rate,
+        protocol=args.protocol, crc=args.crc,
+        auto_reconnect=False)  # 不发心跳 (STAT)，线上字节只来自被测事件
+    if not client.connect():
+        raise SystemExit(f"无法连接模拟器: {client.error_msg}")
+    return client, server
+
+
+def summarize(latencies_ms, emu, events, cpu, wall, extra=None):
+    """latencies_ms 为 None 时不输出百分位 (场景自己在 extra 中报告延迟)"""
+    result = {"events": events}
+    if latencies_ms is not None:
+        result.update({
+            "latency_p50_ms": round(percentile(latencies_ms, 0.50), 3),
+            "latency_p99_ms": round(percentile(latencies_ms, 0.99), 3),
+            "latency_max_ms": round(max(latencies_ms), 3) if latencies_ms else 0.0,
+        })
+    result.update({
+        "wire_bytes": emu.bytes_in,
+        "bytes_per_event": round(emu.bytes_in / events, 3) if events else 0.0,
+        "cpu_s": round(cpu, 4),
+        "wall_s": round(wall, 4),
+    })
+    if extra:
+        result.update(extra)
+    return result
+
+
+def bench_motion(args):
+    """稳定速率的鼠标移动，每个事件 dx=+1，按累计位移对应到线上的包"""
+    emu = KVMEmulator(screen=(1 << 30, 1 << 30))
+    client, server = make_client(args, emu)
+    emu.reset_stats()
+    client.motion.reset_position(0, 0)
+    client.motion.start()
+
+    n = int(args.rate * args.duration)
+    interval = 1.0 / args.rate
+    sent = []
+    cpu0, t0 = time.process_time(), time.perf_counter()
+    for i in range(n):
+        pace(t0, i, interval)
+        sent.append(time.monotonic())
+        client._on_move(i + 1, 0)
+    client.motion.flush()
+    wait_idle(emu)
+    cpu, wall = time.process_time() - cpu0, time.perf_counter() - t0
+
+    # 每个事件的延迟 = 第一个使累计位移覆盖到该事件的包的到达时间 - 事件时间
+    packets = [(t, int(d.split(',')[0])) for t, c, d in emu.log if c == "M"]
+    latencies = []
+    j, received = 0, 0
+    for i, ts in enumerate(sent):
+        while j < len(packets) and received < i + 1:
+            received += packets[j][1]
+            j += 1
+        if received < i + 1:
+            break
+        latencies.append((packets[j - 1][0] - ts) * 1000)
+
+    total = sum(dx for _, dx in packets)
+    extra = {
+        "packets": len(packets),
+        "coalesced": n - len(packets),
+        "lost_motion": n - total,
+        "tx_dropped": client.tx_dropped,
+    }
+    result = summarize(latencies, emu, n, cpu, wall, extra)  # 断开前统计，不计入断开时的 REL
+    client.disconnect()
+    server.stop()
+    return result
+
+
+def bench_key_repeat(args):
+    """模拟系统按键自动重复: 同一个键连续 KD，最后一个 KU
+
+    重复的 KD 在客户端被丢弃，线上只剩第一个 KD 和最后的 KU，
+    所以只报告这两个延迟: 第一次按下 -> KD 到达、松开 -> KU 到达 (两个值没有百分位可言)。
+    """
+    emu = KVMEmulator()
+    client, server = make_client(args, emu)
+    emu.reset_stats()
+    key = TraceKey(char='a')
+    client.keymap.press(key)  # 预先建立按键表 (只查表不发送)，第一次按下的延迟不含建表时间
+    dropped0, saved0 = client.held.repeats_dropped, client.held.bytes_saved
+
+    n = int(args.rate * args.duration)
+    interval = 1.0 / args.rate
+    first = None
+    cpu0, t0 = time.process_time(), time.perf_counter()
+    for i in range(n):
+        pace(t0, i, interval)
+        if first is None:
+            first = time.monotonic()
+        client._on_press(key)
+    released = time.monotonic()
+    client._on_release(key)
+    wait_idle(emu)
+    cpu, wall = time.process_time() - cpu0, time.perf_counter() - t0
+
+    downs = [t for t, c, _ in emu.log if c == "KD"]
+    ups = [t for t, c, _ in emu.log if c == "KU"]
+    if not downs or not ups:
+        client.disconnect()
+        server.stop()
+        raise SystemExit(f"❌ key_repeat: 模拟器没有收到按下/松开 (KD={len(downs)}, KU={len(ups)})，结果无效")
+    extra = {
+        "packets": len(downs) + len(ups),
+        "press_latency_ms": round((downs[0] - first) * 1000, 3),
+        "release_latency_ms": round((ups[-1] - released) * 1000, 3),
+        "repeats_dropped": client.held.repeats_dropped - dropped0,
+        "bytes_saved": client.held.bytes_saved - saved0,
+        "stuck_keys": sorted(emu.pressed_keys()),
+    }
+    result = summarize(None, emu, n, cpu, wall, extra)
+    client.disconnect()
+    server.stop()
+    return result
+
+
+def bench_typing(args):
+    """批量输入文本，延迟按字符计: 该字符所在块被模拟器确认的时间 - 调用开始时间"""
+    emu = KVMEmulator()
+    client, server = make_client(args, emu)
+    emu.reset_stats()
+    text = ("The quick brown fox jumps over the lazy dog 0123456789!\n" * 64)[:args.text_size]
+
+    cpu0, t0 = time.process_time(), time.perf_counter()
+    start = time.monotonic()
+    client.type_text(text, delay=0)
+    wait_idle(emu)
+    cpu, wall = time.process_time() - cpu0, time.perf_counter() - t0
+
+    latencies = []
+    for t, c, d in emu.log:
+        if c == "T":
+            latencies += [(t - start) * 1000] * d
+        elif c == "KU":
+            latencies.append((t - start) * 1000)
+    typed = len(emu.typed) or emu.counts.get("KU", 0)
+    extra = {"typed": typed, "chars_per_s": round(typed / wall, 1) if wall else 0.0}
+    result = summarize(latencies, emu, len(text), cpu, wall, extra)
+    client.disconnect()
+    server.stop()
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Arduino KVM 镜像管线基准测试")
+    parser.add_argument("--scenario", choices=SCENARIOS + ('all',), default='all')
+    parser.add_argument("--rate", type=float, default=1000, help="输入事件速率 (Hz)")
+    parser.add_argument("--duration", type=float, default=2.0, help="每个场景的持续时间 (秒)")
+    parser.add_argument("--report-rate", type=int, default=arduino_kvm_lib.DEFAULT_REPORT_RATE)
+    parser.add_argument("--protocol", choices=('auto', 'text', 'v2'), default='auto')
+    parser.add_argument("--crc", action="store_true")
+    parser.add_argument("--async-tx", action="store_true", help="启用写线程发送管线")
+    parser.add_argument("--text-size", type=int, default=1024, help="typing 场景的文本长度")
+    parser.add_argument("--json", metavar="PATH", help="结果写入 JSON 文件 (- 为标准输出)")
+    args = parser.parse_args()
+
+    names = SCENARIOS if args.scenario == 'all' else (args.scenario,)
+    benches = {'motion': bench_motion, 'key_repeat': bench_key_repeat, 'typing': bench_typing}
+    results = {}
+    for name in names:
+        print(f"▶ {name} ...", file=sys.stderr)
+        results[name] = benches[name](args)
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "params": {k: v for k, v in vars(args).items() if k not in ('json', 'scenario')},
+        "results": results,
+    }
+
+    for name, r in results.items():
+        if "latency_p50_ms" in r:
+            latency = f"p50={r['latency_p50_ms']:8.3f}ms  p99={r['latency_p99_ms']:8.3f}ms"
+        else:
+            latency = f"按下={r['press_latency_ms']:6.3f}ms  松开={r['release_latency_ms']:6.3f}ms"
+        print(f"{name:11s} events={r['events']:6d}  {latency}  bytes/event={r['bytes_per_event']:6.2f}  "
+              f"cpu={r['cpu_s']:.3f}s", file=sys.stderr)
+
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+    elif args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ==========================================
+# 冷启动基准测试
+# ==========================================
+# 每次测量都启动一个全新的解释器 (没有已导入的模块)，取多次运行的中位数，
+# 与下面的预算比较。用于检查启动器 / 单个宏的命令行调用没有被重新引入的全局导入拖慢:
+#
+#   python benchmarks/bench_startup.py
+#   python benchmarks/bench_startup.py --runs 20 --json startup.json --check
+#
+# 每个场景报告两个数值:
+#   wall_ms    从启动进程到进程退出的总时间 (包括解释器本身的启动)
+#   import_ms  进程内测得的时间 (导入 / 构造)，不含解释器启动
+# gui_cold 需要图形环境，没有显示器时标记为 skipped。
+
+# 场景名 -> (进程内执行的代码, import_ms 预算)
+SCENARIOS = {
+    # 只想 type_text 的脚本: 不应加载 pynput / list_ports
+    "lib_import": ("import arduino_kvm_lib", 150),
+    # 构造客户端不扫描串口
+    "lib_client": ("import arduino_kvm_lib; arduino_kvm_lib.ArduinoKVMClient()", 150),
+    # GUI 模块导入 (tkinter + 库 + 宏引擎)
+    "gui_import": ("import run_kvm_gui", 250),
+    # GUI 首次绘制完成 (含一次串口扫描与自动连接尝试)
+    "gui_cold": ("import tkinter, run_kvm_gui; root = tkinter.Tk(); app = run_kvm_gui.KVMGuiApp(root); "
+                 "root.update(); _t1 = __import__('time').perf_counter(); app.on_close()", 1500),
+    # 命令行列出宏 (不加载串口库)
+    "cli_list": (None, 150),
+}
+
+# 这些模块出现在 lib_import 里说明懒加载失效了
+HEAVY_MODULES = ("pynput", "serial.tools.list_ports", "kvm_trace", "kvm_relay", "asyncio")
+
+PROBE = """
+import sys, time, json
+sys.path.insert(0, {root!r})
+_t0 = time.perf_counter()
+_t1 = None
+{code}
+_t1 = _t1 or time.perf_counter()
+print(json.dumps({{"import_ms": (_t1 - _t0) * 1000,
+                  "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else 0.0
+
+
+def run_once(name, code):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    t0 = time.perf_counter()
+    if code is None:
+        # 命令行场景直接运行脚本，进程内时间无法测得，以总时间减去空解释器的时间代替
+        args = [sys.executable, os.path.join(ROOT, "kvm_macro.py"),
+                os.path.join(ROOT, "macros", "stream_deck.json"), "list"]
+    else:
+        args = [sys.executable, "-c", PROBE.format(root=ROOT, code=code, heavy=HEAVY_MODULES)]
+    proc = subprocess.run(args, cwd=ROOT, env=env, capture_output=True, text=True)
+    wall = (time.perf_counter() - t0) * 1000
+    if proc.returncode != 0:
+        return {"error": (proc.stderr.strip().splitlines() or ["exit %d" % proc.returncode])[-1]}
+    result = {"wall_ms": wall}
+    if code is not None:
+        result.update(json.loads(proc.stdout.strip().splitlines()[-1]))
+    return result
+
+
+def bench(name, code, budget, runs, baseline):
+    samples = []
+    for _ in range(runs):
+        r = run_once(name, code)
+        if "error" in r:
+            return {"skipped": r["error"], "budget_ms": budget}
+        samples.append(r)
+    wall = median([s["wall_ms"] for s in samples])
+    if code is None:
+        imp = max(wall - baseline, 0.0)
+    else:
+        imp = median([s["import_ms"] for s in samples])
+    return {
+        "wall_ms": wall,
+        "import_ms": imp,
+        "budget_ms": budget,
+        "over_budget": imp > budget,
+        "heavy_modules": samples[0].get("heavy", []),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Arduino KVM 冷启动基准测试")
+    parser.add_argument("--scenario", choices=tuple(SCENARIOS) + ('all',), default='all')
+    parser.add_argument("--runs", type=int, default=7, help="每个场景运行的次数 (取中位数)")
+    parser.add_argument("--json", metavar="PATH", help="结果写入 JSON 文件 (- 为标准输出)")
+    parser.add_argument("--check", action="store_true", help="有场景超出预算时返回非零退出码")
+    args = parser.parse_args()
+
+    # 空解释器的启动时间，作为命令行场景的基线
+    baseline = median([run_once("python", "pass")["wall_ms"] for _ in range(args.runs)])
+
+    names = tuple(SCENARIOS) if args.scenario == 'all' else (args.scenario,)
+    results = {}
+    for name in names:
+        print(f"▶ {name} ...", file=sys.stderr)
+        code, budget = SCENARIOS[name]
+        results[name] = bench(name, code, budget, args.runs, baseline)
+
+    print(f"{'python':11s} wall={baseline:8.1f}ms", file=sys.stderr)
+    failed = False
+    for name, r in results.items():
+        if "skipped" in r:
+            print(f"{name:11s} skipped ({r['skipped']})", file=sys.stderr)
+            continue
+        mark = "❌" if r["over_budget"] else "✅"
+        heavy = f"  heavy={','.join(r['heavy_modules'])}" if r["heavy_modules"] else ""
+        print(f"{name:11s} wall={r['wall_ms']:8.1f}ms  startup={r['import_ms']:8.1f}ms  "
+              f"budget={r['budget_ms']:6d}ms {mark}{heavy}", file=sys.stderr)
+        failed = failed or r["over_budget"]
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "baseline_ms": baseline,
+        "results": results,
+    }
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+    elif args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 1 if args.check and failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
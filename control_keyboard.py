@@ -4,7 +4,7 @@ import sys
 
 # 配置部分
 SERIAL_PORT = 'COM5'  # 你的 USB-TTL 模块端口
-BAUD_RATE = 9600      # 必须与 Arduino 代码中的 Serial1.begin(9600) 一致
+BAUD_RATE = 115200    # 必须与固件的上电速率 Serial1.begin(SERIAL_BAUD) 一致
 
 def main():
     try:
@@ -2,7 +2,7 @@ import serial
 import time
 
 SERIAL_PORT = 'COM5'
-BAUD_RATE = 9600
+BAUD_RATE = 115200  # 固件上电速率
 
 def debug_mouse_response():
     print(f"🕵️‍♀️ 深度分析 COM5 返回数据 - {SERIAL_PORT}")
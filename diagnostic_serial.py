@@ -2,7 +2,7 @@ import serial
 import time
 
 SERIAL_PORT = 'COM5'
-BAUD_RATES = [9600, 115200]  # 尝试最常见的两种波特率
+BAUD_RATES = [115200, 2000000, 1000000, 500000, 250000, 230400, 9600]  # 上电速率、可协商的速率 (上次会话未切回时)、旧版固件
 
 def full_diagnostic():
     print("🔬 开始全面串口诊断...")
@@ -21,6 +21,11 @@ def full_diagnostic():
                 ser.reset_input_buffer()
                 
                 test_payloads = [
+                    # 固件 4.1+ 回复当前速率 (B:<速率>)
+                    (b'B:0\n', "速率查询 'B:0'"),
+                    # 固件 3.8+ 会对这两条握手指令作出回复 (V:2,0 / A:255)
+                    (b'V:2,0\n', "协议握手 'V:2,0'"),
+                    (b'SEQ:0\n', "可靠模式握手 'SEQ:0'"),
                     (b'A', "纯字符 'A'"),
                     (b'A\n', "带换行 'A\\n'"),
                     (b'E', "纯字符 'E'"), 
@@ -0,0 +1,245 @@
+import asyncio
+import concurrent.futures
+import threading
+
+import arduino_kvm_lib
+from arduino_kvm_lib import (
+    ArduinoKVMClient, TYPE_CHUNK_MAX, TYPE_ACK_TIMEOUT, TYPE_ACK_TIMEOUT_PER_CHAR, encode_type_text,
+)
+
+# ==========================================
+# asyncio 版客户端
+# ==========================================
+# ArduinoKVMClient 的 send_combo / send_key_click / mouse_click / type_text 用 time.sleep 计时，
+# 在 Tk 主线程里调用会卡住整个界面。这里的同名方法都是协程，用 await asyncio.sleep 计时:
+#   - 所有调用方共用一个有序的发送队列，由唯一的写任务按入队顺序写出，多个宏可以并发执行
+#   - 串口读写放在单线程执行器中进行，事件循环本身从不阻塞
+#   - 组合键 / 文本输入是普通的 asyncio Task，可以随时 cancel()，取消时会松开已按下的键
+#
+# 协议协商、编码、可靠模式等仍由 ArduinoKVMClient 完成 (可传入已有的同步客户端共用同一串口)。
+#
+#   kvm = AsyncArduinoKVMClient("COM5")
+#   await kvm.connect()
+#   task = kvm.spawn(kvm.send_combo(['ctrl_l', 'c']))
+#   await kvm.type_text("hello")
+#   await kvm.disconnect()
+
+
+class AsyncArduinoKVMClient:
+    def __init__(self, port=None, baud_rate=115200, client=None, **kwargs):
+        """
+        client: 已有的 ArduinoKVMClient (例如 GUI 中负责镜像的实例)；不传则按 port/kwargs 新建
+        """
+        self.client = client or ArduinoKVMClient(port, baud_rate, **kwargs)
+        self.owns_client = client is None
+        self.queue = None          # asyncio.Queue: 有序发送队列 (bytes 或 Future 栅栏)
+        self.writer = None         # 写任务
+        self.type_lock = None      # 同一时间只允许一个文本输入流 (否则字符会交错)
+        # 串口 I/O 专用线程: 单线程保证写出顺序与入队顺序一致
+        self.io = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="kvm-aio")
+
+    @property
+    def connected(self):
+        return self.client.connected
+
+    # --- 连接 ---
+
+    async def connect(self):
+        """共用的同步客户端由其所有者负责连接，这里只启动写任务"""
+        loop = asyncio.get_running_loop()
+        if self.owns_client and not self.client.connected:
+            ok = await loop.run_in_executor(self.io, self.client.connect)
+            if not ok:
+                return False
+        self._start_writer()
+        return True
+
+    def _start_writer(self):
+        if self.writer and not self.writer.done():
+            return
+        self.queue = asyncio.Queue()
+        self.type_lock = asyncio.Lock()
+        self.writer = asyncio.get_running_loop().create_task(self._write_loop())
+
+    async def disconnect(self):
+        """发完队列中的指令后断开 (共用的同步客户端由其所有者断开)"""
+        if self.writer:
+            await self.drain()
+            self.writer.cancel()
+            try:
+                await self.writer
+            except asyncio.CancelledError:
+                pass
+            self.writer = None
+        if self.owns_client:
+            await asyncio.get_running_loop().run_in_executor(self.io, self.client.disconnect)
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            try:
+                if isinstance(item, asyncio.Future):
+                    # 栅栏: 之前入队的指令都已写出
+                    if not item.done():
+                        item.set_result(None)
+                    continue
+                # 把已经排队的指令一起取出，一次切换到 I/O 线程写出
+                batch = [item]
+                while not self.queue.empty() and len(batch) < arduino_kvm_lib.TX_BATCH_MAX:
+                    nxt = self.queue.get_nowait()
+                    self.queue.task_done()
+                    if isinstance(nxt, asyncio.Future):
+                        await loop.run_in_executor(self.io, self._send_batch, batch)
+                        batch = []
+                        if not nxt.done():
+                            nxt.set_result(None)
+                        continue
+                    batch.append(nxt)
+                if batch:
+                    await loop.run_in_executor(self.io, self._send_batch, batch)
+            finally:
+                self.queue.task_done()
+
+    def _send_batch(self, batch):
+        for payload in batch:
+            self.client._send(payload)
+
+    def _put(self, payload):
+        # 未连接时由 client._send 丢弃，这里不做判断 (共用客户端可能稍后才连接)
+        if self.queue is None:
+            return
+        self.queue.put_nowait(payload)
+
+    async def drain(self):
+        """等待此前入队的指令全部写出"""
+        if self.queue is None:
+            return
+        fence = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait(fence)
+        await fence
+
+    def spawn(self, coro):
+        """以 Task 方式运行一个宏，返回的 Task 可以 cancel()"""
+        return asyncio.get_running_loop().create_task(coro)
+
+    # --- 基础指令 (入队即返回，不等待写出) ---
+
+    def send_packet_raw(self, header, data):
+        self._put(self.client._encode(header, data))
+
+    def send_key_down(self, key):
+        self.send_packet_raw("KD", key)
+
+    def send_key_up(self, key):
+        self.send_packet_raw("KU", key)
+
+    def mouse_move(self, dx, dy):
+        for sx, sy in arduino_kvm_lib.split_delta(dx, dy):
+            self._put(self.client._encode_move(sx, sy))
+
+    def scroll(self, wheel, pan=0):
+        """pan: 水平滚动 (固件 v4.4+，旧固件当作未知指令忽略)"""
+        for w, p in arduino_kvm_lib.split_delta(int(wheel), int(pan)):
+            if w: self.send_packet_raw("S", str(w))
+            if p: self.send_packet_raw("SH", str(p))
+
+    # --- 宏 (协程) ---
+
+    async def send_key_click(self, key, duration=0.05):
+        self.send_key_down(key)
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            self.send_key_up(key)
+
+    async def send_combo(self, keys, duration=0.02):
+        """发送组合键列表 ['ctrl_l', 'c']；被取消时按相反顺序松开已按下的键"""
+        down = []
+        try:
+            for k in keys:
+                self.send_key_down(k)
+                down.append(k)
+                await asyncio.sleep(duration)
+            await asyncio.sleep(0.05)
+            while down:
+                self.send_key_up(down.pop())
+                await asyncio.sleep(duration)
+        finally:
+            for k in reversed(down):
+                self.send_key_up(k)
+
+    async def mouse_click(self, button="L", duration=0.05):
+        self.send_packet_raw("MD", button)
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            self.send_packet_raw("MU", button)
+
+    async def type_text(self, text, delay=0.02):
+        """
+        输入文本。固件支持 T 指令时按块发送并等待确认 (流控)，否则逐字符 KD/KU。
+        被取消时停在当前块之后，已发送的块仍会被固件输入完。
+        """
+        loop = asyncio.get_running_loop()
+        async with self.type_lock:
+            await self.drain()
+            bulk = await loop.run_in_executor(self.io, self.client._probe_bulk_text)
+            if not bulk:
+                for char in text:
+                    self.send_key_down(char)
+                    self.send_key_up(char)
+                    await asyncio.sleep(delay)
+                return True
+
+            data = text.encode('ascii', 'ignore')
+            c = self.client
+            for i in range(0, len(data), TYPE_CHUNK_MAX):
+                chunk = data[i:i + TYPE_CHUNK_MAX]
+                self._put(encode_type_text(chunk, c.protocol, c.use_crc))
+                await self.drain()
+                timeout = TYPE_ACK_TIMEOUT + len(chunk) * TYPE_ACK_TIMEOUT_PER_CHAR
+                # 等待确认放在默认线程池，写线程可以继续发送其他调用方的指令
+                if not await loop.run_in_executor(None, c._wait_type_ack, len(chunk), timeout):
+                    print(f"⚠️ [Async] 文本输入未收到确认，已中止 ({i}/{len(data)} 字节)")
+                    return False
+            return True
+
+    def release_all(self):
+        """松开所有键和鼠标按钮"""
+        self.send_packet_raw("REL", "0")
+
+
+class KVMLoopThread:
+    """
+    在后台线程运行事件循环，供 Tk 等同步界面提交宏而不阻塞主线程:
+
+        runner = KVMLoopThread(AsyncArduinoKVMClient(client=kvm)).start()
+        future = runner.submit(runner.kvm.send_combo(['win', 'l']))   # future.cancel() 可取消
+    """
+
+    def __init__(self, kvm):
+        self.kvm = kvm
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="kvm-async", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.call(self.kvm.connect())
+        return self
+
+    def submit(self, coro):
+        """提交协程，返回 concurrent.futures.Future (可 cancel)"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call(self, coro, timeout=None):
+        """提交协程并等待结果"""
+        return self.submit(coro).result(timeout)
+
+    def stop(self, timeout=2.0):
+        try:
+            self.call(self.kvm.disconnect(), timeout)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=timeout)
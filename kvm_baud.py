@@ -0,0 +1,271 @@
+import json
+import os
+import threading
+import time
+
+# ==========================================
+# 串口速率协商
+# ==========================================
+# 固件上电为 115200，这也是 USB-TTL 模块 + Serial1 链路的上限 (约 11 KB/s，限制了鼠标报告率)。
+# connect() 时在 115200 下与固件协商更高的速率:
+#   1. 上位机发送 "B:<速率>"，固件用当前速率回复 "B:<速率>"，发送完后切换；上位机收到回复后同样切换
+#   2. 上位机在新速率下做突发回显测试: 连续发送 BURST_LINES 行 "E:<数据>"，固件原样回复，
+#      统计丢失/出错的行数 (误码率)
+#   3. 误码率不超过 BAUD_MAX_ERROR_RATE 才发送 "B:0" 确认；否则上位机切回原速率，
+#      固件在 BAUD_CONFIRM_MS 内收不到确认也会自动退回 (链路是乱码时确认不可能被收到)
+#   候选速率从高到低逐个尝试，直到找到可用的速率；都不可用则保持 115200。
+#   突发测试出错数一超过允许值就停止。固件每收到一行 E 都重新计时，上位机从最后一行 E 算起等它退回，
+#   一个不可用的速率约花 BAUD_CONFIRM_MS。
+#   旧固件不认识 B 指令，不回复，保持 115200 (这个结果只缓存 NO_BAUD_TTL 秒，刷新固件后会重新探测)。
+#   pyserial URL (socket://、loop:// 等) 不是真实串口，不协商。
+#
+# 选定的速率按设备缓存在 ~/.arduino_kvm/baud_cache.json (USB VID:PID + 序列号，没有时用端口名)，
+# 下次连接直接切换到缓存的速率，只做一次确认往返，不再做突发测试；确认失败才重新探测。
+# disconnect() 时切回 115200，其他工具 (中继服务器、调试脚本) 仍可按上电速率连接；
+# 如果上一次会话没有切回 (进程崩溃)，连接时会先在缓存的速率下查询固件。
+
+BASE_BAUD = 115200
+# 从高到低尝试。CH340 / CP2102N 支持到 2M，CP2102 只到 1M 左右；
+# ATmega32U4 (16MHz, U2X) 在 2M/1M/500k/250k 下没有分频误差
+BAUD_CANDIDATES = (2000000, 1000000, 500000, 250000, 230400)
+
+BAUD_CONFIRM_MS = 500      # 与固件一致: 切换后等待确认的时间
+BAUD_REPLY_TIMEOUT = 0.3   # 等待 B 指令回复的时间
+BAUD_SETTLE = 0.02         # 切换速率后等适配器稳定
+BURST_LINES = 64           # 突发测试的回显行数
+BURST_PAYLOAD = 48         # 每行的数据长度 ("E:" + 数据 + "\n" 小于固件的 LINE_MAX)
+BURST_WINDOW = 2           # 同时在途的行数 (固件环形缓冲 128 字节)
+BURST_TIMEOUT = 1.0        # 正常的链路在 230400 下也只要约 0.2 秒
+BAUD_MAX_ERROR_RATE = 0.0  # 允许的误码率 (出错行数 / 发送行数)；HID 链路不能容忍误码
+
+NO_BAUD_TTL = 600          # "固件不支持 B 指令" 的缓存有效期 (秒)
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".arduino_kvm", "baud_cache.json")
+
+
+def negotiable(port):
+    """只有真实串口才协商速率 (socket:// 等 URL 上设置 baudrate 没有意义)"""
+    return "://" not in port
+
+
+def device_key(port, ports=()):
+    """
+    缓存键: USB 设备用 VID:PID:序列号 (端口号变化后仍能命中)，其他情况用端口名；
+    URL (socket:// 等，端口号通常是临时的) 不缓存，返回 None
+    ports: serial.tools.list_ports.comports() 的结果
+    """
+    if "://" in port:
+        return None
+    for p in ports:
+        if p.device == port and p.vid is not None:
+            return f"{p.vid:04X}:{p.pid:04X}:{p.serial_number or p.location or port}"
+    return port
+
+
+class BaudCache:
+    """设备 -> 协商结果 的 JSON 缓存 (写入失败只打印警告，不影响连接)"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = None
+
+    def _load(self):
+        if self.entries is None:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+        return self.entries
+
+    def get(self, key):
+        """缓存的速率，没有或已过期时返回 None"""
+        with self.lock:
+            entry = self._load().get(key)
+        if not isinstance(entry, dict):
+            return None
+        if entry.get("expires") is not None and time.time() > entry["expires"]:
+            return None
+        return entry.get("baud")
+
+    def put(self, key, baud, error_rate=0.0, ttl=None):
+        """ttl: 有效期 (秒)，None 为长期有效"""
+        entry = {"baud": baud, "error_rate": error_rate, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        if ttl is not None:
+            entry["expires"] = time.time() + ttl
+        with self.lock:
+            self._load()[key] = entry
+            self._save()
+
+    def forget(self, key):
+        with self.lock:
+            if self._load().pop(key, None) is not None:
+                self._save()
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"⚠️ [Baud] 无法写入速率缓存 {self.path}: {e}")
+
+
+# ==========================================
+# 协商步骤 (直接读写串口对象，调用方负责加锁)
+# ==========================================
+
+def _wait_reply(ser, prefix, timeout):
+    """读到以 prefix 开头的一行，返回其余部分；超时返回 None (其他行忽略)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        line = ser.readline().strip()
+        if line.startswith(prefix):
+            return line[len(prefix):]
+    return None
+
+
+def _set_rate(ser, rate):
+    ser.baudrate = rate
+    time.sleep(BAUD_SETTLE)
+    ser.reset_input_buffer()
+
+
+def query_baud(ser, timeout=BAUD_REPLY_TIMEOUT):
+    """B:0 -> 固件当前速率；不回复 (旧固件或速率不匹配) 返回 None"""
+    ser.reset_input_buffer()
+    ser.write(b"B:0\n")
+    reply = _wait_reply(ser, b"B:", timeout)
+    try:
+        rate = int(reply) if reply is not None else 0
+    except ValueError:
+        rate = 0
+    return rate or None  # 0: 回环 (loop://) 原样返回了查询本身
+
+
+def request_baud(ser, rate, timeout=BAUD_REPLY_TIMEOUT):
+    """发送 B:<rate>，返回固件回复的速率 (等于 rate 表示固件已切换)；没有回复返回 None"""
+    ser.reset_input_buffer()
+    ser.write(f"B:{rate}\n".encode("ascii"))
+    reply = _wait_reply(ser, b"B:", timeout)
+    try:
+        return int(reply) if reply is not None else None
+    except ValueError:
+        return None
+
+
+def burst_test(ser, lines=BURST_LINES, payload=BURST_PAYLOAD, window=BURST_WINDOW, timeout=BURST_TIMEOUT,
+               max_errors=None):
+    """
+    突发回显测试，返回 (出错 (丢失或内容不符) 的行数, 最后一行 E 的发送时间)。
+    固件每收到一行 E 都会重新开始 BAUD_CONFIRM_MS 计时，失败后要从最后一行算起等它退回。
+    数据覆盖全部可打印字符且每行不同，错位的回复也能识别出来。
+    max_errors: 出错行数超过它就停止 (结果已经不合格)，未测的行计为出错
+    """
+    expected = []
+    for i in range(lines):
+        data = "".join(chr(0x21 + (i * 7 + j * 13) % 94) for j in range(payload))
+        expected.append(b"E:" + data.encode("ascii"))
+    sent = replied = matched = 0
+    last_sent = time.monotonic()
+    deadline = last_sent + timeout
+    while replied < lines and time.monotonic() < deadline:
+        while sent < lines and sent - replied < window:
+            ser.write(expected[sent] + b"\n")
+            last_sent = time.monotonic()
+            sent += 1
+        line = ser.readline().rstrip(b"\r\n")
+        if line.startswith(b"O:"):
+            continue  # 固件的溢出报告，对应的行会因为丢失而计为错误
+        # 读超时 (行丢失) 或乱码也算作一次回复，窗口继续前进
+        if line == expected[replied]:
+            matched += 1
+        replied += 1
+        if max_errors is not None and replied - matched > max_errors:
+            break
+    return lines - matched, last_sent
+
+
+def switch_baud(ser, base, rate, burst=True):
+    """
+    从 base 切换到 rate。返回 (是否成功, 误码率)；失败时上位机和固件都已回到 base。
+    burst=False 时只做确认往返 (使用缓存的速率)。
+    """
+    reply = request_baud(ser, rate)
+    last_tx = time.monotonic()  # 固件从切换 (以及之后每收到一行 E) 开始计时 BAUD_CONFIRM_MS
+    if reply != rate:
+        if reply is None:
+            # 回复丢失时固件可能已经切换，等它超时退回
+            time.sleep(BAUD_CONFIRM_MS / 1000)
+            ser.reset_input_buffer()
+        return False, None  # 固件不支持该速率
+    error_rate = 1.0
+    try:
+        _set_rate(ser, rate)
+        max_errors = int(BAUD_MAX_ERROR_RATE * BURST_LINES)
+        error_rate = 0.0
+        if burst:
+            errors, last_tx = burst_test(ser, max_errors=max_errors)
+            error_rate = errors / BURST_LINES
+        # 误码率合格才发送确认 (B:0)，确认的回复也必须在新速率下正确收到
+        if error_rate <= BAUD_MAX_ERROR_RATE and query_baud(ser) == rate:
+            return True, error_rate
+    except (OSError, ValueError) as e:
+        # 适配器不支持该速率时 pyserial 设置 baudrate 就会报错
+        print(f"⚠️ [Baud] 串口无法使用 {rate}: {e}")
+    # 不发送确认，等固件超时退回原速率: 从最后一行 E 算起 (已经过去的时间不用再等)
+    _set_rate(ser, base)
+    remaining = BAUD_CONFIRM_MS / 1000 - (time.monotonic() - last_tx)
+    time.sleep(max(0.0, remaining) + BAUD_SETTLE)
+    ser.reset_input_buffer()
+    return False, error_rate
+
+
+def negotiate(ser, base=BASE_BAUD, target='auto', cached=None, candidates=BAUD_CANDIDATES):
+    """
+    target: 'auto' 从高到低探测 (有缓存时先用缓存) / 'probe' 忽略缓存重新探测 / 指定速率
+    返回报告 {"baud", "supported", "cached", "probes": [{"baud", "ok", "error_rate"}]}，
+    返回时 ser 已处于 report["baud"]
+    """
+    report = {"baud": base, "supported": False, "cached": False, "probes": []}
+    current = query_baud(ser)
+    if current is None and cached and cached != base:
+        # 上一次会话没有切回上电速率，固件可能仍处于缓存的速率
+        _set_rate(ser, cached)
+        current = query_baud(ser)
+        if current is None:
+            _set_rate(ser, base)
+    if current is None:
+        return report  # 旧固件: 保持上电速率
+    report["supported"] = True
+    if current != base:
+        _set_rate(ser, current)
+        report.update(baud=current, cached=True)
+        return report
+
+    if isinstance(target, int):
+        plan = [(target, True)]
+    else:
+        plan = [(rate, True) for rate in candidates if rate > base]
+        if target == 'auto' and cached:
+            if cached == base:
+                return report  # 之前探测过，没有可用的更高速率
+            plan.insert(0, (cached, False))
+    for rate, burst in plan:
+        ok, error_rate = switch_baud(ser, base, rate, burst)
+        report["probes"].append({"baud": rate, "ok": ok, "error_rate": error_rate, "burst": burst})
+        if ok:
+            report.update(baud=rate, cached=not burst)
+            return report
+    return report
+
+
+def restore_base(ser, base=BASE_BAUD):
+    """切回上电速率 (固件立即切换，不需要确认)"""
+    ser.write(f"B:{base}\n".encode("ascii"))
+    ser.flush()
+    _wait_reply(ser, b"B:", BAUD_REPLY_TIMEOUT)
+    _set_rate(ser, base)
@@ -0,0 +1,184 @@
+import select
+import threading
+
+# ==========================================
+# 鼠标捕获 (真正的相对位移)
+# ==========================================
+# 默认的镜像方式由本机光标坐标的变化推算位移，本机光标碰到屏幕边缘后就再也产生不了位移，
+# 而且位移已经被本机的指针加速处理过一次，目标机还会再加速一次。这里提供两种捕获方式:
+#
+#   recenter  指针锁定: 本机光标离开中心区域时拉回中心，位移按拉回前的坐标计算，不受边缘限制。
+#             只有离开中心区域时才拉回 (而不是每个事件都拉回)，拉回产生的回声事件直接忽略，
+#             事件数不会翻倍。任何系统都可用 (依赖 pynput 的 Controller)。
+#   evdev     (Linux) 直接读取鼠标设备的原始 REL_X/REL_Y，未经指针加速，也不受屏幕边界影响。
+#             需要安装 evdev (pip install evdev) 并有 /dev/input/event* 的读权限 (input 组)。
+#             grab=True 时独占设备，本机光标不再移动、点击也不会落在本机上。
+#
+# 两种方式都只产生位移 (dx, dy)，送入与默认方式相同的聚合/发送管线。
+
+CAPTURE_MODES = ('cursor', 'recenter', 'evdev')
+RECENTER_MARGIN = 200   # 光标离中心超过该距离 (像素) 时拉回
+
+
+class RecenterCapture:
+    def __init__(self, on_delta, center, margin=RECENTER_MARGIN, controller=None):
+        """
+        on_delta(dx, dy): 每个位移事件调用一次
+        center: 拉回的目标坐标 (一般为屏幕中心)
+        controller: pynput.mouse.Controller (默认新建)
+        """
+        if controller is None:
+            from pynput import mouse
+            controller = mouse.Controller()
+        self.on_delta = on_delta
+        self.center = (int(center[0]), int(center[1]))
+        self.margin = margin
+        self.controller = controller
+        self.prev = self.center
+        self.warps = 0
+        self.echoes = 0
+
+    def start(self):
+        self.controller.position = self.center
+        self.prev = self.center
+
+    def on_move(self, x, y):
+        """挂在 pynput 的 on_move 上"""
+        x, y = int(x), int(y)
+        dx, dy = x - self.prev[0], y - self.prev[1]
+        if not (dx or dy):
+            self.echoes += 1  # 拉回后系统报告的回声事件 (坐标就是中心)
+            return
+        self.prev = (x, y)
+        self.on_delta(dx, dy)
+        cx, cy = self.center
+        if abs(x - cx) > self.margin or abs(y - cy) > self.margin:
+            self.prev = self.center
+            self.controller.position = self.center
+            self.warps += 1
+
+    def stop(self):
+        pass
+
+
+class EvdevCapture:
+    def __init__(self, on_delta, on_button=None, on_scroll=None, devices=None, grab=False):
+        """
+        on_delta(dx, dy): 每个 SYN_REPORT 调用一次 (同一报告内的 REL_X/REL_Y 合并)
+        on_button(code, pressed): code 为 "L"/"R"/"M"
+        on_scroll(dx, dy): 滚动 (格，高精度滚轮为小数；dy > 0 向上，dx > 0 向右)，每个报告调用一次
+        devices: 设备路径列表 (默认自动查找所有具有 REL_X/REL_Y 的设备)
+        grab: 独占设备 (本机不再收到这个鼠标的任何事件)
+        """
+        try:
+            import evdev
+        except ImportError:
+            raise RuntimeError("evdev 捕获需要安装 evdev (pip install evdev)，且仅支持 Linux")
+        self.evdev = evdev
+        self.on_delta = on_delta
+        self.on_button = on_button
+        self.on_scroll = on_scroll
+        self.paths = devices or self.find_devices()
+        if not self.paths:
+            raise RuntimeError("未找到可读取的鼠标设备 (需要 /dev/input/event* 的读权限)")
+        self.grab = grab
+        self.devices = []
+        self.running = False
+        self.thread = None
+        self.reports = 0
+
+    @staticmethod
+    def find_devices():
+        """具有相对 X/Y 轴的输入设备 (鼠标、触控板的相对模式、轨迹球...)"""
+        import evdev
+        ecodes = evdev.ecodes
+        found = []
+        for path in evdev.list_devices():
+            try:
+                dev = evdev.InputDevice(path)
+            except OSError:
+                continue
+            rel = dev.capabilities().get(ecodes.EV_REL, [])
+            if ecodes.REL_X in rel and ecodes.REL_Y in rel:
+                found.append(path)
+            dev.close()
+        return found
+
+    def start(self):
+        self.devices = [self.evdev.InputDevice(p) for p in self.paths]
+        if self.grab:
+            for dev in self.devices:
+                dev.grab()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="kvm-evdev", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1.0)
+        self.thread = None
+        for dev in self.devices:
+            try:
+                if self.grab:
+                    dev.ungrab()
+                dev.close()
+            except OSError:
+                pass
+        self.devices = []
+
+    def _wheel_codes(self, dev):
+        """((垂直轴事件码, 每格单位), (水平轴事件码, 每格单位))，有高精度轴时使用高精度轴"""
+        ecodes = self.evdev.ecodes
+        rel = dev.capabilities().get(ecodes.EV_REL, [])
+        codes = []
+        for legacy, hi_res in (("REL_WHEEL", "REL_WHEEL_HI_RES"), ("REL_HWHEEL", "REL_HWHEEL_HI_RES")):
+            code = getattr(ecodes, hi_res, None)  # 旧版 python-evdev 没有定义
+            codes.append((code, 120) if code is not None and code in rel else (getattr(ecodes, legacy), 1))
+        return codes
+
+    def _run(self):
+        ecodes = self.evdev.ecodes
+        buttons = {ecodes.BTN_LEFT: "L", ecodes.BTN_RIGHT: "R", ecodes.BTN_MIDDLE: "M"}
+        pending = {dev.fd: [0, 0] for dev in self.devices}
+        by_fd = {dev.fd: dev for dev in self.devices}
+        # 支持高精度滚轮的设备 (内核 5.0+) 同时上报 REL_WHEEL 和 REL_WHEEL_HI_RES (1/120 格)，只取后者
+        wheel_codes = {fd: self._wheel_codes(dev) for fd, dev in by_fd.items()}
+        scroll = {fd: [0, 0] for fd in by_fd}
+        while self.running:
+            # 超时只是为了能及时响应 stop()
+            ready, _, _ = select.select(list(by_fd), [], [], 0.2)
+            for fd in ready:
+                try:
+                    events = by_fd[fd].read()
+                except (BlockingIOError, OSError):
+                    continue
+                acc = pending[fd]
+                wheel = scroll[fd]
+                (v_code, v_div), (h_code, h_div) = wheel_codes[fd]
+                for ev in events:
+                    if ev.type == ecodes.EV_REL:
+                        if ev.code == ecodes.REL_X:
+                            acc[0] += ev.value
+                        elif ev.code == ecodes.REL_Y:
+                            acc[1] += ev.value
+                        elif ev.code == v_code:
+                            wheel[1] += ev.value / v_div
+                        elif ev.code == h_code:
+                            wheel[0] += ev.value / h_div
+                    elif ev.type == ecodes.EV_KEY and ev.code in buttons and ev.value != 2:
+                        if acc[0] or acc[1]:
+                            # 同一报告中按钮之前的位移先发出，点击才会落在正确位置
+                            self.on_delta(acc[0], acc[1])
+                            acc[0] = acc[1] = 0
+                        if self.on_button:
+                            self.on_button(buttons[ev.code], ev.value == 1)
+                    elif ev.type == ecodes.EV_SYN and ev.code == ecodes.SYN_REPORT:
+                        if acc[0] or acc[1]:
+                            self.reports += 1
+                            self.on_delta(acc[0], acc[1])
+                            acc[0] = acc[1] = 0
+                        if (wheel[0] or wheel[1]) and self.on_scroll:
+                            self.on_scroll(wheel[0], wheel[1])
+                        wheel[0] = wheel[1] = 0
@@ -4,13 +4,16 @@ import serial
 import time
 import threading
 from pynput import mouse, keyboard
+from kvm_motion import MotionAccumulator
+from kvm_keymap import KeyMap
+from arduino_kvm_lib import encode_text
 
 # ==========================================
 # 配置
 # ==========================================
 SERIAL_PORT = 'COM5'
 BAUD_RATE = 115200
-MOUSE_RATE_LIMIT = 0.005
+MOUSE_REPORT_RATE = 250  # 鼠标位移合并发送频率 (Hz)
 
 # ==========================================
 # 串口管理器 (线程安全)
@@ -32,11 +35,14 @@ class SerialManager:
             print(f"❌ 串口连接失败: {e}")
 
     def send_packet(self, header, data):
+        self.send_raw(encode_text(header, data))
+
+    def send_raw(self, payload):
+        """发送已编码的指令字节"""
         if self.connected and self.ser and self.ser.is_open:
-            payload = f"{header}:{data}\n"
             with self.lock:
                 try:
-                    self.ser.write(payload.encode('utf-8'))
+                    self.ser.write(payload)
                 except Exception as e:
                     print(f"发送异常: {e}")
     
@@ -58,13 +64,16 @@ class InputMirror:
     def __init__(self, serial_mgr):
         self.ser_mgr = serial_mgr
         self.target_os = 'WIN'
+        self.keymap = KeyMap(self.target_os, encode_text)
         self.enabled = False
-        self.last_mouse_time = 0
+        self.motion = MotionAccumulator(lambda dx, dy: self.ser_mgr.send_packet("M", f"{dx},{dy}"),
+                                        rate_hz=MOUSE_REPORT_RATE)
         self.m_listener = None
         self.k_listener = None
 
     def set_mode(self, os_type):
         self.target_os = os_type # 'WIN' or 'MAC'
+        self.keymap = KeyMap(os_type, encode_text)
 
     def set_enabled(self, output_enabled):
         self.enabled = output_enabled
@@ -78,41 +87,24 @@ class InputMirror:
         self.k_listener = keyboard.Listener(on_press=self.on_press, on_release=self.on_release)
         self.m_listener.start()
         self.k_listener.start()
+        self.motion.start()
 
     def stop_listeners(self):
         if self.m_listener: self.m_listener.stop()
         if self.k_listener: self.k_listener.stop()
-
-    def remap_key_for_mac(self, k):
-        if self.target_os != 'MAC': return k
-        if k == 'ctrl_l': return 'win'
-        if k == 'ctrl_r': return 'win'
-        if k == 'cmd':    return 'alt'
-        if k == 'win':    return 'alt'
-        if k == 'alt_l':  return 'ctrl_l'
-        if k == 'alt_r':  return 'ctrl_r'
-        return k
+        self.motion.stop()
 
     # --- Mouse Events ---
     def on_move(self, x, y):
-        if not self.enabled: return
-        current_time = time.time()
-        if current_time - self.last_mouse_time < MOUSE_RATE_LIMIT: return
-        self.last_mouse_time = current_time
-        
-        # 注意：这里我们简化为发送 "Rel" (如果需要 pynput不支持原生的相对movement，需要自己计算dx/dy)
-        # 为了演示，此处假设我们已经在 mirror_input.py 解决了这个问题
-        # 实际代码中 mirror_input V3.x 用的还是绝对坐标计算后的相对值
-        global prev_x, prev_y
-        try: dx, dy = x - prev_x, y - prev_y
-        except NameError: dx, dy = 0, 0
-        prev_x, prev_y = x, y
-        
-        if dx != 0 or dy != 0:
-            self.ser_mgr.send_packet("M", f"{dx},{dy}")
+        if not self.enabled:
+            # 暂停期间只跟踪坐标，重新开启时不会跳变
+            self.motion.reset_position(x, y)
+            return
+        self.motion.move_to(x, y)
 
     def on_click(self, x, y, button, pressed):
         if not self.enabled: return
+        self.motion.flush()
         btn_code = "L" if button == mouse.Button.left else "R" if button == mouse.Button.right else "M"
         cmd = "MD" if pressed else "MU"
         self.ser_mgr.send_packet(cmd, btn_code)
@@ -124,33 +116,14 @@ class InputMirror:
     # --- Keyboard Events ---
     def on_press(self, key):
         if not self.enabled: return
-        try:
-            k = key.char
-            if k:
-                if 1 <= ord(k) <= 26: k = chr(ord(k) + 96)
-                k = self.remap_key_for_mac(k)
-                self.ser_mgr.send_packet("KD", k)
-        except AttributeError:
-            k = str(key).replace('Key.', '')
-            if k == 'cmd': k = 'win'
-            k = self.remap_key_for_mac(k)
-            self.ser_mgr.send_packet("KD", k)
+        data = self.keymap.press(key)
+        if data: self.ser_mgr.send_raw(data)
 
     def on_release(self, key):
         # 即使 disable 了，release 也要处理吗？最好处理，但既然有 enabled 检查，我们假设 disable 时不需要
         if not self.enabled: return 
-        try:
-            k = key.char
-            if k:
-                if 1 <= ord(k) <= 26: k = chr(ord(k) + 96)
-                k = self.remap_key_for_mac(k)
-                self.ser_mgr.send_packet("KU", k)
-        except AttributeError:
-            k = str(key).replace('Key.', '')
-            if k == 'cmd': k = 'win'
-            if 'media_' in k: return
-            k = self.remap_key_for_mac(k)
-            self.ser_mgr.send_packet("KU", k)
+        data = self.keymap.release(key)
+        if data: self.ser_mgr.send_raw(data)
 
 # ==========================================
 # 主界面 (Tkinter)
@@ -171,9 +144,8 @@ class KVMApp:
         # 2. 初始化镜像引擎
         self.mirror = InputMirror(self.serial_mgr)
         # 初始化鼠标坐标
-        global prev_x, prev_y
         m_controller = mouse.Controller()
-        prev_x, prev_y = m_controller.position
+        self.mirror.motion.reset_position(*m_controller.position)
         
         self.mirror.start_listeners() # 启动监听，但 enabled 默认为 False
         
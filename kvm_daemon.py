@@ -0,0 +1,540 @@
+import asyncio
+import concurrent.futures
+import json
+import os
+import queue
+import threading
+
+import kvm_macro
+from arduino_kvm_lib import ArduinoKVMClient, install_exit_handlers
+from kvm_async import AsyncArduinoKVMClient
+from kvm_baud import BASE_BAUD
+from kvm_daemon_client import DaemonError, KVMDaemonClient, daemon_address, daemon_available, parse_address
+from kvm_screen import ScreenGeometry
+
+# ==========================================
+# 守护进程
+# ==========================================
+# 串口同一时间只能被一个程序打开，以前每个前端 (GUI、宏命令行、mirror_input) 都自己打开串口，
+# 同时运行就互相抢占。守护进程长期运行并独占串口，通过本机套接字提供控制接口，
+# 前端都是它的瘦客户端 (kvm_daemon_client.py)，可以同时连接任意多个:
+#   - 每行一个 JSON 请求 {"id": 1, "op": "combo", "keys": ["ctrl_l", "c"]}，执行完成后回复
+#     {"id": 1, "ok": true, "result": ...} 或 {"id": 1, "ok": false, "error": "..."}；
+#     没有 id 的请求不回复 (鼠标位移等即发即弃的指令)
+#   - 同一连接的指令按发送顺序执行；查询 (status / held / stats) 不排队，立即回复
+#   - 所有客户端的指令进入 AsyncArduinoKVMClient 的同一个有序发送队列，由唯一的写任务写串口；
+#     会按下键的指令 (按键、组合键、文本、点击、宏) 互斥执行，不同客户端的组合键不会交错
+#     (否则 A 按住 Ctrl 期间 B 输入的字母就成了快捷键)；鼠标位移和滚轮不需要等待
+#   - 镜像 (pynput 监听) 在守护进程内运行，由 mirror 指令开关，与发起的客户端是否断开无关
+#   - 设备未连接时定期重试 (自动查找见 kvm_discovery.py)，连接后的断线由库的自动重连处理
+#   - 桌面范围 (绝对定位、recenter 捕获用) 用 serve --geometry 指定；不指定时在第一次需要时
+#     交给主线程检测 (检测可能创建 Tk，只能在主线程进行)，只用相对模式就不会加载 tkinter
+#
+#   python kvm_daemon.py serve [COM5] [--macros macros/stream_deck.json] [--geometry 1920x1080+0+0]
+#   python kvm_daemon.py combo ctrl_l c
+#   python kvm_daemon.py text "Hello World"
+#   python kvm_daemon.py mirror on
+#
+# Unix 域套接字的权限为 0600，只有当前用户能控制键盘鼠标；没有 AF_UNIX 的平台只监听 127.0.0.1。
+
+RETRY_INTERVAL = 2.0        # 设备未连接时重试连接的间隔
+REQUEST_LINE_MAX = 1 << 20  # 单个请求的长度上限 (长文本)
+
+
+class KVMDaemon:
+    def __init__(self, port=None, baud_rate=BASE_BAUD, address=None, macro_file=None, **client_kwargs):
+        """
+        port: 串口名或 URL (None 时自动查找)；address: 监听地址 (见 kvm_daemon_client.py)
+        macro_file: 默认宏文件 (macro 指令不指定文件时使用)
+        client_kwargs: 传给 ArduinoKVMClient 的其他参数
+        """
+        self.client = ArduinoKVMClient(port, baud_rate, **client_kwargs)
+        # 串口在线程池中打开，那里装不了信号处理: 先在这里 (主线程) 装好，SIGTERM 时也能发送 REL
+        install_exit_handlers()
+        self.auto_port = not port
+        self.aio = AsyncArduinoKVMClient(client=self.client)
+        self.address = daemon_address(address)
+        self.macro_file = os.path.abspath(macro_file) if macro_file else None
+        self.macro_files = {}      # 路径 -> (修改时间, {名称: Macro})
+        self.player = kvm_macro.MacroPlayer.for_client(self.client)
+        self.loop = None
+        self.thread = None
+        self.server = None
+        self.input_lock = None     # 会按下键的指令互斥 (asyncio.Lock)
+        self.connections = set()
+        self.busy = set()          # 正在执行的排队指令 (cancel 时取消)
+        self.retry = None
+        self.stopped = threading.Event()
+        self.requests = 0
+        self.main_calls = queue.Queue()  # 必须在主线程执行的调用 (fn, Future)，由 serve_forever 处理
+        self.serving = False
+
+        # 指令 -> (处理协程, 是否排队执行, 是否与其他按键指令互斥)
+        self.ops = {
+            "status": (self._op_status, False, False),
+            "held": (self._op_held, False, False),
+            "stats": (self._op_stats, False, False),
+            "enable_stats": (self._op_enable_stats, False, False),
+            "cancel": (self._op_cancel, False, False),
+            "shutdown": (self._op_shutdown, False, False),
+            "packet": (self._op_packet, True, True),
+            "key": (self._op_key, True, True),
+            "combo": (self._op_combo, True, True),
+            "text": (self._op_text, True, True),
+            "click": (self._op_click, True, True),
+            "release": (self._op_release, True, True),
+            "macro": (self._op_macro, True, True),
+            "macros": (self._op_macros, False, False),
+            "move": (self._op_move, True, False),
+            "scroll": (self._op_scroll, True, False),
+            "mirror": (self._op_mirror, True, False),
+            "target_os": (self._op_target_os, True, False),
+            "mouse_mode": (self._op_mouse_mode, True, False),
+            "report_rate": (self._op_report_rate, True, False),
+        }
+
+    # --- 启动 / 停止 ---
+
+    def start(self):
+        """在后台线程运行事件循环，返回时已开始监听"""
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="kvm-daemon", daemon=True)
+        self.thread.start()
+        try:
+            asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+        except Exception:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=1.0)
+            raise
+        return self
+
+    async def _start(self):
+        self.input_lock = asyncio.Lock()
+        kind, target = parse_address(self.address)
+        if kind == "tcp":
+            self.server = await asyncio.start_server(self._handle, *target, limit=REQUEST_LINE_MAX)
+        else:
+            if daemon_available(self.address):
+                raise DaemonError(f"守护进程已在运行: {self.address}")
+            if os.path.exists(target):
+                os.unlink(target)  # 上次没有正常退出留下的套接字文件
+            os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+            old_mask = os.umask(0o177)  # 创建时就是 0600，不留可被他人连接的窗口
+            try:
+                self.server = await asyncio.start_unix_server(self._handle, target, limit=REQUEST_LINE_MAX)
+            finally:
+                os.umask(old_mask)
+        await self.aio.connect()  # 只启动写任务，串口由下面的 _connect 打开
+        await self._connect()
+        self.retry = self.loop.create_task(self._retry_loop())
+        print(f"✅ [Daemon] 正在监听 {self.address}")
+
+    async def _connect(self):
+        ok = await self.loop.run_in_executor(None, self.client.connect)
+        if not ok:
+            print(f"⚠️ [Daemon] 设备未连接 ({self.client.error_msg})，每 {RETRY_INTERVAL:.0f} 秒重试")
+        return ok
+
+    async def _retry_loop(self):
+        while True:
+            await asyncio.sleep(RETRY_INTERVAL)
+            # 已连接过的设备断线由库的自动重连 (sup_thread) 负责
+            if not self.client.connected and self.client.sup_thread is None:
+                if self.auto_port:
+                    self.client.port = None  # 重新查找 (设备可能换了端口或刚插入)
+                await self.loop.run_in_executor(None, self.client.connect)
+
+    def stop(self):
+        if self.loop is None:
+            return
+        if self.loop.is_running():
+            try:
+                asyncio.run_coroutine_threadsafe(self._stop(), self.loop).result(5.0)
+            except Exception as e:
+                print(f"⚠️ [Daemon] 停止时出错: {e}")
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=2.0)
+        self.loop = None
+        self.player.stop()
+        self.client.stop_mirroring()
+        self.client.disconnect()
+        kind, target = parse_address(self.address)
+        if kind == "unix" and os.path.exists(target):
+            os.unlink(target)
+        self.stopped.set()
+        print("⚪ [Daemon] 已停止")
+
+    async def _stop(self):
+        if self.retry:
+            self.retry.cancel()
+        if self.server:
+            self.server.close()
+        for writer in list(self.connections):
+            writer.close()
+        for task in list(self.busy):
+            task.cancel()
+        await self.aio.disconnect()
+
+    def serve_forever(self):
+        """阻塞直到 Ctrl+C 或 shutdown 指令；期间在主线程执行 main_calls 中的调用"""
+        self.serving = True
+        try:
+            while not self.stopped.is_set():
+                try:
+                    fn, future = self.main_calls.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(fn())
+                except Exception as e:
+                    future.set_exception(e)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.serving = False
+        self.stop()
+
+    async def _on_main_thread(self, fn):
+        """在主线程执行 fn (serve_forever 未运行时，例如嵌入使用，只能在线程池中执行)"""
+        if not self.serving:
+            return await self.loop.run_in_executor(None, fn)
+        future = concurrent.futures.Future()
+        self.main_calls.put((fn, future))
+        return await asyncio.wrap_future(future)
+
+    async def _ensure_geometry(self):
+        """绝对定位和 recenter 捕获需要桌面范围: 没有用 --geometry 指定时第一次需要才检测"""
+        if self.client.geometry is None:
+            geometry = await self._on_main_thread(ScreenGeometry.detect)
+            if self.client.geometry is None:
+                self.client.geometry = geometry
+
+    # --- 连接处理 ---
+
+    async def _handle(self, reader, writer):
+        self.connections.add(writer)
+        prev = None       # 本连接上一条排队指令，下一条在它完成后才执行
+        tasks = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    break  # 超长请求或连接被重置
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    op = request["op"]
+                except (ValueError, KeyError, TypeError):
+                    self._reply(writer, None, error="无效的请求")
+                    continue
+                spec = self.ops.get(op)
+                if spec is None:
+                    self._reply(writer, request.get("id"), error=f"未知指令: {op}")
+                    continue
+                handler, ordered, exclusive = spec
+                self.requests += 1
+                task = self.loop.create_task(self._run(writer, request, handler, prev if ordered else None, exclusive))
+                if ordered:
+                    prev = task
+                    self.busy.add(task)
+                    task.add_done_callback(self.busy.discard)
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            # 已收到的指令仍然执行完 (脚本常常发完就退出)，然后才关闭连接
+            if tasks:
+                await asyncio.wait(tasks)
+            self.connections.discard(writer)
+            writer.close()
+
+    async def _run(self, writer, request, handler, prev, exclusive):
+        try:
+            if prev is not None:
+                await asyncio.wait([prev])  # 前一条失败或被取消不影响这一条
+            if exclusive:
+                async with self.input_lock:
+                    result = await handler(request)
+            else:
+                result = await handler(request)
+        except asyncio.CancelledError:
+            self._reply(writer, request.get("id"), error="已取消")
+            return
+        except (DaemonError, kvm_macro.MacroError, KeyError, TypeError, ValueError, OSError) as e:
+            self._reply(writer, request.get("id"), error=str(e) or type(e).__name__)
+            return
+        except Exception as e:
+            # 其他异常 (例如 pynput 后端不可用) 也必须回复，否则客户端会一直等待
+            print(f"❌ [Daemon] {request.get('op')} 执行失败: {e!r}")
+            self._reply(writer, request.get("id"), error=repr(e))
+            return
+        self._reply(writer, request.get("id"), result=result)
+
+    def _reply(self, writer, request_id, result=None, error=None):
+        if request_id is None or writer.is_closing():
+            return
+        reply = {"id": request_id, "ok": error is None}
+        if error is None:
+            reply["result"] = result
+        else:
+            reply["error"] = error
+        writer.write((json.dumps(reply, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    def _require_link(self):
+        if not self.client.connected:
+            raise DaemonError("设备未连接")
+
+    # --- 查询 ---
+
+    async def _op_status(self, request):
+        c = self.client
+        return {
+            "connected": c.connected,
+            "port": c.port,
+            "protocol": c.protocol,
+            "link_baud": c.link_rate,
+            "mirroring": c.mirror_enabled,
+            "target_os": c.target_os,
+            "mouse_mode": c.mouse_mode,
+            "clients": len(self.connections),
+            "requests": self.requests,
+            "queued": len(self.busy),
+        }
+
+    async def _op_held(self, request):
+        return self.client.held_state()
+
+    async def _op_stats(self, request):
+        return self.client.stats()
+
+    async def _op_enable_stats(self, request):
+        self.client.enable_stats(bool(request.get("enabled", True)))
+
+    async def _op_macros(self, request):
+        return [{"name": m.name, "label": m.label} for m in self._macros(request.get("file")).values()]
+
+    # --- 控制 ---
+
+    async def _op_cancel(self, request):
+        """取消所有客户端正在执行和排队的按键类指令，并释放所有键"""
+        self.player.cancel()
+        cancelled = 0
+        for task in list(self.busy):
+            if task.cancel():
+                cancelled += 1
+        await self.aio.drain()
+        self.aio.release_all()
+        return cancelled
+
+    async def _op_shutdown(self, request):
+        self.loop.call_later(0.1, lambda: threading.Thread(target=self.stop, name="kvm-daemon-stop").start())
+
+    async def _op_packet(self, request):
+        self._require_link()
+        self.aio.send_packet_raw(request["header"], str(request["data"]))
+        await self.aio.drain()
+
+    async def _op_key(self, request):
+        self._require_link()
+        key, action = request["key"], request.get("action", "click")
+        if action == "down":
+            self.aio.send_key_down(key)
+        elif action == "up":
+            self.aio.send_key_up(key)
+        elif action == "click":
+            await self.aio.send_key_click(key, float(request.get("duration", 0.05)))
+        else:
+            raise ValueError(f"未知的按键动作: {action}")
+        await self.aio.drain()
+
+    async def _op_combo(self, request):
+        self._require_link()
+        keys = request["keys"]
+        if not isinstance(keys, list) or not keys:
+            raise ValueError("keys 必须是非空列表")
+        await self.aio.send_combo(keys, float(request.get("duration", 0.02)))
+        await self.aio.drain()
+
+    async def _op_text(self, request):
+        self._require_link()
+        return await self.aio.type_text(str(request["text"]), float(request.get("delay", 0.02)))
+
+    async def _op_click(self, request):
+        self._require_link()
+        button = request.get("button", "L")
+        action = request.get("action", "click")
+        if action == "click":
+            await self.aio.mouse_click(button, float(request.get("duration", 0.05)))
+        elif action in ("down", "up"):
+            self.aio.send_packet_raw("MD" if action == "down" else "MU", button)
+        else:
+            raise ValueError(f"未知的点击动作: {action}")
+        await self.aio.drain()
+
+    async def _op_release(self, request):
+        self.aio.release_all()
+        await self.aio.drain()
+
+    async def _op_move(self, request):
+        self.aio.mouse_move(int(request["dx"]), int(request["dy"]))
+
+    async def _op_scroll(self, request):
+        self.aio.scroll(int(request["wheel"]), int(request.get("pan", 0)))
+
+    def _macros(self, path=None):
+        """读取宏文件 (按修改时间缓存，文件更新后自动重新读取)"""
+        path = path or self.macro_file
+        if not path:
+            raise DaemonError("未指定宏文件 (启动守护进程时用 --macros 指定，或在请求中给出 file)")
+        mtime = os.path.getmtime(path)
+        cached = self.macro_files.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, {m.name: m for m in kvm_macro.load_macros(path)})
+            self.macro_files[path] = cached
+        return cached[1]
+
+    async def _op_macro(self, request):
+        self._require_link()
+        macro = self._macros(request.get("file")).get(request["name"])
+        if macro is None:
+            raise DaemonError(f"找不到宏: {request['name']}")
+        # 先等队列中的指令写完，再由宏播放器按预编译的时间表直接发送 (计时比事件循环精确)
+        await self.aio.drain()
+        # 编译可能要探测固件是否支持批量输入 (读串口)，不放在事件循环线程
+        schedule = await self.loop.run_in_executor(None, macro.for_client, self.client)
+        await self.loop.run_in_executor(None, self.player.play_now, schedule)
+        return len(schedule)
+
+    async def _op_mirror(self, request):
+        if request.get("enabled", True):
+            self._require_link()
+            if request.get("capture", "cursor") == "recenter" or self.client.mouse_mode == 'absolute':
+                await self._ensure_geometry()
+            await self.loop.run_in_executor(None, lambda: self.client.start_mirroring(
+                request.get("capture", "cursor"), bool(request.get("grab", False))))
+        else:
+            await self.loop.run_in_executor(None, self.client.stop_mirroring)
+        return self.client.mirror_enabled
+
+    async def _op_target_os(self, request):
+        os_type = str(request["os"]).upper()
+        if os_type not in ("WIN", "MAC"):
+            raise ValueError(f"未知的系统模式: {os_type}")
+        self.client.set_target_os(os_type)
+
+    async def _op_mouse_mode(self, request):
+        if request["mode"] == 'absolute':
+            await self._ensure_geometry()
+        return await self.loop.run_in_executor(None, self.client.set_mouse_mode, request["mode"])
+
+    async def _op_report_rate(self, request):
+        self.client.set_report_rate(int(request["rate"]))
+
+
+# ==========================================
+# 命令行
+# ==========================================
+
+def _parse_link_baud(value):
+    return None if value == "off" else value if value in ("auto", "probe") else int(value)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Arduino KVM 守护进程")
+    parser.add_argument("--socket", help="守护进程地址 (Unix 套接字路径或 tcp://host:port)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve = sub.add_parser("serve", help="启动守护进程 (独占串口)")
+    serve.add_argument("port", nargs="?", help="串口名或 URL (默认自动查找)")
+    serve.add_argument("--baud", type=int, default=BASE_BAUD, help="固件上电速率")
+    serve.add_argument("--link-baud", default="auto", help="auto / probe / off / 指定速率")
+    serve.add_argument("--macros", help="默认宏文件")
+    serve.add_argument("--reliable", action="store_true", help="可靠模式 (关键指令等待确认)")
+    serve.add_argument("--geometry", help="本机桌面范围，例如 1920x1080+0+0;2560x1440+1920+0 (默认需要时自动检测)")
+
+    sub.add_parser("status", help="查询状态")
+    p = sub.add_parser("combo", help="组合键")
+    p.add_argument("keys", nargs="+")
+    p = sub.add_parser("key", help="单击一个键")
+    p.add_argument("key")
+    p = sub.add_parser("text", help="输入文本")
+    p.add_argument("text")
+    p = sub.add_parser("click", help="鼠标点击")
+    p.add_argument("button", nargs="?", default="L", choices=("L", "R", "M"))
+    p = sub.add_parser("move", help="鼠标相对移动")
+    p.add_argument("dx", type=int)
+    p.add_argument("dy", type=int)
+    p = sub.add_parser("scroll", help="滚轮")
+    p.add_argument("wheel", type=int)
+    p.add_argument("pan", type=int, nargs="?", default=0, help="水平滚动 (正数向右)")
+    p = sub.add_parser("macro", help="执行宏")
+    p.add_argument("name")
+    p.add_argument("--file", help="宏文件 (默认使用守护进程的 --macros)")
+    p = sub.add_parser("mirror", help="开关键盘鼠标镜像")
+    p.add_argument("state", choices=("on", "off"))
+    p.add_argument("--capture", default="cursor", help="cursor / recenter / evdev")
+    sub.add_parser("release", help="释放所有键")
+    sub.add_parser("cancel", help="取消正在执行的宏和文本输入")
+    sub.add_parser("shutdown", help="停止守护进程")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            geometry = ScreenGeometry.parse(args.geometry) if args.geometry else None
+        except ValueError as e:
+            parser.error(str(e))
+        try:
+            daemon = KVMDaemon(args.port, args.baud, args.socket, args.macros,
+                               link_baud=_parse_link_baud(args.link_baud), reliable=args.reliable,
+                               geometry=geometry).start()
+        except (DaemonError, OSError) as e:
+            print(f"❌ [Daemon] 无法启动: {e}")
+            return 1
+        daemon.serve_forever()
+        return 0
+
+    kvm = KVMDaemonClient(args.socket)
+    if not kvm.connect():
+        print(f"❌ [Daemon] {kvm.error_msg}")
+        return 1
+    try:
+        if args.command == "status":
+            result = kvm.status()
+        elif args.command == "combo":
+            result = kvm.send_combo(args.keys)
+        elif args.command == "key":
+            result = kvm.send_key_click(args.key)
+        elif args.command == "text":
+            result = kvm.type_text(args.text)
+        elif args.command == "click":
+            result = kvm.mouse_click(args.button)
+        elif args.command == "move":
+            result = kvm.call("move", dx=args.dx, dy=args.dy)
+        elif args.command == "scroll":
+            result = kvm.call("scroll", wheel=args.wheel, pan=args.pan)
+        elif args.command == "macro":
+            result = kvm.play_macro(args.name, args.file)
+        elif args.command == "mirror":
+            result = kvm.start_mirroring(args.capture) if args.state == "on" else kvm.stop_mirroring()
+        elif args.command == "release":
+            result = kvm.release_all()
+        elif args.command == "cancel":
+            result = kvm.cancel()
+        else:
+            result = kvm.shutdown()
+    except DaemonError as e:
+        print(f"❌ [Daemon] {e}")
+        return 1
+    finally:
+        kvm.disconnect()
+    if result is not None:
+        print(json.dumps(result, ensure_ascii=False, indent=2) if isinstance(result, dict) else result)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
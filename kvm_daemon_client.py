@@ -0,0 +1,252 @@
+import itertools
+import json
+import os
+import socket
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+# ==========================================
+# 守护进程客户端
+# ==========================================
+# kvm_daemon.py 独占串口，这里是它的瘦客户端: 方法名与 ArduinoKVMClient 一致，
+# GUI / 宏命令行 / 脚本检测到守护进程在运行时改用它，不再自己打开串口。
+# 只依赖标准库的 socket/json (不导入 asyncio 和串口库)，启动代价很小。
+#
+#   kvm = KVMDaemonClient()
+#   if kvm.connect():
+#       kvm.send_combo(['ctrl_l', 'c'])
+#       kvm.type_text("hello", wait=False)   # wait=False: 不等执行完成，返回 Future
+#
+# 地址: Unix 域套接字路径，或 "tcp://host:port" (没有 AF_UNIX 的平台默认使用 TCP)；
+# 环境变量 ARDUINO_KVM_DAEMON 可以覆盖默认地址。
+
+DAEMON_TCP_PORT = 5601
+if hasattr(socket, "AF_UNIX"):
+    DEFAULT_DAEMON_ADDRESS = os.path.join(os.path.expanduser("~"), ".arduino_kvm", "kvmd.sock")
+else:
+    DEFAULT_DAEMON_ADDRESS = f"tcp://127.0.0.1:{DAEMON_TCP_PORT}"
+DAEMON_CONNECT_TIMEOUT = 0.5
+DAEMON_CALL_TIMEOUT = 30.0  # 等待回复的上限 (长文本输入也在这个时间内完成)
+
+
+class DaemonError(RuntimeError):
+    pass
+
+
+def daemon_address(address=None):
+    return address or os.environ.get("ARDUINO_KVM_DAEMON") or DEFAULT_DAEMON_ADDRESS
+
+
+def parse_address(address):
+    """"tcp://host:port" -> ("tcp", (host, port))；其他字符串视为 Unix 域套接字路径"""
+    if address.startswith("tcp://"):
+        host, _, port = address[len("tcp://"):].rpartition(":")
+        return "tcp", (host or "127.0.0.1", int(port or DAEMON_TCP_PORT))
+    return "unix", address
+
+
+def open_socket(address, timeout=DAEMON_CONNECT_TIMEOUT):
+    kind, target = parse_address(address)
+    if kind == "tcp":
+        sock = socket.create_connection(target, timeout=timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(target)
+        except OSError:
+            sock.close()
+            raise
+    sock.settimeout(None)
+    return sock
+
+
+def daemon_available(address=None):
+    """守护进程是否在运行 (只尝试连接，不发送指令)"""
+    address = daemon_address(address)
+    kind, target = parse_address(address)
+    if kind == "unix" and not os.path.exists(target):
+        return False  # 常见情况: 没有套接字文件，不必尝试连接
+    try:
+        open_socket(address).close()
+        return True
+    except OSError:
+        return False
+
+
+class KVMDaemonClient:
+    def __init__(self, address=None, timeout=DAEMON_CALL_TIMEOUT):
+        self.address = daemon_address(address)
+        self.timeout = timeout
+        self.sock = None
+        self.connected = False
+        self.error_msg = ""
+        self.port = None             # 守护进程使用的串口 (connect 时查询)
+        self.send_lock = threading.Lock()
+        self.pending = {}            # 请求 id -> Future
+        self.pending_lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.reader = None
+
+    # --- 连接 ---
+
+    def connect(self):
+        try:
+            self.sock = open_socket(self.address)
+        except OSError as e:
+            self.error_msg = f"守护进程未运行 ({self.address}): {e}"
+            return False
+        self.connected = True
+        self.reader = threading.Thread(target=self._read_loop, name="kvmd-client", daemon=True)
+        self.reader.start()
+        try:
+            self.port = self.status().get("port")
+        except DaemonError as e:
+            self.error_msg = str(e)
+            self.disconnect()
+            return False
+        return True
+
+    def disconnect(self):
+        """只断开与守护进程的连接，串口和镜像由守护进程继续管理"""
+        self.connected = False
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+        if self.reader and self.reader is not threading.current_thread():
+            self.reader.join(timeout=1.0)
+        self.reader = None
+
+    def _read_loop(self):
+        try:
+            for line in self.sock.makefile("rb"):
+                try:
+                    reply = json.loads(line)
+                except ValueError:
+                    continue
+                with self.pending_lock:
+                    future = self.pending.pop(reply.get("id"), None)
+                if future is None:
+                    continue
+                if reply.get("ok"):
+                    future.set_result(reply.get("result"))
+                else:
+                    future.set_exception(DaemonError(reply.get("error", "未知错误")))
+        except (OSError, ValueError):
+            pass
+        self.connected = False
+        with self.pending_lock:
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            future.set_exception(DaemonError("与守护进程的连接已断开"))
+
+    # --- 请求 ---
+
+    def call(self, op, wait=True, reply=True, **args):
+        """
+        发送一条请求。wait=True 等待执行完成并返回结果 (失败抛出 DaemonError)；
+        wait=False 立即返回 Future；reply=False 即发即弃 (守护进程不回复)
+        """
+        request = {"op": op, **args}
+        future = None
+        if reply:
+            future = Future()
+            request["id"] = next(self.ids)
+            with self.pending_lock:
+                self.pending[request["id"]] = future
+        data = (json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8")
+        try:
+            if not self.connected:
+                raise OSError("未连接")
+            with self.send_lock:
+                self.sock.sendall(data)
+        except OSError as e:
+            self.connected = False
+            if future is not None:
+                with self.pending_lock:
+                    self.pending.pop(request["id"], None)
+                future.set_exception(DaemonError(f"无法发送到守护进程: {e}"))
+        if future is None:
+            return None
+        if not wait:
+            return future
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            raise DaemonError(f"守护进程 {self.timeout}s 内没有回复 ({op})")
+
+    # --- 与 ArduinoKVMClient 同名的控制 API ---
+
+    def status(self):
+        return self.call("status")
+
+    def send_packet_raw(self, header, data, wait=True):
+        return self.call("packet", wait, header=header, data=str(data))
+
+    def send_key_down(self, key, wait=True):
+        return self.call("key", wait, key=key, action="down")
+
+    def send_key_up(self, key, wait=True):
+        return self.call("key", wait, key=key, action="up")
+
+    def send_key_click(self, key, duration=0.05, wait=True):
+        return self.call("key", wait, key=key, action="click", duration=duration)
+
+    def send_combo(self, keys, duration=0.02, wait=True):
+        return self.call("combo", wait, keys=list(keys), duration=duration)
+
+    def type_text(self, text, delay=0.02, wait=True):
+        return self.call("text", wait, text=text, delay=delay)
+
+    def mouse_move(self, dx, dy):
+        """即发即弃 (与直接写串口一样不等待)"""
+        self.call("move", reply=False, dx=int(dx), dy=int(dy))
+
+    def mouse_click(self, button="L", wait=True):
+        return self.call("click", wait, button=button)
+
+    def scroll(self, wheel, pan=0):
+        self.call("scroll", reply=False, wheel=int(wheel), pan=int(pan))
+
+    def release_all(self, wait=True):
+        return self.call("release", wait)
+
+    def play_macro(self, name, path=None, wait=True):
+        """执行宏文件中的一个宏 (path 为空时使用守护进程启动时指定的宏文件)"""
+        return self.call("macro", wait, name=name, file=os.path.abspath(path) if path else None)
+
+    def cancel(self):
+        """取消所有客户端正在执行的宏 / 组合键 / 文本输入，并释放所有键"""
+        return self.call("cancel")
+
+    def start_mirroring(self, capture='cursor', grab=False):
+        return self.call("mirror", enabled=True, capture=capture, grab=grab)
+
+    def stop_mirroring(self):
+        return self.call("mirror", enabled=False)
+
+    def set_target_os(self, os_type):
+        return self.call("target_os", os=os_type)
+
+    def set_mouse_mode(self, mode, geometry=None):
+        return self.call("mouse_mode", mode=mode)
+
+    def set_report_rate(self, rate_hz):
+        return self.call("report_rate", rate=rate_hz)
+
+    def held_state(self):
+        return self.call("held")
+
+    def enable_stats(self, enabled=True):
+        return self.call("enable_stats", enabled=enabled)
+
+    def stats(self):
+        return self.call("stats")
+
+    def shutdown(self):
+        """停止守护进程 (释放串口)"""
+        return self.call("shutdown")
@@ -0,0 +1,342 @@
+import json
+import os
+import threading
+import time
+
+import serial
+
+from kvm_baud import BASE_BAUD, BaudCache, device_key
+
+# ==========================================
+# 设备发现
+# ==========================================
+# 按描述字符串猜端口 ("Arduino"、"CH340"...) 并不能确认端口上真的是 KVM 固件，
+# 这里改为主动识别:
+#   - 候选端口并行打开，发送 "I:0"，固件 4.2+ 回复 "I:ArduinoKVM,<版本>,<能力>"；
+#     同时发送 "V:2,0"，旧固件 (3.6+) 原样回复，也算识别成功。每个端口最多等待 IDENTIFY_TIMEOUT
+#   - 识别成功的设备按 USB VID:PID:序列号 记录在 ~/.arduino_kvm/devices.json，
+#     下次启动只枚举串口 (不打开端口)，已知设备在场就直接使用；端口号变化 (COM5 -> COM7) 也能认出来
+#   - HotplugWatcher 定期枚举串口，只处理变化的部分: 新出现的已知设备更新端口名，未知端口才识别
+#   - 识别会往端口写数据，所以只识别可能是 KVM 的端口 (常见 USB-TTL 芯片或 Arduino 板的 VID，或描述像)；
+#     识别失败的设备记下来，拔出前 (或显式刷新前) 不再打开
+# 都识别不到时退回旧的描述字符串匹配。
+
+PORT_SCAN_TTL = 2.0        # 串口枚举结果的缓存时间 (秒)，GUI 列表和自动查找共用一次扫描
+IDENTIFY_TIMEOUT = 0.3     # 单个端口等待识别回复的时间 (所有端口并行)
+HOTPLUG_INTERVAL = 1.0     # 热插拔检测的枚举间隔
+DEFAULT_DEVICE_CACHE = os.path.join(os.path.expanduser("~"), ".arduino_kvm", "devices.json")
+
+# 固件通过 Serial1 通信，上位机看到的是 USB-TTL 模块 (Leonardo 自己的 USB 口是接在目标机上的 HID)；
+# 也接受 Arduino 板子本身的 VID，便于用板载 USB 串口调试固件
+KVM_USB_VIDS = {
+    0x1A86,  # WCH CH340 / CH341 / CH9102
+    0x10C4,  # Silicon Labs CP210x
+    0x0403,  # FTDI FT232 / FT231X
+    0x067B,  # Prolific PL2303
+    0x2341,  # Arduino
+    0x2A03,  # Arduino (arduino.org)
+    0x1B4F,  # SparkFun (Pro Micro)
+    0x239A,  # Adafruit
+}
+KVM_DESC_HINTS = ("arduino", "leonardo", "micro", "32u4", "kvm", "ch340", "ch9102", "cp210", "ft232",
+                  "pl2303", "usb-serial", "usb serial", "uart")
+
+_port_scan = (0.0, None)
+_port_scan_lock = threading.Lock()
+
+
+def comports(refresh=False):
+    """枚举串口 (结果缓存 PORT_SCAN_TTL 秒)"""
+    global _port_scan
+    with _port_scan_lock:
+        stamp, ports = _port_scan
+        if refresh or ports is None or time.monotonic() - stamp > PORT_SCAN_TTL:
+            import serial.tools.list_ports
+            ports = serial.tools.list_ports.comports()
+            _port_scan = (time.monotonic(), ports)
+    return ports
+
+
+def identify(port, bauds=(BASE_BAUD,), timeout=IDENTIFY_TIMEOUT):
+    """
+    打开端口确认固件身份。
+    返回 {"firmware": 版本, "caps": 能力位掩码} (旧固件 firmware 为 "legacy"，caps 为 None)，
+    端口打不开或没有回复返回 None。bauds: 依次尝试的速率 (固件可能停在上次协商的速率)
+    """
+    for rate in bauds:
+        try:
+            ser = serial.serial_for_url(port, rate, timeout=0.05)
+        except (serial.SerialException, OSError, ValueError):
+            return None  # 端口被占用或已拔出
+        try:
+            ser.reset_input_buffer()
+            ser.write(b"I:0\nV:2,0\n")
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                line = ser.readline().strip()
+                if line.startswith(b"I:ArduinoKVM,"):
+                    fields = line[len(b"I:ArduinoKVM,"):].decode("ascii", "replace").split(",")
+                    caps = int(fields[1]) if len(fields) > 1 and fields[1].isdigit() else None
+                    return {"firmware": fields[0], "caps": caps, "baud": rate}
+                if line == b"V:2,0":
+                    # 固件按顺序回复，先收到 V 说明不认识 I 指令
+                    return {"firmware": "legacy", "caps": None, "baud": rate}
+        except (serial.SerialException, OSError):
+            return None
+        finally:
+            ser.close()
+    return None
+
+
+def plausible(port):
+    """端口可能是 KVM 适配器: 常见 USB-TTL 芯片或 Arduino 板的 VID，或描述/产品名像 (调制解调器、GPS 等不碰)"""
+    if port.vid is None:
+        return False
+    if port.vid in KVM_USB_VIDS:
+        return True
+    text = " ".join(filter(None, (port.description, port.product, port.manufacturer))).lower()
+    return any(hint in text for hint in KVM_DESC_HINTS)
+
+
+def _legacy_match(ports):
+    """旧的启发式: 描述里有 Arduino/Leonardo，或者只有一个串口"""
+    for p in ports:
+        desc = p.description.lower()
+        hwid = p.hwid.lower()
+        if "arduino" in desc or "leonardo" in desc or "vid:pid=2341" in hwid:
+            return p.device
+    return ports[0].device if len(ports) == 1 else None
+
+
+class DeviceDiscovery:
+    """识别 KVM 固件所在的串口，并持久化已识别的设备"""
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, path=DEFAULT_DEVICE_CACHE, timeout=IDENTIFY_TIMEOUT, baud_cache=None):
+        self.path = path
+        self.timeout = timeout
+        self.baud_cache = baud_cache  # kvm_baud.BaudCache: 识别时也尝试缓存的协商速率
+        self.lock = threading.Lock()
+        self.entries = None  # 设备键 -> {"port", "firmware", "caps", "seen"}
+        self.probes = 0      # 实际打开端口识别的次数
+        self.rejected = set()  # 识别失败的设备键，拔出或显式刷新前不再识别
+
+    @classmethod
+    def default(cls):
+        """进程内共享的实例 (ArduinoKVMClient.find_device 使用)"""
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls(baud_cache=BaudCache())
+            return cls._default
+
+    # --- 持久化 ---
+
+    def _load(self):
+        if self.entries is None:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+        return self.entries
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"⚠️ [Discovery] 无法写入设备缓存 {self.path}: {e}")
+
+    def remember(self, port, info=None, ports=None):
+        """记录一个已确认的设备 (识别成功或客户端握手成功)"""
+        if "://" in port:
+            return
+        key = device_key(port, comports() if ports is None else ports)
+        if key is None:
+            return
+        info = info or {}
+        with self.lock:
+            entry = self._load().setdefault(key, {})
+            entry.update({"port": port, "seen": time.strftime("%Y-%m-%dT%H:%M:%S")})
+            for field in ("firmware", "caps"):
+                if info.get(field) is not None:
+                    entry[field] = info[field]
+            self._save()
+
+    def forget(self, port, ports=None):
+        """端口上的设备不再可信 (例如连接失败)，下次查找时重新识别"""
+        if "://" in port:
+            return
+        key = device_key(port, comports() if ports is None else ports)
+        with self.lock:
+            if key is not None and self._load().pop(key, None) is not None:
+                self._save()
+
+    def known(self, ports):
+        """当前在场的已知设备 [(端口, 缓存条目)]，按最近确认时间排序 (新的在前)"""
+        found = []
+        with self.lock:
+            entries = self._load()
+            for p in ports:
+                key = device_key(p.device, ports)
+                if key in entries:
+                    found.append((p.device, entries[key]))
+        found.sort(key=lambda item: item[1].get("seen", ""), reverse=True)
+        return found
+
+    # --- 识别 ---
+
+    def probe(self, devices, ports=None):
+        """并行识别一组端口，返回 {端口: 识别结果}；识别成功的写入缓存"""
+        ports = comports() if ports is None else ports
+        results = {}
+        results_lock = threading.Lock()
+
+        def worker(device):
+            bauds = [BASE_BAUD]
+            key = device_key(device, ports)
+            cached = self.baud_cache.get(key) if self.baud_cache and key else None
+            if cached and cached != BASE_BAUD:
+                bauds.append(cached)
+            info = identify(device, bauds, self.timeout)
+            if info:
+                with results_lock:
+                    results[device] = info
+
+        threads = [threading.Thread(target=worker, args=(d,), name="kvm-probe", daemon=True) for d in devices]
+        for t in threads:
+            t.start()
+        # 每个端口最多尝试两个速率，再加上打开端口的时间
+        deadline = time.monotonic() + 2 * self.timeout + 1.0
+        for t in threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        self.probes += len(threads)
+        with results_lock:
+            found = dict(results)  # 超时未结束的线程之后的结果不再采用
+        for device, info in found.items():
+            self.remember(device, info, ports)
+        with self.lock:
+            self.rejected.update(device_key(d, ports) for d in devices if d not in found)
+        return found
+
+    def candidates(self, ports):
+        """值得识别的端口: 可能是 KVM 的 USB 串口，且之前没有识别失败过"""
+        with self.lock:
+            rejected = set(self.rejected)
+        return [p.device for p in ports if plausible(p) and device_key(p.device, ports) not in rejected]
+
+    def unplugged(self, devices, ports):
+        """端口已拔出: 重新插入时再识别一次 (可能刷了固件)。ports 为拔出前的枚举结果"""
+        with self.lock:
+            self.rejected.difference_update(device_key(d, ports) for d in devices)
+
+    def find_all(self, refresh=False):
+        """所有在场的 KVM 设备端口 (已知设备不再打开端口)"""
+        if refresh:
+            self.rejected.clear()
+        ports = comports(refresh)
+        devices = [device for device, _ in self.known(ports)]
+        unknown = [d for d in self.candidates(ports) if d not in devices]
+        if unknown:
+            devices += list(self.probe(unknown, ports))
+        return devices
+
+    def locate(self, key, refresh=False):
+        """设备键 (VID:PID:序列号) 当前对应的端口，不在场返回 None"""
+        ports = comports(refresh)
+        for p in ports:
+            if device_key(p.device, ports) == key:
+                return p.device
+        return None
+
+    def find(self, refresh=False):
+        """查找一个 KVM 设备: 已知设备 -> 并行识别 -> 描述字符串匹配"""
+        if refresh:
+            self.rejected.clear()
+        ports = comports(refresh)
+        known = self.known(ports)
+        if known:
+            return known[0][0]
+        found = self.probe(self.candidates(ports), ports)
+        if found:
+            # 新固件优先 (能报告版本和能力)
+            return sorted(found, key=lambda d: found[d]["firmware"] == "legacy")[0]
+        return _legacy_match(ports)
+
+    def watch(self, on_change=None, interval=HOTPLUG_INTERVAL):
+        return HotplugWatcher(self, on_change, interval).start()
+
+
+class HotplugWatcher:
+    """
+    定期枚举串口，增量更新设备缓存:
+      新出现的端口如果是已知设备 (VID:PID:序列号匹配) 只更新端口名，否则才打开识别
+    on_change(added, removed): 端口列表变化时调用 (在监视线程中)，added 为新出现的 KVM 设备端口
+    """
+
+    def __init__(self, discovery, on_change=None, interval=HOTPLUG_INTERVAL):
+        self.discovery = discovery
+        self.on_change = on_change
+        self.interval = interval
+        self.present = None  # 上一次枚举到的端口集合
+        self.ports = []      # 上一次的枚举结果 (拔出的端口要用它算设备键)
+        self.running = False
+        self.thread = None
+        self.wake = threading.Event()
+
+    def start(self):
+        """在后台线程中定期 poll()；也可以不启动线程，由调用方 (例如 Tk 的 after 循环) 定期调用 poll()"""
+        if self.present is None:
+            self.ports = comports()
+            self.present = {p.device for p in self.ports}
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="kvm-hotplug", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2.0)
+        self.thread = None
+
+    def poll(self):
+        """枚举一次并处理变化，返回 (新出现的 KVM 设备端口, 消失的端口)"""
+        ports = comports(refresh=True)
+        current = {p.device for p in ports}
+        if self.present is None:
+            self.present, self.ports = current, ports  # 第一次只记录基线
+            return [], []
+        added, removed = current - self.present, self.present - current
+        if removed:
+            self.discovery.unplugged(removed, self.ports)
+        self.present, self.ports = current, ports
+        devices = []
+        if added:
+            new_ports = [p for p in ports if p.device in added]
+            known = {device for device, _ in self.discovery.known(new_ports)}
+            for device in known:
+                self.discovery.remember(device, ports=ports)  # 端口名可能变了
+            unknown = [d for d in self.discovery.candidates(new_ports) if d not in known]
+            devices = sorted(known)
+            if unknown:
+                devices += sorted(self.discovery.probe(unknown, ports))
+        if (added or removed) and self.on_change:
+            self.on_change(devices, sorted(removed))
+        return devices, sorted(removed)
+
+    def _run(self):
+        while self.running:
+            self.wake.wait(self.interval)
+            if not self.running:
+                return
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"⚠️ [Discovery] 热插拔检测失败: {e}")
@@ -0,0 +1,709 @@
+import os
+import random
+import socket
+import threading
+import time
+
+from arduino_kvm_lib import (
+    OP_MOUSE_MOVE, OP_MOUSE_DOWN, OP_MOUSE_UP, OP_SCROLL, OP_KEY_DOWN, OP_KEY_UP,
+    OP_RELEASE_ALL, OP_TYPE_TEXT, OP_SEQ, OP_MOUSE_ABS, OP_MOUSE_VEL, OP_HSCROLL, TYPE_CHUNK_MAX, KEY_CODES,
+    CAP_ABS_MOUSE, CAP_SMOOTH_MOTION, CAP_HSCROLL, crc8,
+)
+from kvm_screen import ABS_MAX
+from kvm_baud import BASE_BAUD, BAUD_CANDIDATES, BAUD_CONFIRM_MS
+
+# ==========================================
+# Arduino KVM 固件模拟器
+# ==========================================
+# 纯 Python 实现 arduino_kvm_firmware.ino 的指令解析 (文本 / v2 二进制 / T 批量输入 / V 握手 / B 速率协商 / I 识别 / MV 平滑位移 / SH 水平滚动)，
+# 维护虚拟 HID 状态 (按下的键、鼠标按钮、光标位置、垂直/水平滚轮)，并记录每条指令的到达时间。
+# ArduinoKVMClient 可以通过 socket:// URL 或 Linux pty 连接，无需 Leonardo 即可测试和压测。
+#
+#   python kvm_emulator.py --tcp 5555   ->  ArduinoKVMClient("socket://127.0.0.1:5555")
+#   python kvm_emulator.py --pty        ->  ArduinoKVMClient("/dev/pts/N")
+
+# 与固件 framePayloadLength() 一致 (T 指令的长度字节之后再按长度扩展)
+FRAME_PAYLOAD = {
+    OP_MOUSE_MOVE: 2, OP_MOUSE_ABS: 4, OP_MOUSE_VEL: 6, OP_TYPE_TEXT: 1, OP_SEQ: 2,
+    OP_MOUSE_DOWN: 1, OP_MOUSE_UP: 1, OP_SCROLL: 1, OP_HSCROLL: 1, OP_KEY_DOWN: 1, OP_KEY_UP: 1,
+    OP_RELEASE_ALL: 0,
+}
+KEY_NAMES = {}
+for _name, _code in KEY_CODES.items():
+    KEY_NAMES.setdefault(_code, _name)
+BUTTON_NAMES = {0x01: "L", 0x02: "R", 0x04: "M"}
+
+LOG_MAX = 100000  # 最多保留的指令记录条数
+LINE_MAX = 64     # 与固件一致: 超长的文本指令整行丢弃
+FIRMWARE_VERSION = "4.4"  # I 指令回复的固件版本 (与固件 FW_VERSION 一致)
+CAPABILITIES = CAP_ABS_MOUSE | CAP_SMOOTH_MOTION | CAP_HSCROLL
+
+# 与固件 SMOOTH_* 一致 (平滑位移按 1ms 一个 HID 报告播放)
+SMOOTH_MAX_DT = 50
+SMOOTH_START_DT = 4
+SMOOTH_EXTRAP_MAX = 8
+MOUSE_OPS = (OP_MOUSE_MOVE, OP_MOUSE_ABS, OP_MOUSE_DOWN, OP_MOUSE_UP, OP_SCROLL, OP_HSCROLL, OP_RELEASE_ALL)
+
+
+def _s8(v):
+    """固件 Mouse.move 的参数是 signed char，超出范围会回绕"""
+    return ((int(v) + 128) & 0xFF) - 128
+
+
+def _s16(v):
+    return ((int(v) + 0x8000) & 0xFFFF) - 0x8000
+
+
+def _cdiv(a, b):
+    """C 的整数除法 (向零取整)"""
+    q = abs(a) // abs(b)
+    return q if (a >= 0) == (b > 0) else -q
+
+
+def _clamp(v, lo, hi):
+    return max(lo, min(hi, v))
+
+
+class KVMEmulator:
+    def __init__(self, screen=(1920, 1080), drop_rate=0.0, seed=None, max_baud=None, baud_error_rate=0.02):
+        """
+        drop_rate: 模拟链路丢包，按该概率丢弃收到的整条指令 (用于测试可靠模式)
+        max_baud: 模拟链路的可靠速率上限，协商到更高的速率后每个字节按 baud_error_rate 的概率出错
+        """
+        self.lock = threading.Lock()
+        self.screen = screen
+        self.drop_rate = drop_rate
+        self.max_baud = max_baud
+        self.baud_error_rate = baud_error_rate
+        self.random = random.Random(seed)
+        self.reset()
+
+    def reset(self):
+        """清空 HID 状态和统计 (相当于固件重新上电)"""
+        # 虚拟 HID 状态
+        self.pressed = set()  # Arduino 键码
+        self.buttons = 0      # MOUSE_LEFT|RIGHT|MIDDLE 位掩码
+        self.x = self.screen[0] // 2
+        self.y = self.screen[1] // 2
+        self.wheel = 0
+        self.pan = 0
+        self.typed = bytearray()
+
+        # 平滑位移状态 (与固件 smooth* 变量一致，速度单位 1/256 点每毫秒)
+        self.smooth_rem = [0, 0]
+        self.smooth_vel = [0, 0]
+        self.smooth_pred = [0, 0]
+        self.smooth_frac = [0, 0]
+        self.smooth_last_t = 0
+        self.smooth_play = 0
+        self.smooth_extrap = 0
+        self.smooth_active = False
+        self.smooth_tick_at = 0.0
+        self.hid_moves = 0  # 实际发出的鼠标位移报告数 (平滑播放的每个非零报告都计入)
+
+        # 协议状态
+        self.crc_enabled = False
+        self.crc_errors = 0
+        self.unknown = 0
+        self.parse_errors = 0
+        self.expected_seq = 0
+        self.dropped = 0
+        self.baud = BASE_BAUD
+        self.baud_prev = 0       # 不为 0 表示等待确认
+        self.baud_switched = 0.0
+        self.framing_errors = 0  # 上位机速率与模拟器不一致时收到的字节 (全部视为乱码丢弃)
+
+        self.output = bytearray()
+        self.reset_stats()
+
+        # 接收状态机
+        self._line = bytearray()
+        self._line_discard = False
+        self._frame = bytearray()
+        self._frame_need = 0
+        self._type_buf = bytearray()
+        self._type_need = 0
+
+    def reset_stats(self):
+        """只清空统计，保留 HID 和协议状态"""
+        self.bytes_in = 0
+        self.commands = 0
+        self.counts = {}
+        self.log = []  # (monotonic 时间, 指令, 数据)
+
+    # --- 输入 ---
+
+    def feed(self, data, baud=None):
+        """
+        喂入上位机发送的字节，返回需要回复给上位机的字节
+        baud: 上位机当前的串口速率 (传输层能取得时传入，例如 pty)，与模拟器速率不一致时数据全部作废
+        """
+        with self.lock:
+            self.bytes_in += len(data)
+            self._smooth_advance()
+            self._check_baud()
+            if baud is not None and baud != self.baud:
+                self.framing_errors += len(data)
+                return b""
+            if self.max_baud and self.baud > self.max_baud:
+                data = bytes(c ^ (1 << self.random.randrange(8)) if self.random.random() < self.baud_error_rate else c
+                             for c in data)
+            for c in data:
+                self._feed_byte(c)
+            out = bytes(self.output)
+            self.output.clear()
+        return out
+
+    def _feed_byte(self, c):
+        if self._frame_need:
+            self._frame.append(c)
+            if len(self._frame) == 2 and self._frame[0] == OP_TYPE_TEXT:
+                if c > TYPE_CHUNK_MAX:
+                    self._frame_need = 0
+                    return
+                self._frame_need = 2 + c + (1 if self.crc_enabled else 0)
+            if len(self._frame) == 3 and self._frame[0] == OP_SEQ:
+                inner = FRAME_PAYLOAD.get(c)
+                if inner is None or c in (OP_SEQ, OP_TYPE_TEXT):
+                    self._frame_need = 0
+                    return
+                self._frame_need = 3 + inner + (1 if self.crc_enabled else 0)
+            if len(self._frame) == self._frame_need:
+                self._handle_frame(bytes(self._frame))
+                self._frame_need = 0
+            return
+
+        if self._type_need:
+            self._type_buf.append(c)
+            if len(self._type_buf) == self._type_need:
+                self._type_chunk(bytes(self._type_buf))
+                self._type_need = 0
+            return
+
+        if c >= 0x80 and not self._line and not self._line_discard:
+            payload = FRAME_PAYLOAD.get(c)
+            if payload is None:
+                self.unknown += 1
+                return
+            self._frame = bytearray((c,))
+            self._frame_need = 1 + payload + (1 if self.crc_enabled else 0)
+            if self._frame_need == 1:
+                self._handle_frame(bytes(self._frame))
+                self._frame_need = 0
+            return
+
+        if c == 0x0A:
+            line = self._line.decode('utf-8', 'replace').strip()
+            self._line.clear()
+            if not self._line_discard and not self._lost():
+                self._parse_command(line)
+            self._line_discard = False
+            return
+        if self._line_discard:
+            return
+        if len(self._line) >= LINE_MAX - 1:
+            self._line.clear()
+            self._line_discard = True
+            self.parse_errors += 1
+            return
+        self._line.append(c)
+        if c == 0x3A and len(self._line) > 2 and self._line.startswith(b"T:"):
+            try:
+                n = int(self._line[2:-1])
+            except ValueError:
+                n = 0
+            self._line.clear()
+            n = min(n, TYPE_CHUNK_MAX)
+            if n <= 0:
+                self._type_chunk(b"")
+            else:
+                self._type_buf = bytearray()
+                self._type_need = n
+
+    def _lost(self):
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            self.dropped += 1
+            return True
+        return False
+
+    # --- 指令执行 (与固件一致) ---
+
+    def _record(self, cmd, data):
+        self.commands += 1
+        self.counts[cmd] = self.counts.get(cmd, 0) + 1
+        if len(self.log) < LOG_MAX:
+            self.log.append((time.monotonic(), cmd, data))
+
+    def _parse_command(self, cmd):
+        if ':' not in cmd:
+            return
+        kind, data = cmd.split(':', 1)
+        if kind in ("M", "P", "MD", "MU", "S", "SH", "REL"):
+            self._flush_motion()
+        if kind == "M":
+            if ',' in data:
+                dx, dy = data.split(',', 1)
+                self._move(_s8(_to_int(dx)), _s8(_to_int(dy)))
+        elif kind == "P":
+            if ',' in data:
+                x, y = data.split(',', 1)
+                self._move_abs(_to_int(x), _to_int(y))
+        elif kind == "MV":
+            parts = data.split(',')
+            if len(parts) >= 3:
+                self._smooth_sample(_to_int(parts[0]) & 0xFFFF, _to_int(parts[1]), _to_int(parts[2]))
+        elif kind == "MD":
+            self._press_button({"L": 1, "R": 2, "M": 4}.get(data, 0))
+        elif kind == "MU":
+            self._release_button({"L": 1, "R": 2, "M": 4}.get(data, 0))
+        elif kind == "S":
+            self._scroll(_s8(_to_int(data)))
+        elif kind == "SH":
+            self._pan(_s8(_to_int(data)))
+        elif kind == "KD":
+            self._press_key(self._text_key_code(data))
+        elif kind == "KU":
+            self._release_key(self._text_key_code(data))
+        elif kind == "REL":
+            self._release_all()
+        elif kind == "Q":
+            seq, _, inner = data.partition(':')
+            if self._accept_seq(_to_int(seq) & 0xFF):
+                self._parse_command(inner)
+            self._send_ack()
+            return
+        elif kind == "SEQ":
+            self.expected_seq = _to_int(data) & 0xFF
+            self._send_ack()
+            return
+        elif kind == "V":
+            if data.startswith("2,"):
+                self.crc_enabled = (data == "2,1")
+                self.output += f"V:{data}\n".encode('utf-8')
+            return
+        elif kind == "STAT":
+            # 模拟器没有硬件缓冲，溢出计数恒为 0
+            errors = self.unknown + self.parse_errors
+            self.output += f"STAT:0,0,{self.crc_errors},{errors}\n".encode('utf-8')
+            return
+        elif kind == "CAP":
+            self.output += b"CAP:%d\n" % CAPABILITIES
+            return
+        elif kind == "I":
+            self.output += f"I:ArduinoKVM,{FIRMWARE_VERSION},{CAPABILITIES}\n".encode('utf-8')
+            return
+        elif kind == "B":
+            rate = _to_int(data)
+            if rate == 0:
+                self.baud_prev = 0
+                self.output += b"B:%d\n" % self.baud
+            elif rate == BASE_BAUD:
+                self.output += b"B:%d\n" % rate
+                self._set_baud(rate)
+                self.baud_prev = 0
+            elif rate in BAUD_CANDIDATES:
+                prev = self.baud_prev or self.baud
+                self.output += b"B:%d\n" % rate
+                self._set_baud(rate)
+                self.baud_prev = prev
+                self.baud_switched = time.monotonic()
+            else:
+                self.output += b"B:%d\n" % self.baud
+            return
+        elif kind == "E":
+            if self.baud_prev:
+                self.baud_switched = time.monotonic()
+            self.output += f"E:{data}\n".encode('utf-8', 'replace')
+            return
+        else:
+            return
+        self._record(kind, data)
+
+    def _set_baud(self, rate):
+        """与固件 setBaud() 一致: 切换速率并清空接收状态"""
+        self.baud = rate
+        self._line.clear()
+        self._line_discard = False
+        self._frame_need = 0
+        self._type_need = 0
+
+    def _check_baud(self):
+        if self.baud_prev and time.monotonic() - self.baud_switched > BAUD_CONFIRM_MS / 1000:
+            self._set_baud(self.baud_prev)  # 没有收到确认，退回原速率
+            self.baud_prev = 0
+
+    def _accept_seq(self, seq):
+        if seq != self.expected_seq:
+            return False
+        self.expected_seq = (seq + 1) & 0xFF
+        return True
+
+    def _send_ack(self):
+        self.output += b"A:%d\n" % ((self.expected_seq - 1) & 0xFF)
+
+    def _handle_frame(self, frame):
+        if self._lost():
+            return
+        if self.crc_enabled:
+            if crc8(frame[:-1]) != frame[-1]:
+                self.crc_errors += 1
+                return
+        self._execute_frame(frame)
+
+    def _execute_frame(self, frame):
+        op = frame[0]
+        if op in MOUSE_OPS:
+            self._flush_motion()
+        if op == OP_MOUSE_MOVE:
+            dx, dy = _s8(frame[1]), _s8(frame[2])
+            self._move(dx, dy)
+            self._record("M", f"{dx},{dy}")
+        elif op == OP_MOUSE_ABS:
+            x, y = frame[1] | frame[2] << 8, frame[3] | frame[4] << 8
+            self._move_abs(x, y)
+            self._record("P", f"{x},{y}")
+        elif op == OP_MOUSE_VEL:
+            t = frame[1] | frame[2] << 8
+            dx, dy = _s16(frame[3] | frame[4] << 8), _s16(frame[5] | frame[6] << 8)
+            self._smooth_sample(t, dx, dy)
+            self._record("MV", f"{t},{dx},{dy}")
+        elif op == OP_MOUSE_DOWN:
+            self._press_button(frame[1])
+            self._record("MD", BUTTON_NAMES.get(frame[1], frame[1]))
+        elif op == OP_MOUSE_UP:
+            self._release_button(frame[1])
+            self._record("MU", BUTTON_NAMES.get(frame[1], frame[1]))
+        elif op == OP_SCROLL:
+            self._scroll(_s8(frame[1]))
+            self._record("S", str(_s8(frame[1])))
+        elif op == OP_HSCROLL:
+            self._pan(_s8(frame[1]))
+            self._record("SH", str(_s8(frame[1])))
+        elif op == OP_KEY_DOWN:
+            self._press_key(frame[1])
+            self._record("KD", self.key_name(frame[1]))
+        elif op == OP_KEY_UP:
+            self._release_key(frame[1])
+            self._record("KU", self.key_name(frame[1]))
+        elif op == OP_RELEASE_ALL:
+            self._release_all()
+            self._record("REL", "0")
+        elif op == OP_TYPE_TEXT:
+            self._type_chunk(frame[2:2 + frame[1]])
+        elif op == OP_SEQ:
+            if self._accept_seq(frame[1]):
+                self._execute_frame(frame[2:])
+            self._send_ack()
+
+    @staticmethod
+    def _text_key_code(k):
+        if len(k) == 1:
+            return ord(k.encode('utf-8')[:1])
+        return KEY_CODES.get(k, 0)
+
+    def _move(self, dx, dy):
+        self.hid_moves += 1
+        self.x = max(0, min(self.screen[0] - 1, self.x + dx))
+        self.y = max(0, min(self.screen[1] - 1, self.y + dy))
+
+    # --- 平滑位移 (与固件 smoothSample / smoothTick / flushMotion 一致) ---
+
+    def _smooth_sample(self, t, dx, dy):
+        dt = (t - self.smooth_last_t) & 0xFFFF
+        self.smooth_last_t = t
+        if dt == 0:
+            dt = 1
+        if dt > SMOOTH_MAX_DT or not self.smooth_active:
+            dt = SMOOTH_START_DT
+        for i, d in enumerate((dx, dy)):
+            self.smooth_rem[i] += d
+            self.smooth_vel[i] = _cdiv(self.smooth_rem[i] * 256, dt)
+            self.smooth_pred[i] = _cdiv(d * 256, dt)
+        self.smooth_play = dt
+        self.smooth_extrap = min(dt, SMOOTH_EXTRAP_MAX) if (dx or dy) else 0
+        if not self.smooth_active:
+            self.smooth_active = True
+            self.smooth_tick_at = time.monotonic()
+
+    def _smooth_advance(self):
+        """补上距上次处理以来固件 loop() 中应该发生的 1ms 报告 (模拟器没有自己的时钟线程)"""
+        now = time.monotonic()
+        while self.smooth_active and now - self.smooth_tick_at >= 0.001:
+            self.smooth_tick_at += 0.001
+            self._smooth_tick()
+
+    def _smooth_tick(self):
+        if self.smooth_play:
+            vel = self.smooth_vel
+            self.smooth_play -= 1
+        elif self.smooth_extrap:
+            vel = self.smooth_pred
+            self.smooth_extrap -= 1
+        else:
+            self._flush_motion()
+            return
+        n = [0, 0]
+        for i in (0, 1):
+            self.smooth_frac[i] += vel[i]
+            n[i] = _clamp(_cdiv(self.smooth_frac[i], 256), -127, 127)
+            self.smooth_frac[i] = _clamp(self.smooth_frac[i] - n[i] * 256, -255, 255)
+            self.smooth_rem[i] -= n[i]
+        if n[0] or n[1]:
+            self._move(*n)
+
+    def _flush_motion(self):
+        if not self.smooth_active:
+            return
+        while self.smooth_rem[0] or self.smooth_rem[1]:
+            nx = _clamp(self.smooth_rem[0], -127, 127)
+            ny = _clamp(self.smooth_rem[1], -127, 127)
+            self._move(nx, ny)
+            self.smooth_rem[0] -= nx
+            self.smooth_rem[1] -= ny
+        self.smooth_frac = [0, 0]
+        self.smooth_play = self.smooth_extrap = 0
+        self.smooth_active = False
+
+    def _move_abs(self, x, y):
+        # 与主机 HID 驱动一致: 0-32767 线性映射到整个屏幕
+        x = max(0, min(ABS_MAX, x))
+        y = max(0, min(ABS_MAX, y))
+        self.x = (x * (self.screen[0] - 1) + ABS_MAX // 2) // ABS_MAX
+        self.y = (y * (self.screen[1] - 1) + ABS_MAX // 2) // ABS_MAX
+
+    def _scroll(self, wheel):
+        self.wheel += wheel
+
+    def _pan(self, pan):
+        self.pan += pan
+
+    def _press_button(self, b):
+        self.buttons |= b
+
+    def _release_button(self, b):
+        self.buttons &= ~b
+
+    def _press_key(self, code):
+        if code: self.pressed.add(code)
+
+    def _release_key(self, code):
+        if code: self.pressed.discard(code)
+
+    def _release_all(self):
+        self.pressed.clear()
+        self.buttons = 0
+
+    def _type_chunk(self, chunk):
+        self.typed += chunk
+        self._record("T", len(chunk))
+        self.output += b"T:%d\n" % len(chunk)
+
+    # --- 查询 ---
+
+    @staticmethod
+    def key_name(code):
+        if 0x20 < code < 0x7F:
+            return chr(code)
+        return KEY_NAMES.get(code, str(code))
+
+    def pressed_keys(self):
+        """当前按下的键名集合"""
+        with self.lock:
+            return {self.key_name(c) for c in self.pressed}
+
+    def stats(self):
+        """指令统计和到达间隔 (毫秒)"""
+        with self.lock:
+            self._smooth_advance()
+            times = [t for t, _, _ in self.log]
+            gaps = sorted((b - a) * 1000 for a, b in zip(times, times[1:]))
+            duration = times[-1] - times[0] if len(times) > 1 else 0.0
+            return {
+                "bytes": self.bytes_in,
+                "commands": self.commands,
+                "counts": dict(self.counts),
+                "duration_s": duration,
+                "commands_per_s": (len(times) - 1) / duration if duration else 0.0,
+                "gap_p50_ms": gaps[len(gaps) // 2] if gaps else 0.0,
+                "gap_p99_ms": gaps[int(len(gaps) * 0.99)] if gaps else 0.0,
+                "crc_errors": self.crc_errors,
+                "parse_errors": self.unknown + self.parse_errors,
+                "dropped": self.dropped,
+                "baud": self.baud,
+                "framing_errors": self.framing_errors,
+                "cursor": (self.x, self.y),
+                "hid_moves": self.hid_moves,
+                "wheel": self.wheel,
+                "pan": self.pan,
+                "buttons": self.buttons,
+                "pressed": sorted(self.key_name(c) for c in self.pressed),
+            }
+
+
+def _to_int(s):
+    """Arduino String.toInt(): 解析失败返回 0"""
+    try:
+        return int(s.strip())
+    except ValueError:
+        return 0
+
+
+# ==========================================
+# 传输层
+# ==========================================
+
+class EmulatorServer:
+    """TCP 服务端，客户端使用 pyserial 的 socket://host:port 连接"""
+
+    def __init__(self, emulator, host='127.0.0.1', port=0):
+        self.emulator = emulator
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(1)
+        self.host, self.port = self.sock.getsockname()
+        self.running = False
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"socket://{self.host}:{self.port}"
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._serve, name="kvm-emu-tcp", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def _serve(self):
+        while self.running:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with conn:
+                while self.running:
+                    try:
+                        data = conn.recv(4096)
+                    except OSError:
+                        break
+                    if not data:
+                        break
+                    reply = self.emulator.feed(data)
+                    if reply:
+                        conn.sendall(reply)
+
+
+def _termios_speeds():
+    try:
+        import termios
+    except ImportError:
+        return {}
+    return {getattr(termios, name): int(name[1:]) for name in dir(termios) if name[0] == 'B' and name[1:].isdigit()}
+
+
+_TERMIOS_SPEEDS = _termios_speeds()
+_BOTHER = 0o010000
+_TCGETS2 = 0x802C542A
+
+
+class EmulatorPty:
+    """Linux 伪终端，客户端直接打开 self.device (例如 /dev/pts/3)"""
+
+    def __init__(self, emulator):
+        import pty
+        import tty
+        self.emulator = emulator
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)  # 关闭回显和换行转换，按原始字节传输
+        self.device = os.ttyname(self.slave)
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._serve, name="kvm-emu-pty", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _serve(self):
+        import select
+        while self.running:
+            try:
+                ready, _, _ = select.select([self.master], [], [], 0.1)
+                if not ready:
+                    continue
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            reply = self.emulator.feed(data, self._host_baud())
+            if reply:
+                os.write(self.master, reply)
+
+    def _host_baud(self):
+        """上位机在 slave 端设置的速率 (pyserial 对非标准速率使用 BOTHER，需要用 TCGETS2 读取)"""
+        import termios
+        try:
+            speed = termios.tcgetattr(self.slave)[4]
+        except termios.error:
+            return None
+        rate = _TERMIOS_SPEEDS.get(speed)
+        if rate is None and speed == _BOTHER:
+            import array
+            import fcntl
+            buf = array.array('i', [0] * 64)
+            try:
+                fcntl.ioctl(self.slave, _TCGETS2, buf)
+                rate = buf[9]
+            except OSError:
+                pass
+        return rate
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Arduino KVM 固件模拟器")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--tcp", type=int, metavar="PORT", help="监听 TCP 端口 (socket://127.0.0.1:PORT)")
+    group.add_argument("--pty", action="store_true", help="创建 Linux 伪终端")
+    args = parser.parse_args()
+
+    emu = KVMEmulator()
+    if args.pty:
+        transport = EmulatorPty(emu).start()
+        print(f"🧪 模拟器已启动: {transport.device}")
+    else:
+        transport = EmulatorServer(emu, port=args.tcp or 5555).start()
+        print(f"🧪 模拟器已启动: {transport.url}")
+    print("按 Ctrl+C 退出")
+
+    try:
+        while True:
+            time.sleep(1)
+            s = emu.stats()
+            print(f"指令 {s['commands']:6d} | 字节 {s['bytes']:7d} | 光标 {s['cursor']} | "
+                  f"按钮 {s['buttons']} | 按键 {s['pressed']}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        transport.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# ==========================================
+# 按键翻译表
+# ==========================================
+# pynput Key/KeyCode -> (目标系统改键) -> 已编码的指令字节。
+# 目标系统或协议变化时整表重建一次，按键回调里只剩一次字典查询，
+# 不再有 try/except、字符串替换和 if 链。
+# 表在第一次查询时才建立 (需要导入 pynput)，只发送宏/文本的脚本不会加载 pynput。
+# 没有 pynput 的环境 (例如无显示器的录制回放) 只建立字符表，特殊键按 name 属性即时编码。
+
+# MAC 模式: 键位互换以符合 Mac 习惯
+#   - Ctrl -> Command (Win 键) [方便复制粘贴]
+#   - Win  -> Option (Alt 键)
+#   - Alt  -> Control
+MAC_REMAP = {
+    'ctrl_l': 'win',
+    'ctrl_r': 'win',
+    'cmd':    'alt',
+    'win':    'alt',
+    'alt_l':  'ctrl_l',
+    'alt_r':  'ctrl_r',
+}
+
+
+def key_name(name, target_os):
+    """pynput 键名 -> 固件键名 (含 cmd 兼容处理和 Mac 改键)"""
+    if name == 'cmd': name = 'win'
+    if target_os == 'MAC':
+        name = MAC_REMAP.get(name, name)
+    return name
+
+
+class KeyMap:
+    def __init__(self, target_os, encode):
+        """
+        target_os: 'WIN' or 'MAC'
+        encode(header, data) -> bytes: 指令编码函数 (文本或 v2 二进制)
+        """
+        self.target_os = target_os
+        self.encode = encode
+        self.down = None
+        self.up = None
+
+    def _build(self):
+        try:
+            from pynput import keyboard
+            members = list(keyboard.Key)
+        except ImportError:
+            members = []  # 无显示器的 Linux 等: pynput 无法加载
+        target_os, encode = self.target_os, self.encode
+        down, up = {}, {}
+
+        # 特殊键: 以 Key 枚举成员为键
+        for member in members:
+            if member.name.startswith('media_'): continue
+            name = key_name(member.name, target_os)
+            down[member] = encode("KD", name)
+            up[member] = encode("KU", name)
+
+        # 普通字符: 以字符为键
+        for code in range(0x20, 0x7F):
+            ch = chr(code)
+            down[ch] = encode("KD", ch)
+            up[ch] = encode("KU", ch)
+
+        # 按住 Ctrl 时 pynput 会给出 ASCII 控制字符 (1-26)，例如 Ctrl+A -> '\x01'，还原为字母
+        for code in range(1, 27):
+            ch = chr(code + 96)
+            down[chr(code)] = down[ch]
+            up[chr(code)] = up[ch]
+        self.up = up
+        self.down = down
+
+    def press(self, key):
+        """返回按下 key 对应的指令字节，不需要发送时返回 None"""
+        if self.down is None: self._build()
+        return self._lookup(self.down, "KD", key)
+
+    def release(self, key):
+        """返回松开 key 对应的指令字节，不需要发送时返回 None"""
+        if self.up is None: self._build()
+        return self._lookup(self.up, "KU", key)
+
+    def _lookup(self, table, header, key):
+        # KeyCode 取字符查表；Key 枚举没有 char 属性，直接按成员查表
+        char = getattr(key, 'char', None)
+        data = table.get(char or key)
+        if data is None:
+            name = getattr(key, 'name', None)
+            if char:
+                # 表外字符 (非 ASCII 等) 按需编码
+                data = self.encode(header, char)
+            elif name and not name.startswith('media_'):
+                # 不是 pynput Key 成员但有键名 (例如 kvm_trace 回放的 TraceKey)
+                data = self.encode(header, key_name(name, self.target_os))
+        return data
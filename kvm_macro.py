@@ -0,0 +1,357 @@
+import collections
+import json
+import os
+import threading
+import time
+
+from kvm_motion import split_delta
+
+# ==========================================
+# 宏引擎
+# ==========================================
+# 宏定义 (JSON / YAML) -> 预编译的字节时间表 [(相对时间, 已编码指令), ...]
+# 播放时按单调时钟的绝对目标时间发送 (t0 + 相对时间)，先 sleep 再短暂自旋，
+# 不使用累加的 time.sleep，因此误差不会随步骤数累积；每一步的实际偏差都会记录下来。
+#
+# 宏文件格式:
+#   {"macros": [
+#       {"name": "copy", "label": "复制\nCtrl+C", "pos": [0, 0], "steps": [{"combo": ["ctrl_l", "c"]}]},
+#       {"name": "hello", "label": "输入\nHello", "pos": [3, 0], "steps": [{"text": "Hello World!"}]}
+#   ]}
+#
+# 步骤:
+#   {"down": "ctrl_l"} / {"up": "ctrl_l"}       按下 / 松开
+#   {"tap": "enter", "hold": 0.05}               单击一个键
+#   {"combo": ["ctrl_l", "c"], "gap": 0.02, "hold": 0.05}
+#                                                按顺序按下，保持 hold 秒，反向松开 (每个键间隔 gap 秒)
+#   {"text": "Hello", "interval": 0.02}          输入文本: 固件支持 T 指令时按块批量输入 (等待固件确认，
+#                                                interval 不起作用)；旧固件或非 ASCII 文本逐字符 KD/KU
+#   {"delay": 0.5}                               等待
+#   {"move": [dx, dy]}                           相对移动 (超出 HID 范围自动拆包)
+#   {"click": "L", "hold": 0.05}                 鼠标点击 (L/R/M)
+#   {"mouse_down": "L"} / {"mouse_up": "L"}
+#   {"scroll": -3}                               滚轮 (正数向上)
+#   {"hscroll": 2}                               水平滚动 (正数向右，固件 v4.4+)
+
+DEFAULT_GAP = 0.02    # 组合键中相邻两个键之间的间隔
+DEFAULT_HOLD = 0.05   # 组合键 / 单击的保持时间
+DEFAULT_INTERVAL = 0.02  # 文本宏每个字符之间的间隔
+SPIN_THRESHOLD = 0.002   # 距目标时间不足该值时改为自旋等待 (sleep 的精度不够)
+JITTER_HISTORY = 1000    # 保留最近多少个步骤的偏差
+
+
+class MacroError(ValueError):
+    pass
+
+
+class BulkText:
+    """时间表中的一块批量输入文本: 播放器交给 type_text 回调 (等固件确认后才继续)，不直接发送"""
+
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return f"BulkText({self.text!r})"
+
+
+class Schedule:
+    """编译后的宏: offsets[i] 时刻发送 payloads[i] (BulkText 之后的步骤按输入完成的时间顺延)"""
+
+    def __init__(self, offsets, payloads):
+        self.offsets = offsets
+        self.payloads = payloads
+        self.duration = offsets[-1] if offsets else 0.0
+
+    def __len__(self):
+        return len(self.payloads)
+
+
+def compile_steps(steps, encode, encode_move, type_chunk=None):
+    """
+    把步骤列表编译成 Schedule。
+    encode(header, data) -> bytes, encode_move(dx, dy) -> bytes (与客户端的编码方式一致)
+    type_chunk: 固件支持批量输入时为每块的最大长度，ASCII 文本编译成 BulkText 块；None 时逐字符 KD/KU
+    """
+    offsets, payloads = [], []
+    t = 0.0
+
+    def emit(payload):
+        offsets.append(t)
+        payloads.append(payload)
+
+    for i, step in enumerate(steps):
+        if not isinstance(step, dict) or len(step.keys() - {"hold", "gap", "interval"}) != 1:
+            raise MacroError(f"第 {i + 1} 步格式错误: {step!r}")
+        hold = float(step.get("hold", DEFAULT_HOLD))
+        if "down" in step:
+            emit(encode("KD", step["down"]))
+        elif "up" in step:
+            emit(encode("KU", step["up"]))
+        elif "tap" in step:
+            emit(encode("KD", step["tap"]))
+            t += hold
+            emit(encode("KU", step["tap"]))
+        elif "combo" in step:
+            keys = step["combo"]
+            gap = float(step.get("gap", DEFAULT_GAP))
+            for n, k in enumerate(keys):
+                if n: t += gap
+                emit(encode("KD", k))
+            t += hold
+            for n, k in enumerate(reversed(keys)):
+                if n: t += gap
+                emit(encode("KU", k))
+        elif "text" in step:
+            text = step["text"]
+            if type_chunk and text.isascii():
+                for n in range(0, len(text), type_chunk):
+                    emit(BulkText(text[n:n + type_chunk]))
+                continue
+            interval = float(step.get("interval", DEFAULT_INTERVAL))
+            for n, ch in enumerate(text):
+                if n: t += interval
+                emit(encode("KD", ch))
+                emit(encode("KU", ch))
+        elif "delay" in step:
+            t += float(step["delay"])
+        elif "move" in step:
+            dx, dy = step["move"]
+            for sx, sy in split_delta(int(dx), int(dy)):
+                emit(encode_move(sx, sy))
+        elif "click" in step:
+            emit(encode("MD", step["click"]))
+            t += hold
+            emit(encode("MU", step["click"]))
+        elif "mouse_down" in step:
+            emit(encode("MD", step["mouse_down"]))
+        elif "mouse_up" in step:
+            emit(encode("MU", step["mouse_up"]))
+        elif "scroll" in step:
+            emit(encode("S", str(int(step["scroll"]))))
+        elif "hscroll" in step:
+            emit(encode("SH", str(int(step["hscroll"]))))
+        else:
+            raise MacroError(f"第 {i + 1} 步未知动作: {step!r}")
+    return Schedule(offsets, payloads)
+
+
+class Macro:
+    def __init__(self, name, steps, label=None, pos=None):
+        self.name = name
+        self.steps = steps
+        self.label = label or name
+        self.pos = tuple(pos) if pos else None
+        self._compiled = {}  # 编码方式 -> Schedule
+
+    def compile(self, encode, encode_move, key=None, type_chunk=None):
+        """编译并缓存 (key 标识编码方式，例如 (协议版本, crc, 是否批量输入))"""
+        schedule = self._compiled.get(key)
+        if schedule is None:
+            schedule = compile_steps(self.steps, encode, encode_move, type_chunk)
+            self._compiled[key] = schedule
+        return schedule
+
+    def has_text(self):
+        return any(isinstance(step, dict) and "text" in step for step in self.steps)
+
+    def for_client(self, client):
+        """按 ArduinoKVMClient 当前的协议编译 (协议变化后自动重新编译)"""
+        # 只有含文本步骤的宏才需要探测固件是否支持 T 指令
+        bulk = self.has_text() and client._probe_bulk_text()
+        type_chunk = None
+        if bulk:
+            from arduino_kvm_lib import TYPE_CHUNK_MAX  # 客户端存在时库已经加载
+            type_chunk = TYPE_CHUNK_MAX
+        return self.compile(client._encode, client._encode_move, (client.protocol, client.use_crc, bulk), type_chunk)
+
+
+def parse_macros(doc):
+    """宏文件内容 (dict) -> [Macro]"""
+    items = doc.get("macros") if isinstance(doc, dict) else None
+    if not isinstance(items, list):
+        raise MacroError("宏文件缺少 macros 列表")
+    macros = []
+    for item in items:
+        if "name" not in item or "steps" not in item:
+            raise MacroError(f"宏缺少 name 或 steps: {item!r}")
+        macros.append(Macro(item["name"], item["steps"], item.get("label"), item.get("pos")))
+    return macros
+
+
+def load_macros(path):
+    """读取 .json / .yaml / .yml 宏文件 (YAML 需要安装 PyYAML)"""
+    with open(path, encoding="utf-8") as f:
+        if os.path.splitext(path)[1].lower() in (".yaml", ".yml"):
+            try:
+                import yaml
+            except ImportError:
+                raise MacroError("读取 YAML 宏文件需要安装 PyYAML (pip install pyyaml)")
+            doc = yaml.safe_load(f)
+        else:
+            doc = json.load(f)
+    return parse_macros(doc)
+
+
+class MacroPlayer:
+    """
+    后台线程按顺序播放宏，调用方 (例如 Tk 按钮回调) 不会被阻塞。
+    send(payload): 发送一条已编码指令，例如 ArduinoKVMClient._send
+    on_cancel(): 取消播放时调用，一般发送 REL 防止卡键
+    type_text(text): 批量输入一块文本并等待固件确认，成功返回 True (时间表含 BulkText 时必须提供)
+    """
+
+    def __init__(self, send, on_cancel=None, type_text=None):
+        self.send = send
+        self.on_cancel = on_cancel
+        self.type_text = type_text
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.cancelled = False
+        self.jitter = collections.deque(maxlen=JITTER_HISTORY)  # 每步实际发送时间 - 目标时间 (秒)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="kvm-macro", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def for_client(cls, client):
+        """播放到 ArduinoKVMClient: 指令走 _send，文本块走固件批量输入，取消时释放所有键"""
+        return cls(client._send, on_cancel=lambda: client.send_packet_raw("REL", "0"),
+                   type_text=client._type_text_bulk)
+
+    def play(self, schedule):
+        """排队播放，立即返回"""
+        with self.cond:
+            self.queue.append(schedule)
+            self.cond.notify()
+
+    def play_now(self, schedule):
+        """在当前线程同步播放"""
+        self.cancelled = False
+        self._play(schedule)
+
+    def cancel(self):
+        """停止当前宏并清空队列"""
+        with self.cond:
+            self.queue.clear()
+            self.cancelled = True
+            self.cond.notify()
+
+    def stop(self):
+        self.cancel()
+        with self.cond:
+            self._running = False
+            self.cond.notify()
+        self._thread.join(timeout=1.0)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.queue and self._running:
+                    self.cond.wait()
+                if not self._running:
+                    return
+                schedule = self.queue.popleft()
+                self.cancelled = False
+            self._play(schedule)
+
+    def _play(self, schedule):
+        offsets, payloads, send = schedule.offsets, schedule.payloads, self.send
+        t0 = time.perf_counter()
+        for i in range(len(payloads)):
+            # 每一步都以 t0 为基准计算绝对目标时间，sleep 的误差不会累积到后面的步骤
+            target = t0 + offsets[i]
+            while True:
+                remaining = target - time.perf_counter()
+                if remaining <= 0 or self.cancelled:
+                    break
+                if remaining > SPIN_THRESHOLD:
+                    time.sleep(remaining - SPIN_THRESHOLD)
+            if self.cancelled:
+                if self.on_cancel:
+                    self.on_cancel()
+                return
+            start = time.perf_counter()
+            self.jitter.append(start - target)
+            payload = payloads[i]
+            if isinstance(payload, BulkText):
+                if not self.type_text(payload.text):
+                    if self.on_cancel:
+                        self.on_cancel()  # 固件没有确认: 停止播放，后面的步骤不再有意义
+                    return
+                t0 += time.perf_counter() - start  # 之后的步骤按输入完成的时间顺延
+                continue
+            send(payload)
+
+    def jitter_stats(self):
+        """最近播放步骤的发送偏差 (毫秒)"""
+        values = sorted(self.jitter)
+        if not values:
+            return {"steps": 0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        return {
+            "steps": len(values),
+            "p50_ms": values[len(values) // 2] * 1000,
+            "p99_ms": values[min(len(values) - 1, int(len(values) * 0.99))] * 1000,
+            "max_ms": values[-1] * 1000,
+        }
+
+
+def main():
+    """
+    命令行单独执行一个宏 (不启动界面，供启动器/快捷键调用):
+      python kvm_macro.py macros/stream_deck.json copy [--port COM5]
+      python kvm_macro.py macros/stream_deck.json list
+    kvm_daemon.py 在运行时 (且未指定 --port) 交给守护进程执行，不再自己打开串口。
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description="Arduino KVM 宏命令行")
+    parser.add_argument("file", help="宏文件 (.json / .yaml)")
+    parser.add_argument("name", help="宏名称；list 列出文件中的所有宏")
+    parser.add_argument("--port", help="串口名或 URL (默认自动检测)")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--direct", action="store_true", help="不使用守护进程，直接打开串口")
+    args = parser.parse_args()
+
+    macros = load_macros(args.file)
+    if args.name == "list":
+        for m in macros:
+            print(f"{m.name}\t{m.label.replace(chr(10), ' ')}")
+        return 0
+    macro = next((m for m in macros if m.name == args.name), None)
+    if macro is None:
+        print(f"❌ [Macro] 找不到宏: {args.name}")
+        return 2
+
+    if not (args.port or args.direct):
+        from kvm_daemon_client import DaemonError, KVMDaemonClient, daemon_available
+        if daemon_available():
+            kvm = KVMDaemonClient()
+            try:
+                if kvm.connect():
+                    kvm.play_macro(macro.name, args.file)
+                    return 0
+                print(f"❌ [Macro] {kvm.error_msg}")
+                return 1
+            except DaemonError as e:
+                print(f"❌ [Macro] {e}")
+                return 1
+            finally:
+                kvm.disconnect()
+
+    # 只有真正要执行宏时才加载串口库
+    import arduino_kvm_lib
+    kvm = arduino_kvm_lib.ArduinoKVMClient(args.port, args.baud, auto_reconnect=False)
+    if not kvm.connect():
+        return 1
+    player = MacroPlayer.for_client(kvm)
+    try:
+        player.play_now(macro.for_client(kvm))
+    except KeyboardInterrupt:
+        player.cancel()
+    finally:
+        player.stop()
+        kvm.disconnect()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
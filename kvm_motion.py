@@ -0,0 +1,200 @@
+import threading
+import time
+
+# ==========================================
+# 鼠标位移聚合器
+# ==========================================
+# 不再丢弃限流窗口内的鼠标事件，而是把两次发送之间的所有 dx/dy 累加起来，
+# 按固定的回报率 (125/250/500/1000 Hz) 每个周期合并发送一次。
+# 超出固件 HID 范围 (-127 ~ 127) 的位移拆成多个包，而不是截断，
+# 因此远端光标与本地光标不会产生累计漂移。
+# 绝对定位模式下只保留最新的坐标，每个周期发送一个定位包。
+# 平滑模式 (固件 v4.3+) 下每个周期发送一个带时间戳的位移样本 (不拆包)，由固件按 1kHz 均匀播放，
+# 因此样本率可以远低于回报率；位移停止后再发送一个空样本，固件据此收回外推多走的部分。
+# 滚轮 (垂直和水平) 也在同一个周期合并: 触控板的高精度滚动是小数格，先累加，
+# 只有凑满整格才发送，余数留到下一个周期 (方向反转时丢弃，避免反向滚动先抵消旧余数)。
+
+HID_DELTA_MAX = 127
+DEFAULT_REPORT_RATE = 250
+SMOOTH_SAMPLE_RATE = 100  # 平滑模式的样本率 (Hz)，固件在样本之间插值
+SAMPLE_DELTA_MAX = 32767  # 样本的位移为 int16
+SCROLL_EPSILON = 1e-6     # 小数格累加的浮点误差容限 (0.05 * 20 应当凑满一格)
+
+
+def _ticks(amount):
+    """累计的滚动 -> 可以发送的整格数 (向零取整)"""
+    return int(amount + SCROLL_EPSILON) if amount >= 0 else int(amount - SCROLL_EPSILON)
+
+
+def split_delta(dx, dy, limit=HID_DELTA_MAX):
+    """将位移拆分为若干个不超过 limit 的分段，各分段之和严格等于 (dx, dy)"""
+    steps = max(-(-abs(dx) // limit), -(-abs(dy) // limit))
+    if steps <= 1:
+        return [(dx, dy)] if (dx or dy) else []
+    out = []
+    px = py = 0
+    for i in range(1, steps + 1):
+        # 按累计目标取整，误差不会逐段累积
+        nx, ny = dx * i // steps, dy * i // steps
+        out.append((nx - px, ny - py))
+        px, py = nx, ny
+    return out
+
+
+class MotionAccumulator:
+    def __init__(self, send_move, rate_hz=DEFAULT_REPORT_RATE, send_abs=None, send_scroll=None):
+        """
+        send_move(dx, dy): 发送一个鼠标位移包的回调 (保证在 HID 范围内)
+        rate_hz: 每秒最多发送的合并包数
+        send_abs(x, y): 绝对定位模式下发送本机坐标的回调
+        send_scroll(wheel, pan): 发送整格滚动的回调 (垂直 / 水平，保证在 HID 范围内)
+        """
+        self.send_move = send_move
+        self.send_abs = send_abs
+        self.send_scroll = send_scroll
+        self.absolute = False
+        self.pending_abs = None
+        self.interval = 1.0 / rate_hz
+        # 平滑模式: send_sample(t_ms, dx, dy) 不为 None 时按样本率发送位移样本
+        self.send_sample = None
+        self.sample_interval = 1.0 / SMOOTH_SAMPLE_RATE
+        self.moving = False  # 上一个样本有位移 (停止后需要补发空样本)
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()  # 取出 + 发送 (flush 可能同时在发送线程和点击线程中执行)
+        self.pending_dx = 0
+        self.pending_dy = 0
+        self.pending_wheel = 0.0  # 尚未凑满整格的滚动 (格)
+        self.pending_pan = 0.0
+        self.prev_x = None
+        self.prev_y = None
+        self.last_flush = 0
+        self.events_in = 0
+        self.packets_out = 0  # 实际发出的位移包数 (events_in - packets_out 即被合并的事件数)，在 send_lock 内更新
+
+        self._wake = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def set_rate(self, rate_hz):
+        self.interval = 1.0 / rate_hz
+
+    def set_smooth(self, send_sample, rate_hz=SMOOTH_SAMPLE_RATE):
+        """开启 (send_sample 为回调) 或关闭 (None) 平滑模式"""
+        self.flush()
+        with self.send_lock:
+            self.send_sample = send_sample
+            self.sample_interval = 1.0 / rate_hz
+            self.moving = False
+
+    # --- 输入 ---
+
+    def add(self, dx, dy):
+        """累加一次相对位移"""
+        with self.lock:
+            self.pending_dx += dx
+            self.pending_dy += dy
+            self.events_in += 1
+        self._wake.set()
+
+    def add_scroll(self, dx, dy):
+        """累加一次滚动 (格，可以是小数；dy > 0 向上，dx > 0 向右，与 pynput 一致)"""
+        if not (dx or dy):
+            return
+        with self.lock:
+            if dy * self.pending_wheel < 0:
+                self.pending_wheel = 0.0
+            if dx * self.pending_pan < 0:
+                self.pending_pan = 0.0
+            self.pending_wheel += dy
+            self.pending_pan += dx
+            self.events_in += 1
+        self._wake.set()
+
+    def reset_position(self, x, y):
+        """设置参考坐标 (不产生位移)"""
+        self.prev_x, self.prev_y = int(x), int(y)
+
+    def move_to(self, x, y):
+        """由绝对坐标计算相对位移并累加 (pynput on_move 只给绝对坐标)"""
+        x, y = int(x), int(y)
+        if self.absolute:
+            # 绝对定位: 中间的坐标没有意义，只保留最新的一个
+            with self.lock:
+                self.pending_abs = (x, y)
+                self.events_in += 1
+            self.prev_x, self.prev_y = x, y
+            self._wake.set()
+            return
+        if self.prev_x is None:
+            self.prev_x, self.prev_y = x, y
+            return
+        dx, dy = x - self.prev_x, y - self.prev_y
+        self.prev_x, self.prev_y = x, y
+        if dx or dy:
+            self.add(dx, dy)
+
+    # --- 输出 ---
+
+    def flush(self):
+        """立即发送所有累积的位移和整格滚动 (点击前调用，保证点击落在正确位置)"""
+        # 取出和发送在同一把锁内完成: 点击线程的 flush 不会越过发送线程已取出但还没发出的位移，
+        # 平滑样本也按时间戳顺序发出 (send_lock 在 lock 之外，add() 不受影响)
+        with self.send_lock:
+            with self.lock:
+                dx, dy = self.pending_dx, self.pending_dy
+                self.pending_dx = self.pending_dy = 0
+                wheel, pan = _ticks(self.pending_wheel), _ticks(self.pending_pan)
+                self.pending_wheel -= wheel
+                self.pending_pan -= pan
+                pos, self.pending_abs = self.pending_abs, None
+                self._wake.clear()
+                self.last_flush = time.monotonic()
+            if pos is not None:
+                self.packets_out += 1
+                self.send_abs(*pos)
+            send_sample = self.send_sample
+            if send_sample is not None:
+                if dx or dy or self.moving:
+                    t = int(time.monotonic() * 1000) & 0xFFFF
+                    # 超出 int16 的位移 (几乎不会出现) 拆成同一时间戳的多个样本
+                    for sx, sy in split_delta(dx, dy, SAMPLE_DELTA_MAX) or [(0, 0)]:
+                        self.packets_out += 1
+                        send_sample(t, sx, sy)
+                    self.moving = bool(dx or dy)
+            else:
+                for sx, sy in split_delta(dx, dy):
+                    self.packets_out += 1
+                    self.send_move(sx, sy)
+            if self.send_scroll is not None:
+                for sw, sp in split_delta(wheel, pan):
+                    self.packets_out += 1
+                    self.send_scroll(sw, sp)
+
+    def start(self):
+        if self._running: return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="kvm-motion", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self._running: return
+        self._running = False
+        self._wake.set()
+        self._thread.join(timeout=1.0)
+        self._thread = None
+        self.flush()
+
+    def _run(self):
+        while self._running:
+            smooth = self.send_sample is not None
+            # 平滑模式: 位移停止后一个周期内没有新事件，就发送空样本
+            if not self._wake.wait(self.sample_interval if smooth and self.moving else None):
+                self.flush()
+                continue
+            if not self._running: break
+            # 距上次发送不足一个周期则等到周期结束，期间的事件都会被合并
+            interval = self.sample_interval if smooth else self.interval
+            remaining = self.last_flush + interval - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+            self.flush()
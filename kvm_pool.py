@@ -0,0 +1,259 @@
+import threading
+import time
+
+import arduino_kvm_lib
+from kvm_motion import MotionAccumulator, DEFAULT_REPORT_RATE
+
+# ==========================================
+# 多目标设备池
+# ==========================================
+# 同时打开多个 Leonardo (每台目标机一个)，一份本机输入按需路由:
+#   - 单目标: 只发给当前选中的设备
+#   - 广播:   发给一个设备组 (例如同时在几台机器上输入同一条命令)
+# 每个设备使用各自的 ArduinoKVMClient 和发送线程 (async_tx)，回调线程只负责入队，
+# 一台设备卡住或断开不会拖慢其他设备。
+# 切换目标只是更换路由表，下一次位移合并发送就会到达新设备 (小于一个回报周期)；
+# 切换前会把累积的位移发给旧设备并发送 REL，旧设备上不会残留按下的键。
+#
+# 热键 (默认): Ctrl+Alt+1..9 选择第 N 台设备，Ctrl+Alt+0 广播到全部设备。
+#
+#   python kvm_pool.py COM5 COM6 COM7
+
+HOTKEY_MODIFIERS = ('ctrl', 'alt')
+
+
+def _modifier(key):
+    """Key.ctrl_l -> 'ctrl'，非修饰键返回 None"""
+    name = getattr(key, 'name', None)
+    if name is None:
+        return None
+    base = name.split('_')[0]
+    return base if base in ('ctrl', 'alt', 'shift', 'cmd') else None
+
+
+class KVMDevicePool:
+    def __init__(self, ports, report_rate=DEFAULT_REPORT_RATE, **client_kwargs):
+        """
+        ports: 串口列表 (或 socket:// URL)
+        client_kwargs: 传给每个 ArduinoKVMClient 的参数 (protocol / crc / reliable ...)
+        """
+        client_kwargs.setdefault('async_tx', True)  # 每个设备独立的写线程
+        self.clients = [arduino_kvm_lib.ArduinoKVMClient(p, **client_kwargs) for p in ports]
+        self.lock = threading.Lock()
+        self.active = 0
+        self.group = None          # 广播时为设备下标列表
+        self.targets = [self.clients[0]] if self.clients else []  # 当前路由 (回调线程只读这个列表)
+        self.target_os = 'WIN'
+        self.mirror_enabled = False
+        self.held_modifiers = set()
+        self.swallowed = set()     # 作为热键被拦截的按键 (松开时也不转发)
+        self.switches = 0
+
+        # 位移只聚合一次，再分发给所有目标
+        self.motion = MotionAccumulator(self._send_move, rate_hz=report_rate, send_scroll=self._send_scroll)
+        self.m_listener = None
+        self.k_listener = None
+
+    # --- 连接 ---
+
+    def connect_all(self):
+        """连接全部设备，返回成功连接的数量"""
+        ok = 0
+        for c in self.clients:
+            if c.connect():
+                ok += 1
+            else:
+                print(f"❌ [Pool] {c.port} 连接失败: {c.error_msg}")
+        return ok
+
+    def disconnect_all(self):
+        self.stop_mirroring()
+        for c in self.clients:
+            c.disconnect()
+
+    # --- 路由 ---
+
+    def select(self, index):
+        """只控制第 index 台设备"""
+        if not 0 <= index < len(self.clients):
+            return False
+        self._switch([self.clients[index]])
+        with self.lock:
+            self.active, self.group = index, None
+        print(f"🎯 [Pool] 当前目标: #{index + 1} {self.clients[index].port}")
+        return True
+
+    def broadcast(self, indices=None):
+        """广播到设备组 (默认全部设备)"""
+        indices = list(range(len(self.clients))) if indices is None else [i for i in indices if 0 <= i < len(self.clients)]
+        if not indices:
+            return False
+        self._switch([self.clients[i] for i in indices])
+        with self.lock:
+            self.group = indices
+        print(f"📣 [Pool] 广播到: {', '.join(f'#{i + 1}' for i in indices)}")
+        return True
+
+    def _switch(self, new_targets):
+        old = self.targets
+        # 累积的位移属于旧目标，先发出去
+        self.motion.flush()
+        for c in old:
+            if c not in new_targets:
+                c.send_packet_raw("REL", "0")
+        self.targets = new_targets  # 列表整体替换，回调线程无需加锁
+        self.switches += 1
+
+    def status(self):
+        return {
+            "active": self.active,
+            "group": self.group,
+            "devices": [
+                {"port": c.port, "connected": c.connected, "queue": c.tx_queue_depth(), "dropped": c.tx_dropped}
+                for c in self.clients
+            ],
+            "switches": self.switches,
+        }
+
+    # --- 发送 (只入队，不阻塞) ---
+
+    def _send_move(self, dx, dy):
+        for c in self.targets:
+            c.mouse_move(dx, dy)
+
+    def _send_scroll(self, wheel, pan):
+        for c in self.targets:
+            c.scroll(wheel, pan)
+
+    def send_packet_raw(self, header, data):
+        for c in self.targets:
+            c.send_packet_raw(header, data)
+
+    def set_target_os(self, os_type):
+        self.target_os = os_type
+        for c in self.clients:
+            c.set_target_os(os_type)
+
+    # --- 镜像 ---
+
+    def start_mirroring(self):
+        if self.mirror_enabled: return
+        from pynput import mouse, keyboard  # 只在镜像时加载 (无显示器的环境也能只用路由和发送)
+        self.motion.reset_position(*mouse.Controller().position)
+        self.motion.start()
+        guard = self._guard_callback
+        self.m_listener = mouse.Listener(on_move=guard(self._on_move), on_click=guard(self._on_click),
+                                         on_scroll=guard(self._on_scroll))
+        self.k_listener = keyboard.Listener(on_press=guard(self._on_press), on_release=guard(self._on_release))
+        self.m_listener.start()
+        self.k_listener.start()
+        self.mirror_enabled = True
+        print("🟢 [Pool] 镜像已启动")
+
+    def stop_mirroring(self):
+        if not self.mirror_enabled: return
+        self.mirror_enabled = False
+        for listener in (self.m_listener, self.k_listener):
+            if listener is None: continue
+            listener.stop()
+            # 等正在执行的回调返回，避免它在 REL 之后又发出按下指令
+            if listener is not threading.current_thread():
+                listener.join(timeout=0.5)
+        self.motion.stop()
+        for c in self.clients:
+            c.send_packet_raw("REL", "0")
+        print("⚪ [Pool] 镜像已停止")
+
+    def _guard_callback(self, fn):
+        """回调抛出异常时 pynput 会停止监听: 先在所有设备上释放全部按键再继续"""
+        def wrapper(*args):
+            try:
+                return fn(*args)
+            except Exception as e:
+                print(f"❌ [Pool] 镜像回调异常: {e}，已释放所有按键")
+                for c in self.clients:
+                    c.send_packet_raw("REL", "0")
+        return wrapper
+
+    def _on_move(self, x, y):
+        self.motion.move_to(x, y)
+
+    def _on_click(self, x, y, button, pressed):
+        self.motion.flush()
+        name = getattr(button, 'name', None)
+        btn_code = "L" if name == 'left' else "R" if name == 'right' else "M"
+        self.send_packet_raw("MD" if pressed else "MU", btn_code)
+
+    def _on_scroll(self, x, y, dx, dy):
+        self.motion.add_scroll(dx, dy)
+
+    def _hotkey(self, key):
+        """Ctrl+Alt+数字: 返回设备下标 (0 表示广播，返回 -1)，否则返回 None"""
+        if not all(m in self.held_modifiers for m in HOTKEY_MODIFIERS):
+            return None
+        vk = getattr(key, 'vk', None)
+        char = getattr(key, 'char', None)
+        # 按住 Ctrl+Alt 时部分系统给不出字符，用虚拟键码兜底 (0x30-0x39 为数字键)
+        if char and char.isdigit():
+            digit = int(char)
+        elif vk is not None and 0x30 <= vk <= 0x39:
+            digit = vk - 0x30
+        else:
+            return None
+        return -1 if digit == 0 else digit - 1
+
+    def _on_press(self, key):
+        mod = _modifier(key)
+        if mod:
+            self.held_modifiers.add(mod)
+        else:
+            target = self._hotkey(key)
+            if target is not None:
+                self.swallowed.add(key)
+                if target < 0:
+                    self.broadcast()
+                else:
+                    self.select(target)
+                return
+        for c in self.targets:
+            data = c.keymap.press(key)
+            if data: c._send(data)
+
+    def _on_release(self, key):
+        mod = _modifier(key)
+        if mod:
+            self.held_modifiers.discard(mod)
+        if key in self.swallowed:
+            self.swallowed.discard(key)
+            return
+        for c in self.targets:
+            data = c.keymap.release(key)
+            if data: c._send(data)
+
+
+def main():
+    import sys
+    ports = sys.argv[1:]
+    if not ports:
+        # 未指定时使用所有识别到的 KVM 设备
+        from kvm_discovery import DeviceDiscovery
+        ports = DeviceDiscovery.default().find_all()
+    if not ports:
+        print("用法: python kvm_pool.py <串口1> <串口2> ...  (未指定时自动识别所有设备)")
+        return
+    pool = KVMDevicePool(ports)
+    if not pool.connect_all():
+        return
+    pool.select(0)
+    pool.start_mirroring()
+    print("Ctrl+Alt+1..9 切换目标，Ctrl+Alt+0 广播，Ctrl+C 退出")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    pool.disconnect_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,498 @@
+import hmac
+import ipaddress
+import os
+import secrets
+import socket
+import struct
+import threading
+import time
+from urllib.parse import parse_qs, quote, urlsplit
+
+import serial
+
+from kvm_baud import BASE_BAUD, negotiable, negotiate, restore_base
+
+# ==========================================
+# 网络中继
+# ==========================================
+# 让运行 pynput 的电脑不必直接连着 Arduino:
+#   中继服务器 (接 Arduino 的电脑) 独占串口，客户端通过网络发送与串口完全相同的指令字节。
+#   - TCP: 按键/点击/文本等所有指令，以及固件回复 (握手、T 确认、可靠模式 A 确认) 原样回传
+#          每次 write() 作为一条消息 [长度 2B][指令字节]，服务器收齐整条消息才写串口，
+#          因此 UDP 位移包不会插进一条 TCP 指令的中间
+#   - UDP: 鼠标位移，[b"KM"][会话 8B][序号 4B][一批位移帧]，每个数据报携带一次合并发送的全部位移；
+#          序号不大于已收到的最大序号的数据报 (乱序/过期) 直接丢弃
+#   两端都关闭 Nagle (TCP_NODELAY)，小包立即发出。
+#
+# 访问控制: 中继会把收到的字节直接写进串口，等于把键盘鼠标交给对方，所以
+#   - 默认只监听 127.0.0.1；监听其他地址时必须设置共享令牌 (--token) 或来源白名单 (--allow)
+#   - TCP 连接的第一条消息必须是 "AUTH:<令牌>"，服务器回复 "AUTH:OK,<会话号>" 后才转发指令；
+#     UDP 数据报必须带上这个随机会话号并来自同一主机，否则丢弃
+#   - 同一时间只接受一个控制连接 (固件的协议版本、CRC、可靠模式序号都是全局状态，
+#     多个客户端各自握手会互相打乱)，其他连接收到 "AUTH:BUSY" 后关闭
+#
+# 客户端: ArduinoKVMClient("kvm://192.168.1.20:5600?token=...")  (UDP 使用同一端口号)
+# 服务器: python kvm_relay.py COM5 --host 0.0.0.0 --token ...
+# 令牌也可以用环境变量 ARDUINO_KVM_RELAY_TOKEN 提供 (两端都读取)。
+# 客户端经过中继时不做速率协商，由服务器在打开串口时协商 (见 kvm_baud.py)，停止时切回上电速率。
+#
+# 注意: 位移与点击走不同的通道，两者之间不保证严格顺序；点击前客户端会先发出累积的位移，
+# 局域网中 UDP 通常先到达。
+
+DEFAULT_RELAY_PORT = 5600
+DEFAULT_RELAY_HOST = "127.0.0.1"
+UDP_MAGIC = b"KM"
+UDP_HEADER = struct.Struct(">2s8sI")
+MSG_HEADER = struct.Struct(">H")
+MSG_MAX = 0xFFFF
+AUTH_TIMEOUT = 2.0  # 连接后发送认证消息的期限 (秒)
+TOKEN_ENV = "ARDUINO_KVM_RELAY_TOKEN"
+
+
+def _is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _seq_newer(seq, last):
+    """32 位序号比较 (考虑回绕)"""
+    return 0 < ((seq - last) & 0xFFFFFFFF) < 0x80000000
+
+
+# ==========================================
+# 客户端传输 (代替 serial.Serial)
+# ==========================================
+
+class RelayTransport:
+    """实现 ArduinoKVMClient 用到的 serial.Serial 接口，另加 write_motion() 走 UDP"""
+
+    def __init__(self, host, port=DEFAULT_RELAY_PORT, timeout=0.1, connect_timeout=3.0, token=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = socket.create_connection((host, port), timeout=connect_timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(timeout)
+        self.udp = socket.socket(self.sock.family, socket.SOCK_DGRAM)
+        self.udp_addr = self.sock.getpeername()
+        self.udp_seq = 0
+        self.send_lock = threading.Lock()
+        self.rx = bytearray()
+        self.is_open = True
+        self.datagrams = 0
+        try:
+            self.session = self._authenticate(token or os.environ.get(TOKEN_ENV, ""), connect_timeout)
+        except Exception:
+            self.close()
+            raise
+
+    @classmethod
+    def from_url(cls, url, timeout=0.1):
+        """kvm://host[:port][?token=令牌]"""
+        parts = urlsplit(url)
+        if parts.scheme != "kvm" or not parts.hostname:
+            raise ValueError(f"无效的中继地址: {url}")
+        token = parse_qs(parts.query).get("token", [None])[0]
+        return cls(parts.hostname, parts.port or DEFAULT_RELAY_PORT, timeout, token=token)
+
+    def _authenticate(self, token, timeout):
+        """发送令牌，返回服务器分配的 UDP 会话号"""
+        self.write(b"AUTH:" + token.encode("utf-8"))
+        deadline = time.monotonic() + timeout
+        while b"\n" not in self.rx:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._fill(remaining):
+                raise serial.SerialException("中继服务器没有回复认证")
+        line, _, rest = bytes(self.rx).partition(b"\n")
+        self.rx = bytearray(rest)
+        if line.startswith(b"AUTH:OK,"):
+            return bytes.fromhex(line[len(b"AUTH:OK,"):].decode("ascii"))
+        if line == b"AUTH:BUSY":
+            raise serial.SerialException("中继服务器已有其他客户端在控制")
+        raise serial.SerialException("中继服务器拒绝连接 (令牌错误或不在白名单中)")
+
+    # --- 发送 ---
+
+    def write(self, data):
+        data = bytes(data)
+        with self.send_lock:
+            for i in range(0, len(data), MSG_MAX):
+                chunk = data[i:i + MSG_MAX]
+                self.sock.sendall(MSG_HEADER.pack(len(chunk)) + chunk)
+        return len(data)
+
+    def write_motion(self, data):
+        """位移帧走 UDP (即发即弃，服务器丢弃过期的数据报)"""
+        with self.send_lock:
+            self.udp_seq = (self.udp_seq + 1) & 0xFFFFFFFF
+            packet = UDP_HEADER.pack(UDP_MAGIC, self.session, self.udp_seq) + bytes(data)
+        self.udp.sendto(packet, self.udp_addr)
+        self.datagrams += 1
+        return len(data)
+
+    def flush(self):
+        pass
+
+    # --- 接收 ---
+
+    def _fill(self, timeout):
+        self.sock.settimeout(max(timeout, 0.001))
+        try:
+            data = self.sock.recv(4096)
+        except socket.timeout:
+            return False
+        if not data:
+            raise serial.SerialException("中继服务器已断开")
+        self.rx += data
+        return True
+
+    def readline(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            idx = self.rx.find(b"\n")
+            if idx >= 0:
+                line = bytes(self.rx[:idx + 1])
+                del self.rx[:idx + 1]
+                return line
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._fill(remaining):
+                line = bytes(self.rx)
+                self.rx.clear()
+                return line
+
+    def read(self, size=1):
+        deadline = time.monotonic() + self.timeout
+        while len(self.rx) < size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._fill(remaining):
+                break
+        data = bytes(self.rx[:size])
+        del self.rx[:size]
+        return data
+
+    @property
+    def in_waiting(self):
+        return len(self.rx)
+
+    def reset_input_buffer(self):
+        self.rx.clear()
+        self.sock.setblocking(False)
+        try:
+            while self.sock.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        finally:
+            self.sock.settimeout(self.timeout)
+
+    def close(self):
+        self.is_open = False
+        for s in (self.sock, self.udp):
+            try:
+                s.close()
+            except OSError:
+                pass
+
+
+# ==========================================
+# 中继服务器
+# ==========================================
+
+class KVMRelayServer:
+    def __init__(self, serial_port, baud_rate=BASE_BAUD, host=DEFAULT_RELAY_HOST, port=DEFAULT_RELAY_PORT,
+                 link_baud='auto', token=None, allow=None):
+        """
+        serial_port 可以是串口名或 pyserial URL (例如 kvm_emulator 的 socket://)
+        link_baud: 'auto' 协商最高可用速率 / 指定速率 / None 保持 baud_rate
+        token: 共享令牌 (默认读取环境变量 ARDUINO_KVM_RELAY_TOKEN)
+        allow: 允许连接的来源地址或网段列表，例如 ["192.168.1.10", "10.0.0.0/24"]
+        """
+        self.serial_port = serial_port
+        self.baud_rate = baud_rate
+        self.link_baud = link_baud
+        self.link_rate = baud_rate
+        self.host = host
+        self.port = port
+        self.token = token if token is not None else os.environ.get(TOKEN_ENV) or None
+        self.allow = [ipaddress.ip_network(a, strict=False) for a in allow] if allow else None
+        self.ser = None
+        self.ser_lock = threading.Lock()
+        self.tcp = None
+        self.udp = None
+        self.client = None         # 当前的控制连接 (同一时间只有一个)
+        self.client_addr = None
+        self.session = None        # 当前控制连接的 UDP 会话号
+        self.clients_lock = threading.Lock()
+        self.udp_last_seq = None   # 本会话已收到的最大序号
+        self.running = False
+        self.threads = []
+
+        self.tcp_messages = 0
+        self.udp_datagrams = 0
+        self.udp_stale = 0
+        self.rejected = 0          # 被拒绝的连接和数据报
+
+    @property
+    def address(self):
+        return self.tcp.getsockname()[:2] if self.tcp else None
+
+    @property
+    def url(self):
+        host, port = self.address
+        if host in ("0.0.0.0", "::"):
+            host = "127.0.0.1"
+        return f"kvm://{host}:{port}" + (f"?token={quote(self.token)}" if self.token else "")
+
+    def start(self):
+        if not _is_loopback(self.host) and not (self.token or self.allow):
+            raise ValueError(f"监听 {self.host} 会把键盘鼠标暴露给网络，必须设置令牌 (--token) 或白名单 (--allow)")
+        self.ser = serial.serial_for_url(self.serial_port, self.baud_rate, timeout=0.05)
+        if self.link_baud and negotiable(self.serial_port):
+            self.link_rate = negotiate(self.ser, self.baud_rate, self.link_baud)["baud"]
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        self.tcp = socket.socket(family, socket.SOCK_STREAM)
+        self.tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp.bind((self.host, self.port))
+        self.tcp.listen(2)
+        self.tcp.settimeout(0.2)
+        self.port = self.tcp.getsockname()[1]  # port=0 时取实际端口
+        self.udp = socket.socket(family, socket.SOCK_DGRAM)
+        self.udp.bind((self.host, self.port))
+        self.udp.settimeout(0.2)
+        self.running = True
+        for target, name in ((self._accept_loop, "relay-tcp"), (self._udp_loop, "relay-udp"),
+                             (self._serial_loop, "relay-serial")):
+            t = threading.Thread(target=target, name=name, daemon=True)
+            t.start()
+            self.threads.append(t)
+        print(f"✅ [Relay] {self.serial_port} ({self.link_rate}) 已共享在 {self.host}:{self.port} (TCP+UDP)")
+        return self
+
+    def stop(self):
+        self.running = False
+        for t in self.threads:
+            t.join(timeout=1.0)
+        self.threads = []
+        with self.clients_lock:
+            if self.client is not None:
+                self.client.close()
+            self.client = self.session = None
+        self._write_serial(b"REL:0\n")
+        if self.link_rate != self.baud_rate:
+            try:
+                restore_base(self.ser, self.baud_rate)
+            except Exception:
+                pass
+        for s in (self.tcp, self.udp, self.ser):
+            try:
+                s.close()
+            except Exception:
+                pass
+
+    def _write_serial(self, data):
+        with self.ser_lock:
+            try:
+                self.ser.write(data)
+            except Exception as e:
+                print(f"❌ [Relay] 串口写入失败: {e}")
+
+    # --- TCP ---
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                conn, addr = self.tcp.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if not self._allowed(addr[0]):
+                self.rejected += 1
+                print(f"⛔ [Relay] 拒绝不在白名单中的连接: {addr[0]}")
+                try:
+                    conn.sendall(b"AUTH:DENIED\n")
+                except OSError:
+                    pass
+                conn.close()
+                continue
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._client_loop, args=(conn, addr), name="relay-client", daemon=True).start()
+
+    def _allowed(self, ip):
+        if self.allow is None:
+            return True
+        try:
+            ip = ipaddress.ip_address(ip.split("%")[0])
+        except ValueError:
+            return False
+        if getattr(ip, "ipv4_mapped", None):
+            ip = ip.ipv4_mapped
+        return any(ip in net for net in self.allow)
+
+    def _read_auth(self, conn, buf):
+        """读取第一条消息 (AUTH:<令牌>)，期限内没有收齐返回 None"""
+        deadline = time.monotonic() + AUTH_TIMEOUT
+        while time.monotonic() < deadline:
+            if len(buf) >= MSG_HEADER.size:
+                (n,) = MSG_HEADER.unpack_from(buf)
+                if len(buf) >= MSG_HEADER.size + n:
+                    msg = bytes(buf[MSG_HEADER.size:MSG_HEADER.size + n])
+                    del buf[:MSG_HEADER.size + n]
+                    return msg
+            try:
+                data = conn.recv(4096)
+            except socket.timeout:
+                continue
+            if not data:
+                return None
+            buf += data
+        return None
+
+    def _client_loop(self, conn, addr):
+        conn.settimeout(0.2)
+        buf = bytearray()
+        try:
+            msg = self._read_auth(conn, buf)
+            token = (self.token or "").encode("utf-8")
+            if msg is None or not msg.startswith(b"AUTH:") or not hmac.compare_digest(msg[5:], token):
+                self.rejected += 1
+                print(f"⛔ [Relay] 认证失败: {addr[0]}:{addr[1]}")
+                conn.sendall(b"AUTH:DENIED\n")
+                conn.close()
+                return
+            with self.clients_lock:
+                busy = self.client is not None
+                if not busy:
+                    session = secrets.token_bytes(8)
+                    # 先回复再登记，固件回复不会先于认证结果到达客户端
+                    conn.sendall(b"AUTH:OK,%s\n" % session.hex().encode("ascii"))
+                    self.client, self.client_addr, self.session = conn, addr, session
+                    self.udp_last_seq = None  # 新会话的序号从头开始
+            if busy:
+                self.rejected += 1
+                print(f"⛔ [Relay] 已有控制连接，拒绝: {addr[0]}:{addr[1]}")
+                conn.sendall(b"AUTH:BUSY\n")
+                conn.close()
+                return
+        except OSError:
+            conn.close()
+            return
+        print(f"🔗 [Relay] 客户端已连接: {addr[0]}:{addr[1]}")
+        try:
+            while self.running:
+                try:
+                    data = conn.recv(65536)
+                except socket.timeout:
+                    continue
+                if not data:
+                    break
+                buf += data
+                # 只转发完整的消息
+                while len(buf) >= MSG_HEADER.size:
+                    (n,) = MSG_HEADER.unpack_from(buf)
+                    if len(buf) < MSG_HEADER.size + n:
+                        break
+                    self._write_serial(bytes(buf[MSG_HEADER.size:MSG_HEADER.size + n]))
+                    del buf[:MSG_HEADER.size + n]
+                    self.tcp_messages += 1
+        except OSError:
+            pass
+        with self.clients_lock:
+            if self.client is conn:
+                self.client = self.client_addr = self.session = None
+        conn.close()
+        print(f"🔌 [Relay] 客户端已断开: {addr[0]}:{addr[1]}")
+        if self.running:
+            self._write_serial(b"REL:0\n")  # 客户端断开时复位，防止卡键
+
+    # --- UDP ---
+
+    def _udp_loop(self):
+        while self.running:
+            try:
+                packet, addr = self.udp.recvfrom(2048)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if len(packet) < UDP_HEADER.size:
+                continue
+            magic, session, seq = UDP_HEADER.unpack_from(packet)
+            if magic != UDP_MAGIC:
+                continue
+            with self.clients_lock:
+                # 只接受当前控制连接的会话号，并且必须来自同一主机
+                valid = (self.session is not None and hmac.compare_digest(session, self.session)
+                         and addr[0] == self.client_addr[0])
+                last = self.udp_last_seq
+            if not valid:
+                self.rejected += 1
+                continue
+            if last is not None and not _seq_newer(seq, last):
+                self.udp_stale += 1
+                continue
+            self.udp_last_seq = seq
+            self.udp_datagrams += 1
+            self._write_serial(packet[UDP_HEADER.size:])
+
+    # --- 串口回复 ---
+
+    def _serial_loop(self):
+        while self.running:
+            try:
+                data = self.ser.read(self.ser.in_waiting or 1)
+            except Exception as e:
+                print(f"❌ [Relay] 串口读取失败: {e}")
+                time.sleep(0.5)
+                continue
+            if not data:
+                continue
+            client = self.client
+            if client is not None:
+                try:
+                    client.sendall(data)
+                except OSError:
+                    pass
+
+    def stats(self):
+        return {
+            "clients": 1 if self.client is not None else 0,
+            "tcp_messages": self.tcp_messages,
+            "udp_datagrams": self.udp_datagrams,
+            "udp_stale": self.udp_stale,
+            "rejected": self.rejected,
+        }
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Arduino KVM 网络中继服务器")
+    parser.add_argument("serial_port", help="串口名或 pyserial URL")
+    parser.add_argument("--baud", type=int, default=BASE_BAUD, help="固件上电速率")
+    parser.add_argument("--link-baud", default="auto", help="auto / off / 指定速率")
+    parser.add_argument("--host", default=DEFAULT_RELAY_HOST, help="监听地址 (默认只允许本机；0.0.0.0 需要配合 --token 或 --allow)")
+    parser.add_argument("--token", help=f"共享令牌 (也可以用环境变量 {TOKEN_ENV})")
+    parser.add_argument("--allow", action="append", help="允许连接的地址或网段，可重复")
+    parser.add_argument("--port", type=int, default=DEFAULT_RELAY_PORT, help="TCP/UDP 端口")
+    args = parser.parse_args()
+
+    link_baud = None if args.link_baud == "off" else args.link_baud if args.link_baud == "auto" else int(args.link_baud)
+    try:
+        server = KVMRelayServer(args.serial_port, args.baud, args.host, args.port, link_baud,
+                                token=args.token, allow=args.allow).start()
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
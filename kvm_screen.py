@@ -0,0 +1,97 @@
+import re
+
+# ==========================================
+# 屏幕几何 / 绝对坐标映射
+# ==========================================
+# 绝对定位模式下固件上报 0-32767 的 HID 绝对坐标，目标机把它映射到自己的整个桌面。
+# 本机这一侧需要把 pynput 给出的桌面坐标换算到 0-32767:
+#   - 默认映射所有显示器的外接矩形 (整个虚拟桌面)
+#   - 也可以只映射其中一个显示器 (active)，光标离开该显示器时贴边
+# 显示器布局用 "宽x高+X+Y" 描述，多个显示器用分号分隔 (与 X11 geometry 写法一致，偏移可以为负):
+#   ScreenGeometry.parse("1920x1080+0+0;2560x1440+1920-180")
+
+ABS_MAX = 32767
+
+_SPEC_RE = re.compile(r"^\s*(\d+)x(\d+)([+-]\d+)([+-]\d+)\s*$")
+
+
+class ScreenGeometry:
+    def __init__(self, monitors, active=None):
+        """
+        monitors: [(x, y, w, h), ...] 本机桌面坐标中的显示器矩形
+        active: 只映射第 active 个显示器；None 表示映射全部显示器的外接矩形
+        """
+        if not monitors:
+            raise ValueError("至少需要一个显示器")
+        self.monitors = [tuple(int(v) for v in m) for m in monitors]
+        self.active = active
+        if active is None:
+            left = min(m[0] for m in self.monitors)
+            top = min(m[1] for m in self.monitors)
+            right = max(m[0] + m[2] for m in self.monitors)
+            bottom = max(m[1] + m[3] for m in self.monitors)
+            self.region = (left, top, right - left, bottom - top)
+        else:
+            self.region = self.monitors[active]
+        x, y, w, h = self.region
+        # 预先算好比例，to_hid 里只剩乘法和取整
+        self._sx = ABS_MAX / max(w - 1, 1)
+        self._sy = ABS_MAX / max(h - 1, 1)
+
+    @classmethod
+    def parse(cls, spec, active=None):
+        """"1920x1080+0+0;1280x1024+1920+0" -> ScreenGeometry"""
+        monitors = []
+        for part in spec.split(";"):
+            if not part.strip():
+                continue
+            m = _SPEC_RE.match(part)
+            if not m:
+                raise ValueError(f"无效的显示器描述: {part!r} (格式: 宽x高+X+Y)")
+            w, h, x, y = (int(v) for v in m.groups())
+            monitors.append((x, y, w, h))
+        return cls(monitors, active)
+
+    @classmethod
+    def detect(cls, root=None):
+        """
+        检测本机虚拟桌面范围 (所有显示器的外接矩形)。
+        Windows 用 GetSystemMetrics，其他系统用 Tk 的屏幕尺寸；都失败时假定 1920x1080。
+        各显示器的布局无法可靠检测，需要只映射一个显示器时请用 parse() 手动指定。
+        root: 界面程序已有的 Tk 根窗口 (不再创建第二个 Tk 解释器)。
+        没有 root 时会临时创建 Tk，必须在主线程调用 (macOS 上其他线程创建 Tk 会崩溃)。
+        """
+        try:
+            import ctypes
+            user32 = ctypes.windll.user32
+            # SM_XVIRTUALSCREEN / SM_YVIRTUALSCREEN / SM_CXVIRTUALSCREEN / SM_CYVIRTUALSCREEN
+            x, y, w, h = (user32.GetSystemMetrics(i) for i in (76, 77, 78, 79))
+            if w > 0 and h > 0:
+                return cls([(x, y, w, h)])
+        except (ImportError, AttributeError, OSError):
+            pass
+        try:
+            if root is not None:
+                return cls([(0, 0, root.winfo_screenwidth(), root.winfo_screenheight())])
+            import tkinter
+            root = tkinter.Tk()
+            root.withdraw()
+            w, h = root.winfo_screenwidth(), root.winfo_screenheight()
+            root.destroy()
+            return cls([(0, 0, w, h)])
+        except Exception:
+            return cls([(0, 0, 1920, 1080)])
+
+    def to_hid(self, x, y):
+        """本机桌面坐标 -> HID 绝对坐标 (0-32767)，区域外的坐标贴边"""
+        left, top = self.region[0], self.region[1]
+        ax = int((x - left) * self._sx + 0.5)
+        ay = int((y - top) * self._sy + 0.5)
+        return (0 if ax < 0 else ABS_MAX if ax > ABS_MAX else ax,
+                0 if ay < 0 else ABS_MAX if ay > ABS_MAX else ay)
+
+    def spec(self):
+        return ";".join(f"{w}x{h}{x:+d}{y:+d}" for x, y, w, h in self.monitors)
+
+    def __repr__(self):
+        return f"ScreenGeometry({self.spec()!r}, active={self.active})"
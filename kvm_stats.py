@@ -0,0 +1,167 @@
+import threading
+import time
+
+# ==========================================
+# 发送路径统计
+# ==========================================
+# 默认关闭: 客户端只在 self.instr 不为 None 时调用这里的记录函数，
+# 关闭时每条指令只多一次属性判断。
+# 打开后按指令类型统计包数/字节数，并用 2 的幂分桶的直方图记录 write() 耗时和串口锁等待时间。
+
+# 二进制帧操作码 -> 指令名 (与 arduino_kvm_lib 的 V2_OPCODES 一致)
+OPCODE_NAMES = {
+    0x81: "M", 0x82: "MD", 0x83: "MU", 0x84: "S", 0x85: "KD", 0x86: "KU",
+    0x87: "REL", 0x88: "T", 0x89: "Q", 0x8A: "P", 0x8B: "MV", 0x8C: "SH",
+}
+
+
+def command_name(payload):
+    """已编码指令的类型名 (文本取冒号前的头部，二进制帧查操作码)"""
+    if not payload:
+        return "?"
+    if payload[0] >= 0x80:
+        return OPCODE_NAMES.get(payload[0], "?")
+    return payload.split(b":", 1)[0].decode('ascii', 'replace')
+
+
+class Histogram:
+    """按微秒取 2 的幂分桶: 第 i 桶覆盖 [2^(i-1), 2^i) us，记录开销是常数"""
+    BUCKETS = 32
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        us = int(seconds * 1e6)
+        self.counts[min(us.bit_length(), self.BUCKETS - 1)] += 1
+        self.total += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """返回第 p 分位所在桶的上界 (毫秒)"""
+        if not self.total:
+            return 0.0
+        target = self.total * p
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return (1 << i) / 1000.0
+        return self.max * 1000
+
+    def snapshot(self):
+        return {
+            "count": self.total,
+            "mean_ms": round(self.sum / self.total * 1000, 4) if self.total else 0.0,
+            "p50_ms": self.percentile(0.50),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max * 1000, 4),
+        }
+
+
+class KVMStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.monotonic()
+            self.packets = {}      # 指令名 -> 包数
+            self.bytes = {}        # 指令名 -> 字节数
+            self.writes = 0        # write() 调用次数
+            self.write_bytes = 0
+            self.serial_errors = 0
+            self.write_time = Histogram()
+            self.lock_wait = Histogram()
+
+    def count_command(self, payload):
+        name = command_name(payload)
+        with self.lock:
+            self.packets[name] = self.packets.get(name, 0) + 1
+            self.bytes[name] = self.bytes.get(name, 0) + len(payload)
+
+    def count_write(self, nbytes, waited, duration):
+        with self.lock:
+            self.writes += 1
+            self.write_bytes += nbytes
+            self.lock_wait.add(waited)
+            self.write_time.add(duration)
+
+    def count_error(self):
+        with self.lock:
+            self.serial_errors += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "elapsed_s": round(time.monotonic() - self.started, 3),
+                "packets": dict(self.packets),
+                "bytes": dict(self.bytes),
+                "writes": self.writes,
+                "write_bytes": self.write_bytes,
+                "serial_errors": self.serial_errors,
+                "write_time": self.write_time.snapshot(),
+                "lock_wait": self.lock_wait.snapshot(),
+            }
+
+
+def rates(prev, cur):
+    """两次 stats() 快照之间的每秒速率"""
+    dt = cur["elapsed_s"] - prev["elapsed_s"]
+    if dt <= 0:
+        return {}
+    out = {
+        "packets_per_s": (sum(cur["packets"].values()) - sum(prev["packets"].values())) / dt,
+        "bytes_per_s": (cur["write_bytes"] - prev["write_bytes"]) / dt,
+        "writes_per_s": (cur["writes"] - prev["writes"]) / dt,
+    }
+    for key in ("coalesced", "dropped", "serial_errors", "retransmits"):
+        if key in cur and key in prev:
+            out[key + "_per_s"] = (cur[key] - prev[key]) / dt
+    return out
+
+
+def format_rates(r):
+    return (f"{r.get('packets_per_s', 0):7.1f} 包/s  {r.get('bytes_per_s', 0):8.1f} B/s  "
+            f"{r.get('writes_per_s', 0):6.1f} write/s  合并 {r.get('coalesced_per_s', 0):6.1f}/s  "
+            f"丢弃 {r.get('dropped_per_s', 0):5.1f}/s")
+
+
+class StatsLogger:
+    """后台线程: 每 interval 秒取一次 client.stats()，输出与上次之间的速率"""
+
+    def __init__(self, client, interval=5.0, log=print):
+        self.client = client
+        self.interval = interval
+        self.log = log
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="kvm-stats", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if not self._thread: return
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+        self._thread = None
+
+    def _run(self):
+        prev = self.client.stats()
+        while not self._stop.wait(self.interval):
+            cur = self.client.stats()
+            if cur is None or prev is None:
+                prev = cur
+                continue
+            w = cur["write_time"]
+            self.log(f"📊 [Stats] {format_rates(rates(prev, cur))}  write p99 {w['p99_ms']:.3f}ms")
+            prev = cur
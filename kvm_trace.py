@@ -0,0 +1,386 @@
+import mmap
+import os
+import threading
+import time
+
+# ==========================================
+# 输入会话录制 / 回放
+# ==========================================
+# 录制 ArduinoKVMClient 镜像时 pynput 回调收到的原始事件，按原节奏回放到同一条发送管线
+# (位移聚合、按键表、发送队列都会参与)，用于回归测试、演示和压测。
+#
+# 文件格式 (只追加，可以在录制中途读取):
+#   文件头  b"KVMTRACE" + 版本 1B
+#   事件    [时间差 varint, 微秒][类型 1B][字段...]
+#     MOVE   zigzag varint dx, dy   (相对上一个坐标；会话内第一个相对 (0, 0)，即绝对坐标)
+#     CLICK  按钮 1B (0=L 1=R 2=M), 按下 1B
+#     SCROLL zigzag varint dx, dy
+#     SCROLL_FINE  zigzag varint dx, dy (1/120 格，触控板等高精度滚动的小数格)
+#     KEY_DOWN / KEY_UP   特殊键名 (varint 长度 + ASCII)
+#     CHAR_DOWN / CHAR_UP 字符 (varint 长度 + UTF-8)
+#     SESSION             新录制会话开始 (时间差为 0，坐标基准重置)
+# 鼠标移动通常只需 3~4 字节。回放时用 mmap 按需读取，数小时的录制也不会整个读进内存。
+# 本模块不导入 pynput: 按键和按钮按名称记录，回放时用只有 name/char 属性的 TraceKey 代替 pynput 对象，
+# 因此 info / play 在没有显示器的 Linux (CI) 上也能运行。
+#
+#   python kvm_trace.py record session.kvmtrace          # 开始镜像并录制，Ctrl+C 结束
+#   python kvm_trace.py play session.kvmtrace --speed 4  # 4 倍速回放
+#   python kvm_trace.py info session.kvmtrace
+
+MAGIC = b"KVMTRACE"
+VERSION = 1
+HEADER = MAGIC + bytes((VERSION,))
+
+EV_MOVE = 0
+EV_CLICK = 1
+EV_SCROLL = 2
+EV_KEY_DOWN = 3
+EV_KEY_UP = 4
+EV_CHAR_DOWN = 5
+EV_CHAR_UP = 6
+EV_SESSION = 7
+EV_SCROLL_FINE = 8  # 读取时还原为 EV_SCROLL (小数格)
+SCROLL_FINE_UNITS = 120
+
+EVENT_NAMES = {
+    EV_MOVE: "move", EV_CLICK: "click", EV_SCROLL: "scroll", EV_KEY_DOWN: "key_down",
+    EV_KEY_UP: "key_up", EV_CHAR_DOWN: "char_down", EV_CHAR_UP: "char_up", EV_SESSION: "session",
+}
+
+BUTTON_IDS = {"left": 0, "right": 1, "middle": 2}  # pynput Button.name -> 录制中的按钮编号
+BUTTON_NAMES = {v: k for k, v in BUTTON_IDS.items()}
+
+
+class TraceKey:
+    """回放时代替 pynput 的 Key / KeyCode / Button (KeyMap 和 _on_click 只用到 name 和 char)"""
+    __slots__ = ("name", "char")
+
+    def __init__(self, name=None, char=None):
+        self.name = name
+        self.char = char
+
+    def __repr__(self):
+        return f"TraceKey({self.name or self.char!r})"
+
+FLUSH_INTERVAL = 1.0  # 录制时最多每秒落盘一次
+
+
+class TraceError(ValueError):
+    pass
+
+
+# --- varint ---
+
+def _zigzag(v):
+    return (v << 1) ^ (v >> 63)
+
+
+def _unzigzag(v):
+    return (v >> 1) ^ -(v & 1)
+
+
+def _varint(out, v):
+    while v >= 0x80:
+        out.append((v & 0x7F) | 0x80)
+        v >>= 7
+    out.append(v)
+
+
+def _read_varint(buf, pos):
+    result = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+# ==========================================
+# 录制
+# ==========================================
+
+class TraceRecorder:
+    def __init__(self, path):
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new:
+            with open(path, "rb") as f:
+                if f.read(len(HEADER)) != HEADER:
+                    raise TraceError(f"不是录制文件或版本不兼容: {path}")
+        self.path = path
+        self.file = open(path, "ab")
+        self.lock = threading.Lock()
+        self.buf = bytearray(HEADER if new else b"")
+        self.last_us = time.monotonic_ns() // 1000
+        self.last_flush = time.monotonic()
+        self.x = self.y = 0
+        self.events = 0
+        self._event(EV_SESSION)
+
+    def _event(self, kind, *fields):
+        """fields: 已编码的字节串 (调用方负责)"""
+        with self.lock:
+            if self.file is None: return
+            # 在锁内取时间: 鼠标和键盘监听线程并发写入时时间差不会为负
+            now = time.monotonic_ns() // 1000
+            buf = self.buf
+            _varint(buf, 0 if kind == EV_SESSION else now - self.last_us)
+            self.last_us = now
+            buf.append(kind)
+            for f in fields:
+                buf += f
+            self.events += 1
+            if time.monotonic() - self.last_flush >= FLUSH_INTERVAL:
+                self._flush()
+
+    def _flush(self):
+        self.file.write(self.buf)
+        self.file.flush()
+        self.buf.clear()
+        self.last_flush = time.monotonic()
+
+    @staticmethod
+    def _signed(*values):
+        out = bytearray()
+        for v in values:
+            _varint(out, _zigzag(int(v)))
+        return out
+
+    @staticmethod
+    def _text(s):
+        data = s.encode("utf-8")
+        out = bytearray()
+        _varint(out, len(data))
+        return out + data
+
+    # --- 与 pynput 回调同名的记录接口 ---
+
+    def move(self, x, y):
+        x, y = int(x), int(y)
+        with self.lock:
+            dx, dy = x - self.x, y - self.y
+            self.x, self.y = x, y
+        self._event(EV_MOVE, self._signed(dx, dy))
+
+    def click(self, button, pressed):
+        self._event(EV_CLICK, bytes((BUTTON_IDS.get(getattr(button, 'name', None), 0), 1 if pressed else 0)))
+
+    def scroll(self, dx, dy):
+        if dx == int(dx) and dy == int(dy):
+            self._event(EV_SCROLL, self._signed(dx, dy))
+        else:
+            self._event(EV_SCROLL_FINE, self._signed(round(dx * SCROLL_FINE_UNITS), round(dy * SCROLL_FINE_UNITS)))
+
+    def key(self, key, pressed):
+        char = getattr(key, 'char', None)
+        name = getattr(key, 'name', None)  # 只有 pynput Key 枚举成员有 name，KeyCode 没有
+        if char:
+            self._event(EV_CHAR_DOWN if pressed else EV_CHAR_UP, self._text(char))
+        elif name:
+            self._event(EV_KEY_DOWN if pressed else EV_KEY_UP, self._text(name))
+        # 没有字符也不是 Key 枚举的按键 (只有 vk) 无法在目标机上重现，不记录
+
+    def close(self):
+        with self.lock:
+            if self.file is None: return
+            self._flush()
+            self.file.close()
+            self.file = None
+
+
+# ==========================================
+# 回放
+# ==========================================
+
+class TraceReader:
+    """用 mmap 逐个解析事件，只在迭代时按需读取"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.path.getsize(path)
+        if size < len(HEADER):
+            self.file.close()
+            raise TraceError(f"录制文件为空: {path}")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(HEADER)] != HEADER:
+            self.close()
+            raise TraceError(f"不是录制文件或版本不兼容: {path}")
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def events(self):
+        """
+        生成 (时间戳微秒, 类型, 参数...)。
+        MOVE 给出还原后的绝对坐标 (x, y)；末尾不完整的事件 (录制仍在写入) 会被忽略。
+        """
+        buf, end = self.map, len(self.map)
+        pos = len(HEADER)
+        t = x = y = 0
+        while pos < end:
+            try:
+                dt, p = _read_varint(buf, pos)
+                kind = buf[p]
+                p += 1
+                if kind == EV_MOVE or kind == EV_SCROLL or kind == EV_SCROLL_FINE:
+                    a, p = _read_varint(buf, p)
+                    b, p = _read_varint(buf, p)
+                    a, b = _unzigzag(a), _unzigzag(b)
+                    if kind == EV_MOVE:
+                        x += a
+                        y += b
+                        args = (x, y)
+                    elif kind == EV_SCROLL:
+                        args = (a, b)
+                    else:
+                        kind = EV_SCROLL
+                        args = (a / SCROLL_FINE_UNITS, b / SCROLL_FINE_UNITS)
+                elif kind == EV_CLICK:
+                    args = (buf[p], bool(buf[p + 1]))
+                    p += 2
+                elif kind in (EV_KEY_DOWN, EV_KEY_UP, EV_CHAR_DOWN, EV_CHAR_UP):
+                    n, p = _read_varint(buf, p)
+                    if p + n > end:
+                        return
+                    args = (buf[p:p + n].decode("utf-8"),)
+                    p += n
+                elif kind == EV_SESSION:
+                    x = y = 0
+                    args = ()
+                else:
+                    raise TraceError(f"未知事件类型 {kind} (偏移 {pos})")
+            except IndexError:
+                return
+            t += dt
+            pos = p
+            yield (t, kind) + args
+
+
+def _to_key(kind, name):
+    if kind in (EV_CHAR_DOWN, EV_CHAR_UP):
+        return TraceKey(char=name)
+    return TraceKey(name=name)
+
+
+def replay(client, path, speed=1.0, stop_event=None):
+    """
+    把录制文件回放到 client 的镜像回调 (_on_move/_on_click/_on_scroll/_on_press/_on_release)。
+    speed: 回放倍速，0 表示不等待，尽快发送 (压测)。
+    返回回放的事件数。
+    """
+    own_motion = not client.mirror_enabled
+    if own_motion:
+        client.motion.start()
+    count = 0
+    t0 = None
+    try:
+        with TraceReader(path) as reader:
+            for ev in reader.events():
+                if stop_event is not None and stop_event.is_set():
+                    break
+                ts, kind = ev[0], ev[1]
+                if t0 is None:
+                    t0 = time.perf_counter() - (ts / 1e6 / speed if speed else 0)
+                if speed:
+                    # 以开始时间为基准计算每个事件的绝对目标时间，误差不累积
+                    remaining = t0 + ts / 1e6 / speed - time.perf_counter()
+                    if remaining > 0:
+                        time.sleep(remaining)
+                if kind == EV_MOVE:
+                    client._on_move(ev[2], ev[3])
+                elif kind == EV_CLICK:
+                    client._on_click(0, 0, TraceKey(BUTTON_NAMES.get(ev[2], "left")), ev[3])
+                elif kind == EV_SCROLL:
+                    client._on_scroll(0, 0, ev[2], ev[3])
+                elif kind in (EV_KEY_DOWN, EV_CHAR_DOWN):
+                    client._on_press(_to_key(kind, ev[2]))
+                elif kind in (EV_KEY_UP, EV_CHAR_UP):
+                    client._on_release(_to_key(kind, ev[2]))
+                elif kind == EV_SESSION:
+                    client.motion.prev_x = None  # 新会话的第一个坐标只作为基准
+                count += 1
+    finally:
+        if own_motion:
+            client.motion.stop()
+        else:
+            client.motion.flush()
+    return count
+
+
+def trace_info(path):
+    """统计录制文件: 事件数 (按类型)、时长、文件大小"""
+    counts = {}
+    duration = 0
+    with TraceReader(path) as reader:
+        for ev in reader.events():
+            name = EVENT_NAMES[ev[1]]
+            counts[name] = counts.get(name, 0) + 1
+            duration = ev[0]
+    total = sum(counts.values())
+    size = os.path.getsize(path)
+    return {
+        "events": total,
+        "counts": counts,
+        "duration_s": duration / 1e6,
+        "bytes": size,
+        "bytes_per_event": round(size / total, 2) if total else 0.0,
+    }
+
+
+def main():
+    import argparse
+    import arduino_kvm_lib
+    parser = argparse.ArgumentParser(description="Arduino KVM 输入会话录制 / 回放")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_rec = sub.add_parser("record", help="开始镜像并录制，Ctrl+C 结束")
+    p_rec.add_argument("path")
+    p_rec.add_argument("--port", default=None, help="串口 (默认自动检测)")
+    p_play = sub.add_parser("play", help="回放到设备")
+    p_play.add_argument("path")
+    p_play.add_argument("--port", default=None, help="串口或 socket:// URL (默认自动检测)")
+    p_play.add_argument("--speed", type=float, default=1.0, help="回放倍速，0 为不等待")
+    p_info = sub.add_parser("info", help="显示录制文件统计")
+    p_info.add_argument("path")
+    args = parser.parse_args()
+
+    if args.cmd == "info":
+        for k, v in trace_info(args.path).items():
+            print(f"{k:16s} {v}")
+        return
+
+    client = arduino_kvm_lib.ArduinoKVMClient(args.port)
+    if not client.connect():
+        raise SystemExit(f"❌ 连接失败: {client.error_msg}")
+    try:
+        if args.cmd == "record":
+            client.start_recording(args.path)
+            client.start_mirroring()
+            print("🔴 录制中，按 Ctrl+C 结束")
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
+            client.stop_mirroring()
+            client.stop_recording()
+        else:
+            t = time.perf_counter()
+            n = replay(client, args.path, speed=args.speed)
+            print(f"▶ 已回放 {n} 个事件，用时 {time.perf_counter() - t:.2f}s")
+    finally:
+        client.disconnect()
+
+
+if __name__ == "__main__":
+    main()
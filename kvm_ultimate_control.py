@@ -1,11 +1,14 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import serial
-import serial.tools.list_ports
 import time
 import threading
 from pynput import mouse, keyboard
 import sys
+from kvm_motion import MotionAccumulator
+from kvm_keymap import KeyMap
+from arduino_kvm_lib import encode_text, HeldState, release_on_exit, cancel_release_on_exit
+from kvm_discovery import DeviceDiscovery, comports
 
 # =============================================================================
 # Arduino KVM Ultimate Control Panel
@@ -25,11 +28,17 @@ class KVMApp:
         self.mouse_listener = None
         self.key_listener = None
         self.stop_mirror_event = threading.Event()
+        self.serial_lock = threading.Lock() # 位移聚合线程与监听线程会同时写串口
+        self.motion = MotionAccumulator(lambda dx, dy: self.send_packet("M", f"{dx},{dy}"))
         
         self.target_os = "WIN" # WIN or MAC
+        self.keymap = KeyMap(self.target_os, encode_text)
+        # 目标机上当前按下的键/按钮 (自动重复的 KD 不再重复发送)，进程退出时保证释放
+        self.held = HeldState()
 
         self.setup_ui()
         self.auto_scan_ports()
+        self.refresh_held()
 
     def setup_ui(self):
         # --- 顶部: 连接区域 ---
@@ -46,6 +55,9 @@ class KVMApp:
         
         self.lbl_status = ttk.Label(top_frame, text="未连接", foreground="red")
         self.lbl_status.pack(side=tk.LEFT, padx=20)
+
+        self.lbl_held = ttk.Label(top_frame, text="", foreground="gray")
+        self.lbl_held.pack(side=tk.LEFT, padx=5)
         
         # --- 中部: 常用宏按钮 (Stream Deck 风格) ---
         deck_frame = ttk.LabelFrame(self.root, text="快捷宏 (点击即发送)", padding=10)
@@ -93,19 +105,32 @@ class KVMApp:
 
     # ================= 串口逻辑 =================
     def auto_scan_ports(self):
-        ports = serial.tools.list_ports.comports()
+        # 枚举和识别 (可能要打开端口等待回复) 在后台线程中进行，不卡界面
+        threading.Thread(target=self.scan_worker, name="kvm-scan", daemon=True).start()
+
+    def scan_worker(self):
+        ports = comports(refresh=True)
+        # 已识别的 KVM 设备 (未识别过的候选端口会并行发送识别指令确认)
+        found = DeviceDiscovery.default().find() if ports else None
+        try:
+            self.root.after(0, self.show_ports, ports, found)
+        except (RuntimeError, tk.TclError):
+            pass  # 窗口已关闭
+
+    def show_ports(self, ports, found):
         port_list = [f"{p.device} - {p.description}" for p in ports]
         self.port_combo['values'] = port_list
         if port_list:
             self.port_combo.current(0)
-            # 自动寻找可能是 CH340 的设备
-            for i, p in enumerate(port_list):
-                if "CH340" in p or "USB-SERIAL" in p or "COM5" in p:
+            for i, p in enumerate(ports):
+                if p.device == found:
                     self.port_combo.current(i)
                     break
 
     def toggle_connection(self):
         if self.ser and self.ser.is_open:
+            self.release_all()
+            cancel_release_on_exit(self.release_all)
             self.ser.close()
             self.ser = None
             self.btn_connect.config(text="连接")
@@ -123,18 +148,34 @@ class KVMApp:
                 
                 # 发送复位信号
                 self.send_packet("REL", "0")
+                release_on_exit(self.release_all)
                 
             except Exception as e:
                 messagebox.showerror("连接失败", str(e))
 
     def send_packet(self, header, data):
+        self.send_raw(encode_text(header, data))
+
+    def send_raw(self, payload):
+        if not self.held.track(payload): return # 已按下的键不重复发送
         if self.ser and self.ser.is_open:
             try:
-                payload = f"{header}:{data}\n"
-                self.ser.write(payload.encode('utf-8'))
+                with self.serial_lock:
+                    self.ser.write(payload)
             except:
                 pass
 
+    def release_all(self):
+        """松开所有键和按钮 (断开连接、退出镜像、进程退出时调用)"""
+        self.send_packet("REL", "0")
+
+    def refresh_held(self):
+        """界面显示目标机上当前按下的键"""
+        state = self.held.snapshot()
+        held = state["keys"] + [f"鼠标{b}" for b in state["buttons"]]
+        self.lbl_held.config(text=f"按下: {' + '.join(held)}" if held else "")
+        self.root.after(200, self.refresh_held)
+
     # ================= 宏命令逻辑 =================
     def send_ctrl_alt_del(self):
         """发送 Ctrl+Alt+Del 组合键"""
@@ -192,13 +233,18 @@ class KVMApp:
         self.mirror_thread.start()
 
     def stop_mirror(self):
+        if self.stop_mirror_event.is_set(): return
         self.is_mirroring = False
         self.stop_mirror_event.set()
         
-        if self.mouse_listener: self.mouse_listener.stop()
-        if self.key_listener: self.key_listener.stop()
+        # 先停监听并等回调返回，再复位；否则 REL 之后仍可能有迟到的按下指令
+        for listener in (self.mouse_listener, self.key_listener):
+            if listener:
+                listener.stop()
+                listener.join(timeout=0.5)
+        self.motion.stop()
         
-        self.send_packet("REL", "0") # 安全复位
+        self.release_all() # 安全复位
         
         if hasattr(self, 'overlay'):
             self.overlay.destroy()
@@ -212,39 +258,17 @@ class KVMApp:
         
         self.mouse_ctl = mouse.Controller()
         # 记录初始位置
-        self.prev_x, self.prev_y = self.mouse_ctl.position
-        self.last_mouse_time = 0
+        self.motion.reset_position(*self.mouse_ctl.position)
+        self.motion.start()
 
         def on_move(x, y):
             if not self.is_mirroring: return
-            
-            # 计算位移 (普通版本)
-            dx = int(x) - int(self.prev_x)
-            dy = int(y) - int(self.prev_y)
-            
-            self.prev_x, self.prev_y = x, y
-            
-            # 如果没有位移，直接返回
-            if dx == 0 and dy == 0: return
-
-            # 简单的限流
-            cur_time = time.time()
-            if cur_time - self.last_mouse_time < 0.005: 
-                return
-            self.last_mouse_time = cur_time
-            
-            # Arduino 格式限制 (-127 ~ 127)
-            dx_send = max(-127, min(127, dx))
-            dy_send = max(-127, min(127, dy))
-            
-            if dx_send != 0 or dy_send != 0:
-                self.send_packet("M", f"{dx_send},{dy_send}")
-            
-            # 这里没有任何 force position 的操作了
-            # 纯粹的被动监听，最稳定
+            # 位移全部累加，按回报率合并发送；大位移拆成多个包，不再截断到 ±127
+            self.motion.move_to(x, y)
 
         def on_click(x, y, button, pressed):
             if not self.is_mirroring: return
+            self.motion.flush()
             btn = "L" if button == mouse.Button.left else "R" if button == mouse.Button.right else "M"
             cmd = "MD" if pressed else "MU"
             self.send_packet(cmd, btn)
@@ -256,22 +280,33 @@ class KVMApp:
         # 键盘处理
         def on_press(key):
             if not self.is_mirroring: return
-            k_str = self.parse_key(key)
-            if k_str: self.send_packet("KD", k_str)
+            data = self.keymap.press(key)
+            if data: self.send_raw(data)
 
         def on_release(key):
             if key == keyboard.Key.esc:
-                # 在主线程回调停止
+                # 立即停止转发，再到主线程回调停止 (中间到达的事件不再发送)
+                self.is_mirroring = False
                 self.root.after(10, self.stop_mirror)
                 return False
                 
             if not self.is_mirroring: return
-            k_str = self.parse_key(key)
-            if k_str: self.send_packet("KU", k_str)
+            data = self.keymap.release(key)
+            if data: self.send_raw(data)
+
+        def guarded(fn):
+            # 回调异常会让 pynput 停止监听，松开事件再也收不到: 先释放全部
+            def wrapper(*args):
+                try:
+                    return fn(*args)
+                except Exception as e:
+                    print(f"镜像回调异常: {e}")
+                    self.release_all()
+            return wrapper
 
         # 启动监听
-        self.mouse_listener = mouse.Listener(on_move=on_move, on_click=on_click, on_scroll=on_scroll)
-        self.key_listener = keyboard.Listener(on_press=on_press, on_release=on_release)
+        self.mouse_listener = mouse.Listener(on_move=guarded(on_move), on_click=guarded(on_click), on_scroll=guarded(on_scroll))
+        self.key_listener = keyboard.Listener(on_press=guarded(on_press), on_release=guarded(on_release))
         
         self.mouse_listener.start()
         self.key_listener.start()
@@ -279,21 +314,6 @@ class KVMApp:
         self.mouse_listener.join()
         self.key_listener.join()
 
-    def parse_key(self, key):
-        try:
-            if hasattr(key, 'char') and key.char:
-                # 修复: 当按住 Ctrl 时, pynput 可能返回 ASCII 控制字符 (1-26)
-                # 例如 Ctrl+A 返回 \x01, 需要转换回 'a'
-                if len(key.char) == 1:
-                    code = ord(key.char)
-                    if 1 <= code <= 26:
-                        return chr(code + 96) # 0x01('^A') -> 'a'
-                return key.char # 普通字符
-            else:
-                return str(key).replace('Key.', '') # 特殊键
-        except:
-            return None
-
 if __name__ == "__main__":
     root = tk.Tk()
     app = KVMApp(root)
@@ -8,13 +8,17 @@ import time
 import threading
 from pynput import mouse, keyboard
 import sys
+from kvm_motion import MotionAccumulator
+from kvm_keymap import KeyMap
+from arduino_kvm_lib import encode_text
+from kvm_daemon_client import DaemonError, KVMDaemonClient, daemon_available
 
 # ==========================================
 # 配置
 # ==========================================
 SERIAL_PORT = 'COM5'
 BAUD_RATE = 115200
-MOUSE_RATE_LIMIT = 0.005 
+MOUSE_REPORT_RATE = 250  # 鼠标位移合并发送频率 (Hz): 125/250/500/1000
 
 # 目标系统模式: 'WIN' 或 'MAC'
 # WIN模式: 1:1 透传 (Ctrl->Ctrl, Win->Win)
@@ -27,7 +31,8 @@ TARGET_OS = 'WIN'
 # 全局变量
 serial_lock = threading.Lock()
 ser = None
-last_mouse_time = 0
+motion = None
+keymap = None
 
 def init_serial():
     global ser
@@ -39,28 +44,6 @@ def init_serial():
         print(f"❌ 串口连接失败: {e}")
         return False
 
-def remap_key_for_mac(k):
-    """
-    将 Windows 键位映射为 Mac 常用布局
-    Pynput Name  ->  Arduino Name
-    """
-    if TARGET_OS != 'MAC':
-        return k
-        
-    # 核心映射：让 PC 的 Ctrl 变成 Mac 的 Command
-    if k == 'ctrl_l': return 'win'      # L_Ctrl -> Command
-    if k == 'ctrl_r': return 'win'      # R_Ctrl -> Command
-    
-    # PC Win -> Mac Option
-    if k == 'cmd':    return 'alt'      # Win -> Option
-    if k == 'win':    return 'alt'
-    
-    # PC Alt -> Mac Control
-    if k == 'alt_l':  return 'ctrl_l'   # L_Alt -> Control
-    if k == 'alt_r':  return 'ctrl_r'   # R_Alt -> Control
-    
-    return k
-
 def send_packet(header, data_str):
     """
     发送简单的文本协议。
@@ -68,15 +51,17 @@ def send_packet(header, data_str):
        鼠标: "M:10,-5\n"
        键盘: "K:a\n"
     """
-    global ser
+    send_raw(encode_text(header, data_str))
+
+def send_raw(payload):
+    """发送已编码的指令字节"""
     if not ser or not ser.is_open:
         return
 
     try:
-        payload = f"{header}:{data_str}\n" 
         with serial_lock:
-            ser.write(payload.encode('utf-8'))
-            # print(f"Sent: {payload.strip()}") # 调试用，太快可以注释掉
+            ser.write(payload)
+            # print(f"Sent: {payload}") # 调试用，太快可以注释掉
     except Exception as e:
         print(f"发送失败: {e}")
 
@@ -84,36 +69,11 @@ def send_packet(header, data_str):
 # 鼠标监听
 # ==========================================
 def on_move(x, y):
-    global last_mouse_time
-    current_time = time.time()
-    
-    # 简单的频率限制
-    if current_time - last_mouse_time < MOUSE_RATE_LIMIT:
-        return
-    
-    last_mouse_time = current_time
-    
-    # 这里我们简化处理：
-    # 真实的 KVM 需要计算 "相对位移" (dx, dy)，而不是绝对坐标 (x, y)。
-    # pynput 只提供绝对坐标 x, y。我们需要记录上一次的位置。
-    # 但为了演示效果，我们先发送当前坐标，
-    # 或者如果不方便计算，就发送一个固定方向测试。
-    
-    # 下面是计算相对位移的逻辑
-    global prev_x, prev_y
-    try:
-        dx = x - prev_x
-        dy = y - prev_y
-    except NameError:
-        dx, dy = 0, 0
-    
-    prev_x, prev_y = x, y
-    
-    if dx != 0 or dy != 0:
-        # 发送 M:dx,dy
-        send_packet("M", f"{dx},{dy}")
+    # 两次发送之间的位移全部累加，由 motion 按回报率合并发送
+    motion.move_to(x, y)
 
 def on_click(x, y, button, pressed):
+    motion.flush() # 先发出累积的位移，保证点击位置正确
     btn_code = "L" if button == mouse.Button.left else "R" if button == mouse.Button.right else "M"
     
     if pressed:
@@ -121,56 +81,61 @@ def on_click(x, y, button, pressed):
     else:
         send_packet("MU", btn_code) # Mouse Up
 
+def send_scroll(wheel, pan):
+    if wheel: send_packet("S", str(wheel)) # S:1 (Scroll Up)
+    if pan: send_packet("SH", str(pan))    # 水平滚动 (固件 v4.4+，旧固件忽略)
+
 def on_scroll(x, y, dx, dy):
-    send_packet("S", str(dy)) # S:1 (Scroll Up)
+    # 触控板的小数滚动先累加，凑满整格才发送
+    motion.add_scroll(dx, dy)
 
 # ==========================================
 # 键盘监听
 # ==========================================
 def on_press(key):
-    try:
-        # 普通按键
-        k = key.char
-        if k:
-            if 1 <= ord(k) <= 26:
-                k = chr(ord(k) + 96)
-            k = remap_key_for_mac(k)
-            send_packet("KD", k)
-    except AttributeError:
-        # 特殊按键
-        k = str(key).replace('Key.', '')
-        
-        # 兼容性处理
-        if k == 'cmd': k = 'win'
-        
-        k = remap_key_for_mac(k)
-        send_packet("KD", k)
+    data = keymap.press(key)
+    if data:
+        send_raw(data)
 
 def on_release(key):
     if key == keyboard.Key.esc:
         print("\n🛑 停止监听")
         return False
-        
+
+    data = keymap.release(key)
+    if data:
+        send_raw(data)
+
+# ==========================================
+# 通过守护进程镜像
+# ==========================================
+def mirror_via_daemon():
+    kvm = KVMDaemonClient()
+    if not kvm.connect():
+        print(f"❌ {kvm.error_msg}")
+        return
     try:
-        k = key.char
-        if k:
-            if 1 <= ord(k) <= 26:
-                k = chr(ord(k) + 96)
-            k = remap_key_for_mac(k)
-            send_packet("KU", k)
-    except AttributeError:
-        k = str(key).replace('Key.', '')
-        if k == 'cmd': k = 'win'
-        if 'media_' in k: return
-
-        k = remap_key_for_mac(k)
-        send_packet("KU", k)
+        kvm.set_target_os(TARGET_OS)
+        kvm.set_report_rate(MOUSE_REPORT_RATE)
+        kvm.start_mirroring()
+        print(f"🚀 守护进程 ({kvm.port}) 开始镜像输入，按 [Enter] 或 Ctrl+C 停止")
+        input()
+    except (DaemonError, KeyboardInterrupt, EOFError) as e:
+        if isinstance(e, DaemonError):
+            print(f"❌ {e}")
+    finally:
+        try:
+            kvm.stop_mirroring()  # 守护进程停止监听并发送 REL
+        except DaemonError:
+            pass
+        kvm.disconnect()
+        print("\n🛑 停止监听")
 
 # ==========================================
 # 主程序
 # ==========================================
 def main():
-    global TARGET_OS
+    global TARGET_OS, motion, keymap
     print("🖥️  Arduino KVM Input Mirror V3.0")
     print("---------------------------------------------")
     choice = input("Select Target System (1=Windows, 2=Mac): ").strip()
@@ -180,14 +145,22 @@ def main():
     else:
         TARGET_OS = 'WIN'
         print("🪟 Windows Mode Selected: Standard Mapping")
+    keymap = KeyMap(TARGET_OS, encode_text)
+
+    # kvm_daemon.py 在运行时串口已被它占用: 改为让守护进程镜像 (其他前端仍可同时使用)
+    if daemon_available():
+        mirror_via_daemon()
+        return
         
     if not init_serial():
         return
 
     # 初始化鼠标位置
     mouse_controller = mouse.Controller()
-    global prev_x, prev_y
-    prev_x, prev_y = mouse_controller.position
+    motion = MotionAccumulator(lambda dx, dy: send_packet("M", f"{dx},{dy}"), rate_hz=MOUSE_REPORT_RATE,
+                               send_scroll=send_scroll)
+    motion.reset_position(*mouse_controller.position)
+    motion.start()
 
     print("🚀 开始镜像输入...")
     print("---------------------------------------------")
@@ -220,6 +193,7 @@ def main():
         pass
     finally:
         print("\n🧹 正在停止... 发送全键释放信号")
+        motion.stop()
         send_packet("REL", "0")
         time.sleep(0.2) # 确保发出去
         
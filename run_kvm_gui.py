@@ -1,33 +1,63 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import arduino_kvm_lib  # 引入刚才生成的库
+import kvm_stats
+import kvm_macro
+from kvm_discovery import DeviceDiscovery, HotplugWatcher
+from kvm_daemon_client import DaemonError, KVMDaemonClient, daemon_available
+from kvm_screen import ScreenGeometry
+import os
+import threading
 
 # ==========================================
 # 配置
 # ==========================================
 # SERIAL_PORT = 'COM5' (在库里默认了，也可以传入)
+MACRO_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "macros", "kvm_console.json")
 
 class KVMGuiApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Arduino KVM 控制台 (基于 Lib)")
-        self.root.geometry("700x600")
+        self.root.geometry("700x680")
         
         # 1. 初始化核心库 (尝试自动检测，但不强制连接成功)
-        self.kvm = arduino_kvm_lib.ArduinoKVMClient()
+        #    kvm_daemon.py 在运行时作为它的客户端 (串口、镜像和宏都由守护进程执行，可与其他前端同时使用)
+        self.daemon = daemon_available()
+        #    桌面范围用已有的 Tk 根窗口检测 (绝对定位时镜像线程直接使用，不会再创建 Tk)
+        self.kvm = KVMDaemonClient() if self.daemon else \
+            arduino_kvm_lib.ArduinoKVMClient(geometry=ScreenGeometry.detect(root))
+        # 文本输入在后台事件循环中执行，不阻塞界面 (与镜像共用同一个串口客户端)；第一次发送文本时才启动
+        self.aio = None
+        self.player = None if self.daemon else \
+            kvm_macro.MacroPlayer.for_client(self.kvm)
         
         self.setup_ui()
         
-        # 尝试自动连接
-        if self.kvm.port:
+        # 尝试自动连接 (自动查找复用上面端口列表的扫描结果)
+        if self.daemon:
             if self.kvm.connect():
-                self.set_status(f"已连接: {self.kvm.port}", "green")
-                self.combo_ports.set(self.kvm.port)
+                self.set_status(f"守护进程: {self.kvm.port}", "green")
             else:
-                self.set_status(f"连接失败: {self.kvm.port}", "red")
+                self.set_status("守护进程连接失败", "red")
+        elif self.kvm.connect():
+            self.set_status(f"已连接: {self.kvm.port}", "green")
+            self.combo_ports.set(self.kvm.port)
+        elif self.kvm.port:
+            self.set_status(f"连接失败: {self.kvm.port}", "red")
         else:
             self.set_status("未检测到设备", "orange")
 
+        self.prev_stats = None
+        self.refresh_stats()
+        self.refresh_held()
+        # 热插拔: 枚举和识别串口在监视线程中进行，结果通过 after 交回界面线程；
+        # 插入的 KVM 设备在未连接时自动连接 (守护进程自己处理)
+        self.hotplug = HotplugWatcher(DeviceDiscovery.default(), self.on_hotplug_thread)
+        self.unplugged = False
+        if not self.daemon:
+            self.hotplug.start()
+
     def set_status(self, text, color):
         self.lbl_status.config(text=text, foreground=color)
 
@@ -59,6 +89,10 @@ class KVMGuiApp:
         self.var_mirror_enable = tk.BooleanVar(value=False)
         chk_mirror = ttk.Checkbutton(top_frame, text="启用键盘鼠标镜像", variable=self.var_mirror_enable, command=self.on_toggle_mirror)
         chk_mirror.pack(side=tk.LEFT, padx=20)
+
+        # 指针锁定: 本机光标被拉回中心，位移不受屏幕边缘限制 (下次启动镜像时生效)
+        self.var_pointer_lock = tk.BooleanVar(value=False)
+        ttk.Checkbutton(top_frame, text="指针锁定", variable=self.var_pointer_lock).pack(side=tk.LEFT, padx=5)
         
         # 系统模式
         ttk.Label(top_frame, text="系统模式:").pack(side=tk.LEFT, padx=(20, 5))
@@ -67,26 +101,30 @@ class KVMGuiApp:
         r2 = ttk.Radiobutton(top_frame, text="Mac", variable=self.var_os_mode, value="MAC", command=self.on_change_mode)
         r1.pack(side=tk.LEFT, padx=5)
         r2.pack(side=tk.LEFT, padx=5)
+
+        # 绝对定位 (固件 v4.0+): 远端光标与本机光标位置一一对应，不会在屏幕边缘卡住或漂移
+        self.var_abs_mouse = tk.BooleanVar(value=False)
+        chk_abs = ttk.Checkbutton(top_frame, text="绝对定位", variable=self.var_abs_mouse, command=self.on_toggle_abs_mouse)
+        chk_abs.pack(side=tk.LEFT, padx=10)
+
+        # 平滑移动 (固件 v4.3+): 低样本率发送位移，固件按 1kHz 插值播放，远端光标轨迹更顺滑
+        self.var_smooth_mouse = tk.BooleanVar(value=False)
+        chk_smooth = ttk.Checkbutton(top_frame, text="平滑移动", variable=self.var_smooth_mouse, command=self.on_toggle_smooth_mouse)
+        chk_smooth.pack(side=tk.LEFT, padx=10)
+
+        # 目标机上当前按下的键 (卡键时一眼能看出来)
+        self.lbl_held = ttk.Label(top_frame, text="", foreground="gray")
+        self.lbl_held.pack(side=tk.LEFT, padx=10)
         
         # --- 快捷按键区域 ---
         deck_frame = ttk.LabelFrame(self.root, text="快捷控制", padding=10)
         deck_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
         
-        buttons = [
-            (0, 0, "复制 (Ctrl+C)", ['ctrl_l', 'c']),
-            (0, 1, "粘贴 (Ctrl+V)", ['ctrl_l', 'v']),
-            (0, 2, "全选 (Ctrl+A)", ['ctrl_l', 'a']),
-            (1, 0, "锁屏 (Win+L)", ['win', 'l']),
-            (1, 1, "桌面 (Win+D)", ['win', 'd']),
-            (1, 2, "任务 (Ctrl+Shift+Esc)", ['ctrl_l', 'shift_l', 'esc']),
-            (2, 0, "回车 Enter", ['enter']),
-            (2, 1, "退格 Backspace", ['backspace']),
-            (2, 2, "Tab键", ['tab']),
-        ]
-        
-        for r, c, text, keys in buttons:
-            btn = ttk.Button(deck_frame, text=text, 
-                           command=lambda k=keys: self.kvm.send_combo(k))
+        # 快捷键来自宏文件，在后台线程按预编译的时间表播放
+        for macro in kvm_macro.load_macros(MACRO_FILE):
+            r, c = macro.pos
+            btn = ttk.Button(deck_frame, text=macro.label,
+                           command=lambda m=macro: self.play_macro(m))
             btn.grid(row=r, column=c, padx=5, pady=5, sticky="nsew")
 
         # 文本框测试
@@ -102,28 +140,151 @@ class KVMGuiApp:
         
         for i in range(3): deck_frame.columnconfigure(i, weight=1)
 
+        # --- 实时统计 ---
+        stats_frame = ttk.LabelFrame(self.root, text="实时统计", padding=10)
+        stats_frame.pack(fill=tk.X, padx=10, pady=5)
+
+        self.var_stats = tk.BooleanVar(value=False)
+        chk_stats = ttk.Checkbutton(stats_frame, text="开启", variable=self.var_stats, command=self.on_toggle_stats)
+        chk_stats.pack(side=tk.LEFT, padx=5)
+
+        self.lbl_rates = ttk.Label(stats_frame, text="统计未开启", font=("Consolas", 9))
+        self.lbl_rates.pack(side=tk.LEFT, padx=10)
+
     # --- 逻辑 ---
+    def play_macro(self, macro):
+        if self.player is None:
+            self.kvm.play_macro(macro.name, MACRO_FILE, wait=False)  # 守护进程按顺序执行
+        else:
+            self.player.play(macro.for_client(self.kvm))
+
+    def daemon_lost(self, err):
+        """守护进程退出或连接断开: 界面保留，只显示状态"""
+        self.set_status(f"守护进程已断开: {err}", "red")
+
     def on_toggle_mirror(self):
         if self.var_mirror_enable.get():
-            self.kvm.start_mirroring()
+            self.kvm.start_mirroring(capture='recenter' if self.var_pointer_lock.get() else 'cursor')
         else:
             self.kvm.stop_mirroring()
 
     def on_change_mode(self):
         self.kvm.set_target_os(self.var_os_mode.get())
 
+    def on_toggle_abs_mouse(self):
+        self.var_smooth_mouse.set(False) # 两种模式互斥
+        mode = 'absolute' if self.var_abs_mouse.get() else 'relative'
+        if not self.kvm.set_mouse_mode(mode):
+            self.var_abs_mouse.set(False)
+            messagebox.showwarning("绝对定位", "固件不支持绝对定位，请更新到 v4.0 以上")
+
+    def on_toggle_smooth_mouse(self):
+        self.var_abs_mouse.set(False)
+        mode = 'smooth' if self.var_smooth_mouse.get() else 'relative'
+        if not self.kvm.set_mouse_mode(mode):
+            self.var_smooth_mouse.set(False)
+            messagebox.showwarning("平滑移动", "固件不支持平滑移动，请更新到 v4.3 以上")
+
     def on_send_text(self):
         txt = self.entry_text.get()
-        self.kvm.type_text(txt)
+        if self.daemon:
+            self.kvm.type_text(txt, wait=False)
+            return
+        if self.aio is None:
+            from kvm_async import AsyncArduinoKVMClient, KVMLoopThread
+            self.aio = KVMLoopThread(AsyncArduinoKVMClient(client=self.kvm)).start()
+        self.aio.submit(self.aio.kvm.type_text(txt))
+
+    def on_toggle_stats(self):
+        self.kvm.enable_stats(self.var_stats.get())
+        self.prev_stats = None
+        if not self.var_stats.get():
+            self.lbl_rates.config(text="统计未开启")
+
+    def refresh_stats(self):
+        """每秒刷新一次速率面板"""
+        try:
+            cur = self.kvm.stats()
+        except DaemonError as e:
+            cur = None
+            self.daemon_lost(e)
+        if cur is not None:
+            if self.prev_stats is not None:
+                r = kvm_stats.rates(self.prev_stats, cur)
+                w = cur["write_time"]
+                self.lbl_rates.config(text=f"{kvm_stats.format_rates(r)}\n"
+                                           f"write p50 {w['p50_ms']:.3f}ms  p99 {w['p99_ms']:.3f}ms  "
+                                           f"锁等待 p99 {cur['lock_wait']['p99_ms']:.3f}ms  "
+                                           f"队列 {cur['tx_queue_depth']}  串口异常 {cur['serial_errors']}")
+            self.prev_stats = cur
+        if self.unplugged and self.kvm.connected:
+            # 库的自动重连已经找回设备 (可能换了端口名)
+            self.unplugged = False
+            self.set_status(f"已连接: {self.kvm.port}", "green")
+            self.combo_ports.set(self.kvm.port)
+        self.root.after(1000, self.refresh_stats)
+
+    def refresh_held(self):
+        try:
+            state = self.kvm.held_state()
+        except DaemonError as e:
+            state = {"keys": [], "buttons": []}
+            self.daemon_lost(e)
+        held = state["keys"] + [f"鼠标{b}" for b in state["buttons"]]
+        self.lbl_held.config(text=f"按下: {' + '.join(held)}" if held else "")
+        self.root.after(200, self.refresh_held)
+
+    def in_ui(self, func, *args):
+        """从后台线程把回调交给界面线程 (窗口已关闭则丢弃)"""
+        try:
+            self.root.after(0, func, *args)
+        except (RuntimeError, tk.TclError):
+            pass
+
+    def on_hotplug_thread(self, added, removed):
+        """监视线程: 端口列表有变化"""
+        self.in_ui(self.on_hotplug, added, removed)
+
+    def on_hotplug(self, added, removed):
+        self.port_list = arduino_kvm_lib.ArduinoKVMClient.list_ports()  # 监视线程刚枚举过，命中缓存
+        self.combo_ports['values'] = self.port_list
+        if added and not self.kvm.connected and self.kvm.sup_thread is None:
+            # 未连接 (也不在自动重连中) 时才接管新插入的设备；握手可能要几百毫秒，不在界面线程中做
+            self.kvm.port = added[0]
+            self.set_status(f"正在连接: {self.kvm.port}", "orange")
+            threading.Thread(target=self.connect_added, name="kvm-gui-connect", daemon=True).start()
+        elif self.kvm.port in removed:
+            self.unplugged = True
+            self.set_status(f"设备已拔出: {self.kvm.port}", "orange")
+
+    def connect_added(self):
+        ok = self.kvm.connect()
+        self.in_ui(self.on_added_connected, ok)
+
+    def on_added_connected(self, ok):
+        if ok:
+            self.set_status(f"已连接: {self.kvm.port}", "green")
+            self.combo_ports.set(self.kvm.port)
+        else:
+            self.set_status(f"连接失败: {self.kvm.port}", "red")
 
     def on_refresh_ports(self):
-        self.port_list = arduino_kvm_lib.ArduinoKVMClient.list_ports()
+        self.port_list = arduino_kvm_lib.ArduinoKVMClient.list_ports(refresh=True)
         self.combo_ports['values'] = self.port_list
         if self.port_list:
             self.combo_ports.current(0)
             
     def on_connect(self):
         selected_port = self.combo_ports.get()
+        if self.daemon:
+            # 串口由守护进程管理，这里只重新连接守护进程
+            self.kvm.disconnect()
+            if self.kvm.connect():
+                self.set_status(f"守护进程: {self.kvm.port}", "green")
+            else:
+                self.set_status("守护进程连接失败", "red")
+                messagebox.showerror("连接失败", self.kvm.error_msg)
+            return
         if not selected_port:
             return
             
@@ -138,7 +299,14 @@ class KVMGuiApp:
              messagebox.showerror("连接失败", self.kvm.error_msg)
 
     def on_close(self):
-        self.kvm.stop_mirroring()
+        self.hotplug.stop()
+        if self.player: self.player.stop()
+        if self.aio: self.aio.stop()
+        try:
+            if not self.daemon or self.var_mirror_enable.get():
+                self.kvm.stop_mirroring() # 守护进程的镜像只在本窗口开启过时才停止
+        except DaemonError:
+            pass
         self.kvm.disconnect()
         self.root.destroy()
 
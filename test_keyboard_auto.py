@@ -2,7 +2,7 @@ import serial
 import time
 
 SERIAL_PORT = 'COM5'
-BAUD_RATE = 9600
+BAUD_RATE = 115200  # 固件上电速率
 
 def test_sequence():
     try:
@@ -2,7 +2,18 @@ import serial
 import time
 
 SERIAL_PORT = 'COM5'
-BAUD_RATE = 9600
+BAUD_RATE = 115200  # 固件上电速率
+# 可协商的更高速率 (与 kvm_baud.BAUD_CANDIDATES 一致)，用来检查模块本身能跑到多快
+FAST_RATES = [230400, 250000, 500000, 1000000, 2000000]
+
+def loopback_once(ser, test_str):
+    """发送一次并读回，返回收到的字符串 (None 表示没有收到)"""
+    ser.reset_input_buffer()
+    ser.write(test_str.encode('utf-8'))
+    time.sleep(0.5)
+    if ser.in_waiting > 0:
+        return ser.read(ser.in_waiting).decode('utf-8', errors='replace')
+    return None
 
 def echo_test():
     print(f"🔄 正在测试模块回环 (Loopback) - 端口: {SERIAL_PORT}")
@@ -15,13 +26,8 @@ def echo_test():
             test_str = "Hello World Loopback Test"
             print(f"📤 发送数据: {test_str}")
             
-            # 发送
-            ser.write(test_str.encode('utf-8'))
-            time.sleep(0.5)
-            
-            # 接收
-            if ser.in_waiting > 0:
-                received = ser.read(ser.in_waiting).decode('utf-8')
+            received = loopback_once(ser, test_str)
+            if received is not None:
                 print(f"📥 接收回显: {received}")
                 
                 if received == test_str:
@@ -29,15 +35,36 @@ def echo_test():
                     print("结论：既然模块没问题，问题一定出在和 Arduino 的连接上。")
                 else:
                     print("\n⚠️ 数据已接收但有误码。可能接触不良。")
+                    return
             else:
                 print("\n❌ 未接收到数据！")
                 print("可能原因：")
                 print("1. 短接没接好")
                 print("2. 模块驱动有问题")
                 print("3. 模块硬件损坏")
+                return
+
+            # 高速测试: 较长的数据 (覆盖全部可打印字符)，逐个速率检查模块能否无误码收发
+            print("\n⚡ 测试更高的速率 (速率协商的上限取决于模块):")
+            burst = "".join(chr(0x21 + i % 94) for i in range(512))
+            best = BAUD_RATE
+            for rate in FAST_RATES:
+                try:
+                    ser.baudrate = rate
+                except (serial.SerialException, ValueError) as e:
+                    print(f"  {rate:>8}: ❌ 驱动不支持 ({e})")
+                    continue
+                time.sleep(0.05)
+                received = loopback_once(ser, burst)
+                if received == burst:
+                    best = rate
+                    print(f"  {rate:>8}: ✅")
+                else:
+                    print(f"  {rate:>8}: ❌ {'无回显' if received is None else '有误码'}")
+            print(f"\n结论：模块最高可用速率 {best}")
 
     except Exception as e:
         print(f"❌ 无法打开串口: {e}")
 
 if __name__ == "__main__":
-    echo_test()
\ No newline at end of file
+    echo_test()
@@ -27,7 +27,7 @@ def main():
     # 2. 发送 COM5 指令 (可选，看是否叠加效果)
     try:
         print("🔌 尝试向 COM5 发送 'M' 指令...")
-        with serial.Serial('COM5', 9600, timeout=1) as ser:
+        with serial.Serial('COM5', 115200, timeout=1) as ser:
             ser.write(b'M')
     except Exception as e:
         print(f"⚠️ 无法连接串口 (不影响本地测试): {e}")